@@ -0,0 +1,183 @@
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+# Synthetic documents for the benchmarks. Everything is generated from a seed
+# with the standard library only, so the same size always gives the same bytes.
+
+SIZES = {
+	"small": {"docx": 4, "docx_toc": 4, "pptx": 4, "pdf": 4, "html": 4, "txt": 4, "sections": 6, "paragraphs": 4},
+	"medium": {"docx": 20, "docx_toc": 20, "pptx": 20, "pdf": 20, "html": 20, "txt": 20, "sections": 10, "paragraphs": 6},
+	"large": {"docx": 100, "docx_toc": 100, "pptx": 100, "pdf": 100, "html": 100, "txt": 100, "sections": 16, "paragraphs": 8},
+}
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "ten", "vo", "sul", "pre", "dan", "ix", "or", "bel", "cor", "fi", "nu", "sta", "gro", "pel", "tu", "zen"]
+COMMON = ["the", "and", "for", "with", "our", "each", "new", "this", "from", "more", "all", "product", "store", "price", "customer", "season", "menu", "order", "team", "launch"]
+TOPICS = ["Overview", "Pricing", "Ingredients", "Promotions", "Store Hours", "Delivery", "Allergens", "Loyalty Program", "Packaging", "Suppliers", "Training", "Returns", "Catering", "Nutrition", "Gift Cards", "Feedback"]
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+P = "http://schemas.openxmlformats.org/presentationml/2006/main"
+R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_RELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+
+class TextGenerator:
+	def __init__(self, seed = 0):
+		self.random = random.Random(seed)
+		self.vocabulary = COMMON + ["".join(self.random.choice(SYLLABLES) for _ in range(self.random.randint(2, 4))) for _ in range(400)]
+
+	def sentence(self, min_words = 6, max_words = 18):
+		words = [self.random.choice(self.vocabulary) for _ in range(self.random.randint(min_words, max_words))]
+		if self.random.random() < 0.2:
+			words.insert(self.random.randint(0, len(words)), f"SKU-{self.random.randint(1000, 9999)}")
+		return " ".join(words).capitalize() + "."
+
+	def paragraph(self, sentences = 4):
+		return " ".join(self.sentence() for _ in range(sentences))
+
+	def sections(self, count, paragraphs):
+		titles = []
+		for i in range(count):
+			title = TOPICS[i % len(TOPICS)]
+			if i >= len(TOPICS):
+				title = f"{title} {i // len(TOPICS) + 1}"
+			titles.append(title)
+		return [(title, [self.paragraph(self.random.randint(2, 5)) for _ in range(paragraphs)]) for title in titles]
+
+
+def docx_paragraph(text, style = None, size = None, bold = False):
+	ppr = f"<w:pPr><w:pStyle w:val=\"{style}\"/></w:pPr>" if style != None else ""
+	rpr = ""
+	if size != None or bold:
+		rpr = "<w:rPr>" + ("<w:b w:val=\"1\"/>" if bold else "") + (f"<w:sz w:val=\"{size}\"/>" if size != None else "") + "</w:rPr>"
+	return f"<w:p>{ppr}<w:r>{rpr}<w:t xml:space=\"preserve\">{escape(text)}</w:t></w:r></w:p>"
+
+
+def write_docx(path, sections, toc = False):
+	"""TOC documents use TOC1/Heading1 styles (the structured path in DocExtractorDOCX);
+	the others mark headings only by a larger bold run, like most hand-made documents."""
+	body = []
+	if toc:
+		body.append(docx_paragraph("Table of Contents", style = "TOCHeading"))
+		for title, _ in sections:
+			body.append(docx_paragraph(title, style = "TOC1"))
+	for title, paragraphs in sections:
+		if toc:
+			body.append(docx_paragraph(title, style = "Heading1"))
+		else:
+			body.append(docx_paragraph(title, size = 32, bold = True))
+		for text in paragraphs:
+			body.append(docx_paragraph(text, size = 22))
+	document = f"<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?><w:document xmlns:w=\"{W}\" xmlns:r=\"{R}\"><w:body>{''.join(body)}<w:sectPr/></w:body></w:document>"
+	with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+		z.writestr("[Content_Types].xml", "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Types xmlns=\"http://schemas.openxmlformats.org/package/2006/content-types\"><Default Extension=\"rels\" ContentType=\"application/vnd.openxmlformats-package.relationships+xml\"/><Default Extension=\"xml\" ContentType=\"application/xml\"/><Override PartName=\"/word/document.xml\" ContentType=\"application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml\"/></Types>")
+		z.writestr("_rels/.rels", f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Relationships xmlns=\"{PKG_RELS}\"><Relationship Id=\"rId1\" Type=\"http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument\" Target=\"word/document.xml\"/></Relationships>")
+		z.writestr("word/_rels/document.xml.rels", f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Relationships xmlns=\"{PKG_RELS}\"><Relationship Id=\"rId9\" Type=\"http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink\" Target=\"https://example.com\" TargetMode=\"External\"/></Relationships>")
+		z.writestr("word/document.xml", document)
+
+
+def write_pptx(path, sections):
+	"""A title slide, an agenda slide, then one slide per section. Only the parts the
+	extractor reads are written, so PowerPoint itself may refuse to open the file."""
+	slides = [["Synthetic Deck", "Benchmark corpus"], ["Agenda"] + [title for title, _ in sections]]
+	for title, paragraphs in sections:
+		slides.append([title] + paragraphs)
+	with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+		z.writestr("[Content_Types].xml", "<?xml version=\"1.0\" encoding=\"UTF-8\"?><Types xmlns=\"http://schemas.openxmlformats.org/package/2006/content-types\"><Default Extension=\"rels\" ContentType=\"application/vnd.openxmlformats-package.relationships+xml\"/><Default Extension=\"xml\" ContentType=\"application/xml\"/></Types>")
+		for i, lines in enumerate(slides):
+			paras = "".join(f"<a:p><a:r><a:t>{escape(line)}</a:t></a:r></a:p>" for line in lines)
+			z.writestr(f"ppt/slides/slide{i + 1}.xml", f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><p:sld xmlns:a=\"{A}\" xmlns:p=\"{P}\"><p:cSld><p:spTree><p:sp><p:txBody>{paras}</p:txBody></p:sp></p:spTree></p:cSld></p:sld>")
+
+
+def pdf_escape(text):
+	return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def wrap(text, width = 90):
+	lines = []
+	line = ""
+	for word in text.split():
+		if len(line) + len(word) + 1 > width:
+			lines.append(line)
+			line = word
+		else:
+			line = f"{line} {word}".strip()
+	if line:
+		lines.append(line)
+	return lines
+
+
+def write_pdf(path, sections, lines_per_page = 48):
+	lines = []
+	for title, paragraphs in sections:
+		lines.append(title.upper())
+		for text in paragraphs:
+			lines += wrap(text)
+		lines.append("")
+	pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+	objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+	kids = []
+	for page in pages:
+		stream = "BT /F1 10 Tf 14 TL 50 760 Td " + " ".join(f"({pdf_escape(line)}) Tj T*" for line in page) + " ET"
+		objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+		objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+		kids.append(f"{len(objects)} 0 R")
+	objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+	out = b"%PDF-1.4\n"
+	offsets = []
+	for i, obj in enumerate(objects):
+		offsets.append(len(out))
+		out += f"{i + 1} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+	xref = len(out)
+	out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+	for offset in offsets:
+		out += f"{offset:010d} 00000 n \n".encode()
+	out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+	with open(path, "wb") as fout:
+		fout.write(out)
+
+
+def write_html(path, sections):
+	body = ["<nav><a href=\"/\">Home</a> <a href=\"/menu\">Menu</a></nav>", "<script>var tracking = function(){ return 1; };</script>"]
+	for title, paragraphs in sections:
+		body.append(f"<h2>{escape(title)}</h2>")
+		body += [f"<p>{escape(text)}</p>" for text in paragraphs]
+		body.append("<aside>Related links</aside>")
+	body.append("<footer>Copyright</footer>")
+	with open(path, "w") as fout:
+		fout.write(f"<html><head><title>Synthetic page</title><style>p {{ margin: 0 }}</style></head><body>{''.join(body)}</body></html>")
+
+
+def write_txt(path, sections):
+	with open(path, "w") as fout:
+		for title, paragraphs in sections:
+			fout.write(f"{title}\n")
+			for text in paragraphs:
+				fout.write(f"{text}\n")
+			fout.write("\n")
+
+
+def generate_corpus(folder, size = "small", seed = 0):
+	"""Writes the corpus for a SIZES preset (or an equivalent dict) into folder and returns the file names."""
+	spec = SIZES[size] if isinstance(size, str) else size
+	if not os.path.exists(folder):
+		os.makedirs(folder)
+	gen = TextGenerator(seed)
+	writers = {
+		"docx": lambda path, sections: write_docx(path, sections, toc = False),
+		"docx_toc": lambda path, sections: write_docx(path, sections, toc = True),
+		"pptx": write_pptx,
+		"pdf": write_pdf,
+		"html": write_html,
+		"txt": write_txt,
+	}
+	files = []
+	for kind in writers:
+		ext = "docx" if kind == "docx_toc" else kind
+		for i in range(spec.get(kind, 0)):
+			fname = f"{kind}_{i:04d}.{ext}"
+			writers[kind](os.path.join(folder, fname), gen.sections(spec["sections"], spec["paragraphs"]))
+			files.append(fname)
+	return files
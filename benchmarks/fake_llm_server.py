@@ -0,0 +1,215 @@
+import json
+import time
+import random
+import asyncio
+import click
+
+from benchmarks.stand_ins import reply_text
+
+MAX_HEADER_BYTES = 64 * 1024
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 429: "Too Many Requests",
+	500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable", 504: "Gateway Timeout"}
+MODES = ["auto", "echo", "canned"]
+
+
+class FakeLLMServer:
+	"""Stand-in for the OpenAI and Ollama chat APIs, for load tests that should not cost money or need a GPU.
+
+	POST /v1/chat/completions answers like OpenAI (server-sent event chunks
+	ending with "data: [DONE]" when "stream" is true, one completion object
+	otherwise) and POST /api/chat like Ollama (NDJSON lines ending with
+	"done": true). The first token is sent after ttft seconds and the rest
+	at tokens_per_second. A fraction error_rate of requests fail with
+	error_status. mode "auto" answers like the benchmark stand-in LLM,
+	"echo" repeats the last message and "canned" always sends `response`.
+	"""
+
+	def __init__(self, ttft = 0.2, tokens_per_second = 50.0, error_rate = 0.0, error_status = 429, retry_after = 1, mode = "auto", response = None, seed = None):
+		if mode not in MODES:
+			raise Exception(f"{self.__class__}: Unknown mode \"{mode}\" (expected {', '.join(MODES)}).")
+		self.ttft = ttft
+		self.tokens_per_second = tokens_per_second
+		self.error_rate = error_rate
+		self.error_status = error_status
+		self.retry_after = retry_after
+		self.mode = mode
+		self.response = response or "This is a canned response from the fake LLM server."
+		self.random = random.Random(seed)
+		self.stats = {"requests": 0, "errors": 0, "tokens": 0, "active": 0}
+
+	def reply(self, messages):
+		if self.mode == "canned":
+			return self.response
+		if self.mode == "echo":
+			return messages[-1]["content"] if len(messages) > 0 else ""
+		return reply_text(messages)
+
+	def tokens(self, text):
+		words = text.split(" ")
+		return [w + " " for w in words[:-1]] + [words[-1]]
+
+	async def paced(self, tokens):
+		# yields each token at the moment a real model would have produced it
+		start = time.monotonic()
+		for i, token in enumerate(tokens):
+			due = start + self.ttft + (i / self.tokens_per_second if self.tokens_per_second > 0 else 0)
+			delay = due - time.monotonic()
+			if delay > 0:
+				await asyncio.sleep(delay)
+			self.stats["tokens"] += 1
+			yield token
+
+	async def read_request(self, reader):
+		head = await reader.readuntil(b"\r\n\r\n")
+		lines = head.decode("latin-1").split("\r\n")
+		method, path, _ = lines[0].split(" ", 2)
+		headers = {}
+		for line in lines[1:]:
+			if line.find(":") > -1:
+				k, v = line.split(":", 1)
+				headers[k.strip().lower()] = v.strip()
+		length = int(headers.get("content-length", 0))
+		body = await reader.readexactly(length) if length > 0 else b""
+		return method, path.split("?")[0], body
+
+	async def send_json(self, writer, status, payload, headers = None):
+		body = json.dumps(payload).encode()
+		extra = "".join(f"{k}: {v}\r\n" for k, v in (headers or {}).items())
+		writer.write((f"HTTP/1.1 {status} {REASONS.get(status, 'Error')}\r\n"
+			"Content-Type: application/json\r\n"
+			f"Content-Length: {len(body)}\r\n"
+			f"{extra}"
+			"Connection: close\r\n\r\n").encode() + body)
+		await writer.drain()
+
+	async def start_stream(self, writer, content_type):
+		writer.write((f"HTTP/1.1 200 OK\r\n"
+			f"Content-Type: {content_type}\r\n"
+			"Cache-Control: no-cache\r\n"
+			"Connection: close\r\n\r\n").encode())
+		await writer.drain()
+
+	async def openai_chat(self, writer, payload, messages):
+		model = payload.get("model", "fake")
+		created = int(time.time())
+		completion_id = f"chatcmpl-fake{self.stats['requests']}"
+		tokens = self.tokens(self.reply(messages))
+		if not payload.get("stream", False):
+			text = "".join([t async for t in self.paced(tokens)])
+			await self.send_json(writer, 200, {"id": completion_id, "object": "chat.completion", "created": created, "model": model,
+				"choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+				"usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)}})
+			return
+		await self.start_stream(writer, "text/event-stream")
+		def chunk(delta, finish_reason = None):
+			return "data: " + json.dumps({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+				"choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}) + "\n\n"
+		writer.write(chunk({"role": "assistant", "content": ""}).encode())
+		async for token in self.paced(tokens):
+			writer.write(chunk({"content": token}).encode())
+			await writer.drain()
+		writer.write((chunk({}, "stop") + "data: [DONE]\n\n").encode())
+		await writer.drain()
+
+	async def ollama_chat(self, writer, payload, messages):
+		model = payload.get("model", "fake")
+		tokens = self.tokens(self.reply(messages))
+		def line(data):
+			data.update({"model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())})
+			return json.dumps(data) + "\n"
+		if not payload.get("stream", True):
+			text = "".join([t async for t in self.paced(tokens)])
+			await self.send_json(writer, 200, json.loads(line({"message": {"role": "assistant", "content": text}, "done": True, "eval_count": len(tokens)})))
+			return
+		await self.start_stream(writer, "application/x-ndjson")
+		async for token in self.paced(tokens):
+			writer.write(line({"message": {"role": "assistant", "content": token}, "done": False}).encode())
+			await writer.drain()
+		writer.write(line({"message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop", "eval_count": len(tokens)}).encode())
+		await writer.drain()
+
+	async def handle_chat(self, writer, path, body):
+		try:
+			payload = json.loads(body or b"{}")
+			messages = payload["messages"]
+		except Exception:
+			await self.send_json(writer, 400, {"error": {"message": "expected a JSON body with \"messages\"", "type": "invalid_request_error"}})
+			return
+		self.stats["requests"] += 1
+		if self.error_rate > 0 and self.random.random() < self.error_rate:
+			self.stats["errors"] += 1
+			headers = {"Retry-After": str(self.retry_after)} if self.error_status in [429, 503] else None
+			await self.send_json(writer, self.error_status, {"error": {"message": "injected error", "type": "fake_error", "code": self.error_status}}, headers = headers)
+			return
+		self.stats["active"] += 1
+		try:
+			if path == "/api/chat":
+				await self.ollama_chat(writer, payload, messages)
+			else:
+				await self.openai_chat(writer, payload, messages)
+		finally:
+			self.stats["active"] -= 1
+
+	async def handle(self, reader, writer):
+		try:
+			method, path, body = await asyncio.wait_for(self.read_request(reader), timeout = 10)
+			if path == "/health":
+				await self.send_json(writer, 200, self.stats)
+			elif path in ["/v1/chat/completions", "/chat/completions", "/api/chat"]:
+				if method != "POST":
+					await self.send_json(writer, 405, {"error": "use POST"})
+				else:
+					await self.handle_chat(writer, path, body)
+			else:
+				await self.send_json(writer, 404, {"error": "not found"})
+		except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+			pass
+		finally:
+			try:
+				writer.close()
+				await writer.wait_closed()
+			except ConnectionError:
+				pass
+
+	async def run(self, host = "127.0.0.1", port = 11435, started = None):
+		server = await asyncio.start_server(self.handle, host, port, limit = MAX_HEADER_BYTES)
+		print(f"Fake LLM on http://{host}:{port} (OpenAI: OPENAI_BASE_URL=http://{host}:{port}/v1, Ollama: OLLAMA_HOST=http://{host}:{port}; ttft {self.ttft}s, {self.tokens_per_second} tokens/s, error rate {self.error_rate})")
+		if started != None:
+			started.set()
+		async with server:
+			await server.serve_forever()
+
+
+def start_in_thread(host = "127.0.0.1", port = 11435, **settings):
+	"""Starts a server on a daemon thread (for benchmarks) and returns it once it is listening."""
+	import threading
+	server = FakeLLMServer(**settings)
+	started = threading.Event()
+	threading.Thread(target = lambda: asyncio.run(server.run(host, port, started)), daemon = True).start()
+	if not started.wait(timeout = 10):
+		raise Exception(f"Fake LLM server did not start on {host}:{port}.")
+	return server
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=11435)
+@click.option("--ttft", default=0.2, help="Seconds before the first token")
+@click.option("--tokens_per_second", default=50.0, help="Token rate after the first token (0 for no delay)")
+@click.option("--error_rate", default=0.0, help="Fraction of requests that fail")
+@click.option("--error_status", default=429, help="HTTP status of failed requests")
+@click.option("--retry_after", default=1, help="Retry-After seconds sent with 429 and 503 errors")
+@click.option("--mode", default="auto", type=click.Choice(MODES))
+@click.option("--response", default=None, help="Reply text for --mode canned")
+@click.option("--seed", default=None, type=int, help="Seed for error injection")
+def main(**kwargs):
+	host = kwargs.pop("host")
+	port = kwargs.pop("port")
+	try:
+		asyncio.run(FakeLLMServer(**kwargs).run(host, port))
+	except KeyboardInterrupt:
+		pass
+
+
+if __name__=="__main__":
+	main()
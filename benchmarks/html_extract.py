@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import click
+
+from benchmarks.corpus import TextGenerator, write_html
+from utils import html_text
+
+# Times HTML text extraction on many pages: the BeautifulSoup extractor,
+# lxml in one process, and lxml across processes (build-docs folder mode).
+# Every page's lxml text must match BeautifulSoup's, or the run fails.
+
+
+def normalized(lines):
+	return [" ".join(line.split()) for line in lines if line.strip()]
+
+
+def timed(label, pages, run):
+	start = time.perf_counter()
+	results = run()
+	elapsed = time.perf_counter() - start
+	click.echo(f"{label:<22} {elapsed:>8.2f}s {len(pages) / elapsed:>9.1f} pages/s")
+	return results, elapsed
+
+
+@click.command()
+@click.option("--pages", default=400, help="Number of pages to extract")
+@click.option("--sample", default="sample_documents/sample.html", help="Page copied into the set (every other page is generated)")
+@click.option("--workers", default=None, type=int, help="Processes for the bulk run (default: all cores)")
+@click.option("--workdir", default=None, help="Keep the pages here instead of a temporary directory")
+@click.option("--seed", default=0)
+def main(**kwargs):
+	if not html_text.available():
+		click.echo("lxml is not installed (pip install lxml).")
+		sys.exit(2)
+	workdir = kwargs["workdir"] or tempfile.mkdtemp(prefix = "ragtime_html_")
+	try:
+		# half copies of the sample page, half generated pages with nav/script boilerplate
+		text = TextGenerator(seed = kwargs["seed"])
+		paths = []
+		for i in range(kwargs["pages"]):
+			path = os.path.join(workdir, f"page_{i:05d}.html")
+			if i % 2 == 0 and os.path.exists(kwargs["sample"]):
+				shutil.copyfile(kwargs["sample"], path)
+			else:
+				write_html(path, text.sections(8, 5))
+			paths.append(path)
+		size = sum(os.path.getsize(p) for p in paths)
+		click.echo(f"{len(paths)} pages, {size / 1024 / 1024:.1f} MB")
+
+		def read_all(extract):
+			lines = []
+			for path in paths:
+				with open(path, "rb") as fin:
+					lines.append(extract(fin.read()))
+			return lines
+
+		golden, bs4_s = timed("beautifulsoup", paths, lambda: read_all(html_text.bs4_lines))
+		serial, lxml_s = timed("lxml", paths, lambda: read_all(html_text.html_lines))
+		bulk, bulk_s = timed("lxml bulk", paths, lambda: [lines for _, lines in html_text.extract_paths(paths, workers = kwargs["workers"])])
+		click.echo(f"speedup: {bs4_s / lxml_s:.1f}x single process, {bs4_s / bulk_s:.1f}x bulk")
+
+		mismatches = [paths[i] for i in range(len(paths)) if normalized(golden[i]) != normalized(serial[i]) or normalized(golden[i]) != normalized(bulk[i])]
+		if len(mismatches) > 0:
+			click.echo(f"{len(mismatches)} page(s) extract differently, e.g. {mismatches[0]}")
+			sys.exit(1)
+		click.echo("text identical to beautifulsoup on every page")
+	finally:
+		if not kwargs["workdir"]:
+			shutil.rmtree(workdir, ignore_errors = True)
+
+
+if __name__=="__main__":
+	main()
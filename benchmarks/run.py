@@ -0,0 +1,178 @@
+import os
+import sys
+import json
+import time
+import queue
+import shutil
+import platform
+import tempfile
+import multiprocessing
+from datetime import datetime
+import click
+
+from benchmarks.corpus import SIZES, generate_corpus
+from benchmarks.stages import STAGES, run_stage
+
+METRICS = ["wall_s", "cpu_s", "peak_rss_mb"]
+DEFAULT_THRESHOLDS = {"wall_s": 0.20, "cpu_s": 0.20, "peak_rss_mb": 0.10}
+# differences below these are noise however large the ratio
+MIN_DELTA = {"wall_s": 0.05, "cpu_s": 0.05, "peak_rss_mb": 5}
+
+
+def measure(name, workdir, settings):
+	ctx = multiprocessing.get_context("spawn")
+	results = ctx.Queue()
+	proc = ctx.Process(target = run_stage, args = (name, workdir, settings, results))
+	proc.start()
+	start = time.perf_counter()
+	result = None
+	while result == None:
+		# checked before waiting, so a result put just before the process exited is still read
+		alive = proc.is_alive()
+		try:
+			result = results.get(timeout = 1)
+		except queue.Empty:
+			if not alive:
+				break
+	proc.join()
+	if result == None:
+		# killed (e.g. by the OOM killer), crashed or failed before run_stage could report
+		result = {
+			"stage": name,
+			"wall_s": time.perf_counter() - start,
+			"cpu_s": None,
+			"peak_rss_mb": None,
+			"counts": {},
+			"error": f"the stage process died without a result (exit code {proc.exitcode})",
+		}
+	return result
+
+
+def free_port():
+	import socket
+	with socket.socket() as sock:
+		sock.bind(("127.0.0.1", 0))
+		return sock.getsockname()[1]
+
+
+def compare(results, baseline, thresholds):
+	"""Returns (rows, regressions); a metric regresses when it grew by more than its threshold."""
+	rows = []
+	regressions = []
+	base_stages = {s["stage"]: s for s in baseline.get("stages", [])}
+	for stage in results["stages"]:
+		base = base_stages.get(stage["stage"])
+		if base == None:
+			continue
+		for metric in METRICS:
+			old = base.get(metric)
+			new = stage.get(metric)
+			if not old or new == None:
+				continue
+			change = (new - old) / old
+			regressed = change > thresholds[metric] and new - old > MIN_DELTA[metric]
+			rows.append((stage["stage"], metric, old, new, change, regressed))
+			if regressed:
+				regressions.append(f"{stage['stage']}.{metric}")
+	return rows, regressions
+
+
+@click.command()
+@click.option("--size", default="small", type=click.Choice(list(SIZES.keys())))
+@click.option("--stages", default=",".join(STAGES), help="Comma separated subset of " + ",".join(STAGES))
+@click.option("--workdir", default=None, help="Keep the corpus and index here instead of a temporary directory")
+@click.option("--output", default="benchmark_results.json")
+@click.option("--baseline", default=None, help="Results file to compare against")
+@click.option("--save_baseline", default=None, help="Also write these results to this file as the new baseline")
+@click.option("--threshold", default=None, type=float, help="Allowed relative growth for every metric (defaults: wall/cpu 0.20, rss 0.10)")
+@click.option("--queries", default=20)
+@click.option("--retrieval_mode", default="vector", type=click.Choice(["vector", "hybrid", "prefilter"]))
+@click.option("--seed", default=0)
+@click.option("--real_llm", default=False, is_flag = True, help="Call the configured LLM instead of the stand-in")
+@click.option("--metrics", default=False, is_flag = True, help="Include the per-stage metrics breakdown in the results")
+@click.option("--real_embeddings", default=False, is_flag = True, help="Use the sentence-transformers model instead of hashed embeddings")
+@click.option("--embedding_settings", default=None, help="JSON embedding_settings block for --real_embeddings, e.g. '{\"workers\": 16}'")
+@click.option("--llm_server", default=False, is_flag = True, help="Send LLM calls over HTTP to a local fake OpenAI/Ollama server")
+@click.option("--llm_ttft", default=0.2, help="Fake server seconds to first token")
+@click.option("--llm_tokens_per_second", default=50.0, help="Fake server token rate")
+@click.option("--llm_error_rate", default=0.0, help="Fraction of fake server requests that fail with 429")
+@click.option("--batch_size", default=None, type=int, help="indexing_settings batch_size for the index stage")
+def main(**kwargs):
+	stages = [s.strip() for s in kwargs["stages"].split(",") if s.strip()]
+	for s in stages:
+		if s not in STAGES:
+			click.echo(f"Unknown stage \"{s}\" (expected {', '.join(STAGES)}).")
+			sys.exit(2)
+	thresholds = dict(DEFAULT_THRESHOLDS)
+	if kwargs["threshold"] is not None:
+		thresholds = {m: kwargs["threshold"] for m in METRICS}
+	settings = {k: kwargs[k] for k in ["queries", "retrieval_mode", "real_llm", "real_embeddings", "metrics"]}
+	if kwargs["embedding_settings"]:
+		settings["embedding_settings"] = json.loads(kwargs["embedding_settings"])
+	if kwargs["llm_server"]:
+		from benchmarks.fake_llm_server import start_in_thread
+		port = free_port()
+		start_in_thread(port = port, ttft = kwargs["llm_ttft"], tokens_per_second = kwargs["llm_tokens_per_second"], error_rate = kwargs["llm_error_rate"])
+		# the spawned stage processes inherit these
+		os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+		os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{port}"
+		settings["llm_server"] = {"ttft": kwargs["llm_ttft"], "tokens_per_second": kwargs["llm_tokens_per_second"], "error_rate": kwargs["llm_error_rate"]}
+	if kwargs["batch_size"]:
+		settings["indexing_settings"] = {"batch_size": kwargs["batch_size"]}
+
+	workdir = kwargs["workdir"] or tempfile.mkdtemp(prefix = "ragtime_bench_")
+	corpus = os.path.join(workdir, "corpus")
+	if not os.path.exists(corpus):
+		files = generate_corpus(corpus, size = kwargs["size"], seed = kwargs["seed"])
+		click.echo(f"Generated {len(files)} {kwargs['size']} documents in {corpus}")
+
+	results = {
+		"created": datetime.now().isoformat(timespec = "seconds"),
+		"size": kwargs["size"],
+		"seed": kwargs["seed"],
+		"settings": settings,
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"cpus": os.cpu_count(),
+		"stages": [],
+	}
+	try:
+		for name in stages:
+			click.echo(f"Running {name}...")
+			result = measure(name, workdir, settings)
+			results["stages"].append(result)
+			if result["error"] != None:
+				click.echo(f"{name} failed: {result['error']}")
+				break
+			click.echo(f"  {result['wall_s']:.2f}s wall, {result['cpu_s']:.2f}s cpu, {result['peak_rss_mb']:.0f} MB peak  {json.dumps(result['counts'])}")
+	finally:
+		if not kwargs["workdir"]:
+			shutil.rmtree(workdir, ignore_errors = True)
+
+	with open(kwargs["output"], "w") as fout:
+		json.dump(results, fout, indent = 4)
+	click.echo(f"Wrote {kwargs['output']}")
+	if kwargs["save_baseline"]:
+		with open(kwargs["save_baseline"], "w") as fout:
+			json.dump(results, fout, indent = 4)
+		click.echo(f"Saved baseline {kwargs['save_baseline']}")
+
+	failed = any(r["error"] != None for r in results["stages"])
+	if kwargs["baseline"]:
+		with open(kwargs["baseline"], "r") as fin:
+			baseline = json.load(fin)
+		if baseline.get("size") != results["size"]:
+			click.echo(f"Warning: baseline is for size \"{baseline.get('size')}\", these results are \"{results['size']}\".")
+		rows, regressions = compare(results, baseline, thresholds)
+		click.echo(f"\n{'stage':<8} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+		for stage, metric, old, new, change, regressed in rows:
+			click.echo(f"{stage:<8} {metric:<12} {old:>10.2f} {new:>10.2f} {change:>+7.0%}{'  REGRESSION' if regressed else ''}")
+		if len(regressions) > 0:
+			click.echo(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+			failed = True
+	if failed:
+		sys.exit(1)
+
+
+if __name__=="__main__":
+	main()
@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import resource
+import warnings
+
+# Each stage reads what the previous one left in the work directory, so a
+# stage can run on its own in a fresh process and its peak RSS is its own.
+
+STAGES = ["extract", "chunk", "index", "query"]
+
+
+def peak_rss_mb():
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes on Linux, bytes on macOS
+	return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def extract(workdir, settings):
+	os.environ.setdefault("GSUITE_CREDS", "")
+	from utils.doc_extractor import DocExtractor
+	from main import parse_folder
+	de = DocExtractor()
+	doc_json, doc_sources = parse_folder(de, os.path.join(workdir, "corpus"), include_images = False)
+	with open(os.path.join(workdir, "extracted.json"), "w") as fout:
+		json.dump({"doc_json": doc_json, "doc_sources": doc_sources}, fout)
+	return {"sections": len(doc_json), "files": len(set(doc_sources.values()))}
+
+
+def chunk(workdir, settings):
+	from main import chunk_doc_json
+	with open(os.path.join(workdir, "extracted.json"), "r") as fin:
+		extracted = json.load(fin)
+	doc_data = chunk_doc_json(extracted["doc_json"], extracted["doc_sources"])
+	with open(os.path.join(workdir, "docs.json"), "w") as fout:
+		json.dump(doc_data, fout)
+	return {"chunks": len(doc_data)}
+
+
+def index(workdir, settings):
+	from llama_index.core import Document
+	from utils.index_sync import doc_text, doc_metadata
+	from utils.tafi_indexer import TafiIndexer
+	from benchmarks.stand_ins import fake_embed_model
+	with open(os.path.join(workdir, "docs.json"), "r") as fin:
+		docs = json.load(fin)
+	documents = []
+	for doc_id in docs:
+		metadata = doc_metadata(doc_id, docs[doc_id])
+		documents.append(Document(text = doc_text(docs[doc_id]), id_ = doc_id, extra_info = metadata, excluded_embed_metadata_keys = list(metadata.keys())))
+	ti = TafiIndexer(persist_dir = os.path.join(workdir, "index"), quantization = settings.get("quantization"), embedding_settings = settings.get("embedding_settings"), indexing_settings = settings.get("indexing_settings"))
+	if not settings.get("real_embeddings"):
+		ti.vector_store.loaded_embed_model = fake_embed_model()
+	start = time.perf_counter()
+	index = ti.index_from_docs(docs = documents, index_name = "bench")
+	nodes = len(index.docstore.docs)
+	return {"documents": len(documents), "nodes": nodes, "nodes_per_second": nodes / (time.perf_counter() - start)}
+
+
+def query(workdir, settings):
+	from utils.query_service import QueryService
+	from benchmarks.stand_ins import FakeLLM, fake_embed_model
+	with open(os.path.join(workdir, "docs.json"), "r") as fin:
+		docs = json.load(fin)
+	config = {
+		"vector_store_location": "local",
+		"local_settings": {"vector_store_folder": os.path.join(workdir, "index"), "index_name": "bench", "retrieval_mode": settings.get("retrieval_mode", "vector"), "quantization": settings.get("quantization")},
+	}
+	service = QueryService(config)
+	if not settings.get("real_embeddings"):
+		service.index.vector_store.loaded_embed_model = fake_embed_model()
+	service.warm_up()
+	# questions are the opening words of evenly spaced chunks, so every run asks the same ones
+	texts = [docs[k]["text"] for k in sorted(docs)]
+	step = max(1, len(texts) // settings.get("queries", 20))
+	questions = [" ".join(t.split("Content:")[-1].split()[:8]) for t in texts[::step]][:settings.get("queries", 20)]
+	# with --real_llm or --llm_server the configured LLMInvoker answers
+	llm = None if settings.get("real_llm") or settings.get("llm_server") else FakeLLM()
+	latencies = []
+	tokens = 0
+	for q in questions:
+		start = time.perf_counter()
+		for text in service.answer(q, llm = llm):
+			tokens += 1
+		latencies.append(time.perf_counter() - start)
+	latencies.sort()
+	return {
+		"queries": len(questions),
+		"tokens": tokens,
+		"latency_p50_s": latencies[len(latencies) // 2] if latencies else 0,
+		"latency_p95_s": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0,
+	}
+
+
+def run_stage(name, workdir, settings, results):
+	"""Target of a spawned process: runs one stage with the stand-ins installed and reports its cost."""
+	warnings.simplefilter("ignore")
+	if not settings.get("real_llm") and not settings.get("llm_server"):
+		from benchmarks.stand_ins import install_fake_llm
+		install_fake_llm()
+	if settings.get("metrics"):
+		from utils import metrics
+		metrics.enable()
+	stage = globals()[name]
+	start_cpu = time.process_time()
+	start = time.perf_counter()
+	try:
+		counts = stage(workdir, settings)
+		error = None
+	except Exception as e:
+		counts = {}
+		error = f"{e.__class__.__name__}: {e}"
+	result = {
+		"stage": name,
+		"wall_s": time.perf_counter() - start,
+		"cpu_s": time.process_time() - start_cpu,
+		"peak_rss_mb": peak_rss_mb(),
+		"counts": counts,
+		"error": error,
+	}
+	if settings.get("metrics"):
+		result["metrics"] = metrics.registry.to_dict()
+	results.put(result)
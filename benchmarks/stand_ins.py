@@ -0,0 +1,74 @@
+import json
+import re
+import time
+import hashlib
+import numpy as np
+
+# Network-free replacements for the LLM and the embedding model, so the
+# benchmarks measure our code and not a remote service or a model download.
+
+
+def reply_text(prompt):
+	"""The stand-in reply to a prompt string or chat message list: part names for json_from_list, otherwise a canned answer."""
+	text = prompt[-1]["content"] if isinstance(prompt, list) else prompt
+	if text.find("RECOMMENDED KEYS") > -1:
+		keys = re.findall(r"\"(part_[0-9]+)\"", text.split("INPUT JSON:")[-1])
+		return json.dumps({k: f"section {k.split('_')[1]}" for k in keys})
+	return f"Based on the provided information, here is what I found about {text}"
+
+
+class FakeLLM:
+	"""Drop-in for LLMInvoker: renames json_from_list parts and streams a canned answer."""
+
+	def __init__(self, model = None, *args, token_delay = 0.0, **kwargs):
+		self.model = model
+		self.token_delay = token_delay
+
+	def map(self, prompts, model = None, **settings):
+		from utils.llm_invoker import map_prompts
+		return map_prompts(lambda: FakeLLM(token_delay = self.token_delay), prompts, model = model, **settings)
+
+	def ask_llm(self, prompt, model = None, stream = True):
+		answer = reply_text(prompt)
+		if answer.startswith("{"):
+			yield answer
+			return
+		for token in answer.split(" "):
+			if self.token_delay > 0:
+				time.sleep(self.token_delay)
+			yield token + " "
+
+
+def install_fake_llm():
+	# DocExtractor and QueryService import LLMInvoker when they call it, so patching the module is enough
+	import utils.llm_invoker
+	utils.llm_invoker.LLMInvoker = FakeLLM
+
+
+def hash_embedding(text, dim = 384):
+	vec = np.zeros(dim, dtype = np.float32)
+	for token in re.findall(r"[a-z0-9]+", text.lower()):
+		h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size = 8).digest(), "little")
+		vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+	norm = np.linalg.norm(vec)
+	if norm > 0:
+		vec /= norm
+	return vec.tolist()
+
+
+def fake_embed_model(dim = 384):
+	"""A llama_index embedding that hashes tokens into dim buckets (same size as MiniLM)."""
+	from llama_index.core.embeddings import BaseEmbedding
+
+	class HashEmbedding(BaseEmbedding):
+		def _get_query_embedding(self, query):
+			return hash_embedding(query, dim)
+
+		async def _aget_query_embedding(self, query):
+			return hash_embedding(query, dim)
+
+		def _get_text_embedding(self, text):
+			return hash_embedding(text, dim)
+
+	from utils import metrics
+	return metrics.instrument_embed_model(HashEmbedding(model_name = "hash"))
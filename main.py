@@ -1,27 +1,55 @@
-from datetime import datetime
 import os
+import sys
+if os.environ.get("RAGTIME_IMPORT_REPORT"):
+	# installed before anything else is imported so the report covers click too
+	from utils import import_report
+	import_report.install()
+	import atexit
+	atexit.register(import_report.report)
 import json
 import click
-from unidecode import unidecode
-import psycopg2
-import warnings
-from pydantic import BaseModel
-from utils.llm_invoker import LLMInvoker
-import sys
 
 def get_db():
-	db = psycopg2.connect(
-		password=os.environ["DATABASE_PASS"],
-		user=os.environ["DATABASE_USER"], 
-		database=os.environ["DATABASE_DATABASE"], 
-		host=os.environ["DATABASE_HOST"],
-		connect_timeout=3)
-	db.autocommit = True
-	return db
+	# pooled; use as "with get_db() as db:"
+	from utils import pg_pool
+	return pg_pool.connection(autocommit = True)
 
 @click.group()
-def group():
-    pass
+@click.option("--import_report", default=False, is_flag = True, help="Print the slowest module imports on exit (set RAGTIME_IMPORT_REPORT=1 to include startup).")
+@click.option("--metrics", default=None, help="Record stage timings and counters and write them to this file on exit.")
+@click.option("--metrics_format", default=None, type=click.Choice(["json", "prometheus"]), help="Defaults to prometheus for .prom/.txt files, json otherwise.")
+@click.option("--profile", default=None, help="Profile the command and write the stats to this file; the hottest functions are printed on exit.")
+@click.option("--profile_mode", default="cprofile", type=click.Choice(["cprofile", "sample"]), help="cprofile (every call, pstats file) or sample (stacks of all threads every 5 ms, collapsed-stack file).")
+@click.option("--trace_malloc", default=None, help="Trace allocations and write the top allocation sites to this file.")
+@click.option("--profile_top", default=25, help="Functions and allocation sites to list.")
+@click.pass_context
+def group(ctx, **kwargs):
+	if kwargs["profile"] or kwargs["trace_malloc"]:
+		from utils import profiling
+		hooks = []
+		if kwargs["trace_malloc"]:
+			hooks.append(profiling.MallocTrace(kwargs["trace_malloc"], top = kwargs["profile_top"]))
+		if kwargs["profile"]:
+			hooks.append(profiling.Profile(kwargs["profile"], mode = kwargs["profile_mode"], top = kwargs["profile_top"]))
+		for hook in hooks:
+			hook.start()
+		def report():
+			# everything stops before any report is built, so neither sees the other's work
+			for hook in reversed(hooks):
+				hook.stop()
+			for hook in reversed(hooks):
+				click.echo(f"\nPROFILE {ctx.invoked_subcommand}: {hook.report()}", err = True)
+		ctx.call_on_close(report)
+	if kwargs["metrics"]:
+		from utils import metrics
+		metrics.enable()
+		ctx.call_on_close(lambda: metrics.export(kwargs["metrics"], kwargs["metrics_format"]))
+	if kwargs["import_report"]:
+		from utils import import_report
+		if import_report.installed == None:
+			import_report.install()
+			import atexit
+			atexit.register(import_report.report)
 
 def split_text(text, max_length=255):
   chunks = []
@@ -37,12 +65,87 @@ def split_text(text, max_length=255):
   return chunks
 
 
+def content_sections(content):
+	# a dict of sections, or ("part_N", lines) pairs streamed from a large text file
+	if content == None:
+		return []
+	return content.items() if isinstance(content, dict) else content
+
+def iter_sections(names, contents):
+	"""Yields (section name, text or lines, source) for every file's sections, with repeated names numbered."""
+	seen = set()
+	for f, content in zip(names, contents):
+		if content == None:
+			continue
+		for k, text in content_sections(content):
+			newk = k
+			counter = 1
+			if k=="UNCATEGORIZED":
+				continue
+			while newk in seen:
+				counter+=1
+				newk = f"{k}_{counter}"
+			if len(text) > 0:
+				seen.add(newk)
+				yield newk, text, f
+
+def collect_sections(names, contents):
+	doc_json = {}
+	doc_sources = {}
+	for k, text, f in iter_sections(names, contents):
+		doc_json[k] = text
+		doc_sources[k] = f
+	return doc_json, doc_sources
+
+def parse_folder(de, folder, include_images = True):
+	return collect_sections(*extract_folder(de, folder, include_images = include_images))
+
+def extract_folder(de, folder, include_images = True):
+	dirlist = [f for f in os.listdir(folder) if f.find("~")==-1]
+	contents = de.process_files([f"{folder}/{f}" for f in dirlist], include_images=include_images)
+	return dirlist, contents
+
+def chunk_sections(sections):
+	"""Yields (chunk id, record) for (section name, text or lines, source) triples, one section at a time."""
+	from unidecode import unidecode
+	from utils.index_sync import chunk_id
+	from utils import metrics
+	seen = set()
+	for key, doctext, source in sections:
+		if isinstance(doctext,list):
+			doctext = "\n".join(doctext)
+		if key.lower().find("table of contents")>-1:
+			continue
+		pretty_key = key.replace("_"," ").title()
+		if (len(doctext.strip())==0):
+			continue
+		with metrics.timer("chunk"):
+			if len(doctext)<=255:
+				text_array = [doctext]
+			else:
+				text_array = split_text(doctext)
+		for offset, t in enumerate(text_array):
+			content = f"Section: {pretty_key}\nContent: {t}"
+			with metrics.timer("normalize"):
+				content = unidecode(content, errors='replace', replace_str=u' ')
+			doc_id = chunk_id(content)
+			if doc_id in seen:
+				continue
+			seen.add(doc_id)
+			metrics.count("chunks")
+			yield doc_id, {"text":content, "source":source, "section":pretty_key, "offset":offset}
+
+def chunk_doc_json(doc_json, doc_sources):
+	return dict(chunk_sections((key, doc_json[key], doc_sources.get(key)) for key in doc_json))
+
+
 @click.command()
 @click.option('--include_images','-i', default=False, is_flag = True)
 @click.option('--force_overwrite','-f', default=False,is_flag = True)
 @click.option("--config", default="None", prompt = "Config file name")
 @click.option("--file", default="None", prompt = "Doc name (source of documents if it exists)")
 @click.option("--folder", default="None", prompt = "Document directory name")
+@click.option("--archive", default="None", help="zip or tar(.gz/.bz2/.xz) archive of documents, or - for a tar stream on stdin")
 def build_docs(**kwargs):
 	config = None
 	for k in kwargs:
@@ -52,16 +155,20 @@ def build_docs(**kwargs):
 	config_file = kwargs["config"]
 	file = kwargs["file"]
 	folder = kwargs["folder"]
+	archive = kwargs["archive"]
 	force_overwrite = kwargs["force_overwrite"]
-	if not config_file and not file and not folder:
-		click.echo("You must supply a config file and a doc source file or folder.")
+	if not config_file and not file and not folder and not archive:
+		click.echo("You must supply a config file and a doc source file, folder or archive.")
 		return
-	elif config_file and not (file or folder):
-		click.echo("You must supply a config file and a doc source file or folder.")
+	elif config_file and not (file or folder or archive):
+		click.echo("You must supply a config file and a doc source file, folder or archive.")
 		return
 	elif file and folder:
 		click.echo(f"Move {file} into {folder} and just provide the folder option.")
 		return
+	elif archive and (file or folder):
+		click.echo("Provide either an archive or a file/folder, not both.")
+		return
 	elif config_file:
 		if config_file.find(".json")==-1:
 			click.echo(f"Config files must be in JSON format.")
@@ -81,66 +188,88 @@ def build_docs(**kwargs):
 
 		click.echo("Loading doc extractor...")
 		from utils.doc_extractor import DocExtractor
-		from utils.llm_invoker import LLMInvoker
-		de = DocExtractor()
+		de = DocExtractor(llm_settings = config.get("llm_settings"), extract_settings = config.get("extract_settings"))
 		doc_file = config["content_settings"]["document_file"]
-		doc_json = {}
 		if file:
 			click.echo(f"Parsing \"{file}\" to \"{doc_file}\"...")
-			doc_json = de.process_file(file, include_images=include_images)
+			content = de.process_files([file], include_images=include_images)[0]
+			sections = ((k, text, os.path.basename(file)) for k, text in content_sections(content))
 		elif folder:
 			click.echo(f"Parsing files in \"{folder}\" to \"{doc_file}\"...")
-			dirlist = os.listdir("documents")
-			for f in dirlist:
-				print(f)
-				if f.find("~")==-1:
-					fname = f"{folder}/{f}"
-					content = de.process_file(fname, include_images=True)
-					if content == None:
-						continue
-					for k in content:
-						newk = k
-						counter = 1
-						if k=="UNCATEGORIZED":
-							continue
-						while newk in doc_json:
-							counter+=1
-							newk = f"{k}_{counter}"
-						if len(content[k]) > 0:
-							doc_json[newk] = content[k]
-		uuid=1
-		doc_data = {}
-		for key in doc_json:
-			if isinstance(doc_json[key],list):
-				doc_json[key] = "\n".join(doc_json[key])
-			if key.lower().find("table of contents")>-1:
-				continue
-			pretty_key = key.replace("_"," ").title()
-			if (len(doc_json[key].strip())==0):
-				continue
-			doctext = doc_json[key]
-			if len(doctext)<=255:
-				content = f"Section: {pretty_key}\nContent: {doc_json[key]}"
-				content = unidecode(content, errors='replace', replace_str=u' ')
-				doc_data[f"uuid_{uuid}"] = content
-				uuid+=1
-			else:
-				text_array = split_text(doctext)
-				for t in text_array:
-					content = f"Section: {pretty_key}\nContent: {t}"
-					content = unidecode(content, errors='replace', replace_str=u' ')
-					doc_data[f"uuid_{uuid}"] = content
-					uuid+=1
+			sections = iter_sections(*extract_folder(de, folder, include_images = True))
+		elif archive:
+			if archive != "-" and not os.path.exists(archive):
+				click.echo(f"Archive \"{archive}\" not found.")
+				return
+			click.echo(f"Parsing files in archive \"{archive}\" to \"{doc_file}\"...")
+			sections = iter_sections(*de.process_archive(archive, include_images = include_images))
+		# chunks stream from the extracted sections into the document file; dedup needs them all at once
+		doc_data = chunk_sections(sections)
 
+		if "dedup_settings" in config["content_settings"]:
+			doc_data = dedup_docs_data(dict(doc_data), config["content_settings"]["dedup_settings"])
+
+		from utils.corpus_store import save_docs
+		save_docs(doc_file, doc_data)
+		quarantine_file = de.write_quarantine()
+		if quarantine_file != None:
+			click.echo(f"Skipped {len(de.quarantined)} file(s) that could not be extracted; see \"{quarantine_file}\".")
+
+def dedup_docs_data(doc_data, dedup_settings, merge = False):
+	from utils.doc_dedup import MinHashDeduplicator, save_duplicates
+	from utils.index_sync import doc_text
+	dedup = MinHashDeduplicator.from_settings(dedup_settings)
+	kept, duplicates = dedup.dedup(doc_data, text_of = doc_text)
+	click.echo(f"Dropped {len(duplicates)} near-duplicate chunks of {len(doc_data)} (threshold {dedup.threshold}).")
+	duplicates_file = dedup_settings.get("duplicates_file", "duplicate_docs.json")
+	save_duplicates(duplicates_file, duplicates, merge = merge)
+	return kept
+
+@click.command()
+@click.option("--config", default="None", prompt = "Config file name")
+@click.option("--threshold", default=None, type=float)
+def dedup_docs(**kwargs):
+	config = None
+	for k in kwargs:
+		if kwargs[k]=="None":
+			kwargs[k] = None
+	config_file = kwargs["config"]
+	if not config_file:
+		click.echo("Please specify a config file name.")
+		return
+	try:
+		with open(config_file,"r") as fin:
+			config = json.load(fin)
+	except Exception as e:
+		click.echo(f"Error loading config file: {e}")
+		return
+	if "content_settings" not in config:
+		click.echo(f"No \"content_settings\" key found in config file.")
+		return
+	if "document_file" not in config["content_settings"]:
+		click.echo(f"No \"document_file\" key found in \"content_settings.")
+		return
+	doc_file = config["content_settings"]["document_file"]
+	dedup_settings = dict(config["content_settings"].get("dedup_settings", {}))
+	if kwargs["threshold"] is not None:
+		dedup_settings["threshold"] = kwargs["threshold"]
+	from utils.corpus_store import load_docs, save_docs
+	try:
+		docs = load_docs(doc_file)
+	except Exception as e:
+		click.echo(f"Error loading document file: {e}")
+		return
+	docs = dedup_docs_data(docs, dedup_settings, merge = True)
+	save_docs(doc_file, docs)
 
-		with open(doc_file,"w") as fout:
-			fout.write(json.dumps(doc_data,indent=4))
-			
 
 
 
 @click.command()
 @click.option("--config", default="None", prompt = "Config file name")
+@click.option("--incremental", default=False, is_flag = True)
+@click.option("--bulk_load", default=False, is_flag = True)
+@click.option("--resume", default=False, is_flag = True, help="Continue an interrupted build from its last checkpoint")
 def index_docs(**kwargs):
 	config = None
 	docs = None
@@ -148,6 +277,12 @@ def index_docs(**kwargs):
 		if kwargs[k]=="None":
 			kwargs[k] = None
 	config_file = kwargs["config"]
+	incremental = kwargs["incremental"]
+	bulk_load = kwargs["bulk_load"]
+	resume = kwargs["resume"]
+	if resume and (incremental or bulk_load):
+		click.echo("--resume only applies to full builds (not --incremental or --bulk_load).")
+		return
 	if not config_file:
 		click.echo("Please specify a config file name.")
 		return
@@ -179,7 +314,7 @@ def index_docs(**kwargs):
 		index_name = local_config["index_name"]
 	elif (vector_store_location=="database"):
 		use_environment_variables = input("Use database environment variables (Y/N)?")
-		if (use_environment_variables.lower()!="y"):
+		if (use_environment_variables.lower()=="y"):
 			use_environment_variables = True
 		else:
 			use_environment_variables = False
@@ -191,25 +326,16 @@ def index_docs(**kwargs):
 			click.echo("No \"content_table_name\" key in config[\"database_settings\"].")
 			return
 		content_table = data_config["content_table_name"]
-		if not use_environment_variables:
-			try:
-				host = data_config["database_host"]
-				os.environ["DATABASE_HOST"] = host
-				user = data_config["database_user"]
-				os.environ["DATABASE_USER"] = host
-				password = data_config["database_pass"]
-				os.environ["DATABASE_PASS"] = host
-				database = data_config["database_database"]
-				os.environ["DATABASE_DATABASE"] = host
-			except:
-				click.echo("Could not find database settings in config.")
-				return
+		from utils import pg_pool
+		try:
+			pg_pool.configure(data_config, use_environment_variables = use_environment_variables)
+		except KeyError:
+			click.echo("Could not find database settings in config.")
+			return
 
-	try:
-		with open(doc_file,"r") as fin:
-			docs = json.load(fin)
-	except Exception as e:
-		click.echo(f"Error loading config file: {e}")
+	from utils.corpus_store import iter_docs
+	if not os.path.exists(doc_file):
+		click.echo(f"Document file \"{doc_file}\" not found.")
 		return
 
 	formatted_content = []
@@ -231,125 +357,162 @@ def index_docs(**kwargs):
 			click.echo("Only one editor field can have the \"is_content\" flag set to \"true\".")
 			return
 		
-		for doc_id in docs:
-			content = docs[doc_id]
-			formatted_content.append({"id":doc_id,"text":content})
+		from utils.index_sync import doc_text, doc_metadata
+		metadata_fields = config["content_settings"].get("metadata_fields", {})
+		def formatted_docs():
+			# a corpus store is read a page at a time; a JSON document file has to be loaded whole
+			for doc_id, record in iter_docs(doc_file):
+				metadata = dict(metadata_fields)
+				metadata.update(doc_metadata(doc_id, record))
+				yield {"id":doc_id,"text":doc_text(record),"metadata":metadata}
+		formatted_content = formatted_docs()
 			
-	documents = []
 	from llama_index.core import Document
-	for doc in formatted_content:
-		text = doc["text"]
-		doc = Document(text = text, extra_info = {"id":doc["id"]})
-		documents.append(doc)
+	# built lazily so the indexers only hold one batch of Documents at a time
+	documents = (Document(text = doc["text"], id_ = doc["id"], extra_info = doc["metadata"], excluded_embed_metadata_keys = list(doc["metadata"].keys())) for doc in formatted_content)
+	indexing_settings = config.get("indexing_settings")
 
 	if vector_store_location=="database":
 		from utils.pgvector_helper import PGVectorHelper
-		pgindex = PGVectorHelper()
-		pgindex.build_index_from_docs(documents,content_table)
+		pgindex = PGVectorHelper(embedding_settings = config.get("embedding_settings"), indexing_settings = indexing_settings)
+		if incremental:
+			pgindex.sync_index_from_docs(documents,content_table)
+		elif bulk_load:
+			bulk_settings = dict(data_config.get("bulk_load", {}))
+			bulk_settings.setdefault("quantization", data_config.get("quantization"))
+			if indexing_settings and "batch_size" in indexing_settings:
+				bulk_settings.setdefault("batch_size", indexing_settings["batch_size"])
+			pgindex.bulk_load_from_docs(documents,content_table,settings = bulk_settings)
+		else:
+			pgindex.build_index_from_docs(documents,content_table,resume = resume)
 	else:
-		from utils.tafi_indexer import TafiIndexer
-		ti = TafiIndexer(persist_dir = vector_store_directory)
-		ti.index_from_docs(docs = documents,index_name = index_name)
+		if "shards" in local_config:
+			from utils.sharded_index import ShardedIndexer
+			ti = ShardedIndexer(persist_dir = vector_store_directory, shard_settings = local_config["shards"], quantization = local_config.get("quantization"), embedding_settings = config.get("embedding_settings"), indexing_settings = indexing_settings)
+		else:
+			from utils.tafi_indexer import TafiIndexer
+			ti = TafiIndexer(persist_dir = vector_store_directory, quantization = local_config.get("quantization"), embedding_settings = config.get("embedding_settings"), indexing_settings = indexing_settings)
+		if incremental:
+			ti.sync_from_docs(docs = documents,index_name = index_name)
+		else:
+			ti.index_from_docs(docs = documents,index_name = index_name,resume = resume)
 
-@click.command()
-@click.option("--config", default="None", prompt = "Config file name")
-def query(**kwargs):
-	config = None
-	docs = None
-	for k in kwargs:
-		if kwargs[k]=="None":
-			kwargs[k] = None
-	config_file = kwargs["config"]
+def load_query_config(config_file, use_environment_variables = None):
 	if not config_file:
 		click.echo("Please specify a config file name.")
-		return
+		return None
 	try:
 		with open(config_file,"r") as fin:
 			config = json.load(fin)
 	except Exception as e:
 		click.echo(f"Error loading config file: {e}")
-		return
+		return None
 	if "vector_store_location" not in config:
 		click.echo("No \"vector_store_location\" key in config (value must be either \"database\" or \"local\"")
-		return
+		return None
 	vector_store_location = config["vector_store_location"]
 	if (vector_store_location=="local"):
 		if "local_settings" not in config:
 			click.echo("No \"local_settings\" key in config.")
-			return
-		local_config = config["local_settings"]
-		vector_store_directory = local_config["vector_store_folder"]
-		index_name = local_config["index_name"]
+			return None
 	elif (vector_store_location=="database"):
-		use_environment_variables = input("Use database environment variables (Y/N)?")
-		if (use_environment_variables.lower()!="y"):
-			use_environment_variables = True
-		else:
-			use_environment_variables = False
+		if use_environment_variables == None:
+			use_environment_variables = input("Use database environment variables (Y/N)?")
+			if (use_environment_variables.lower()=="y"):
+				use_environment_variables = True
+			else:
+				use_environment_variables = False
 		if "database_settings" not in config:
 			click.echo("No \"database_settings\" key in config.")
-			return
+			return None
 		data_config = config["database_settings"]
 		if "content_table_name" not in data_config:
 			click.echo("No \"content_table_name\" key in config[\"database_settings\"].")
-			return
-		content_table = data_config["content_table_name"]
-		if not use_environment_variables:
-			try:
-				host = data_config["database_host"]
-				os.environ["DATABASE_HOST"] = host
-				user = data_config["database_user"]
-				os.environ["DATABASE_USER"] = host
-				password = data_config["database_pass"]
-				os.environ["DATABASE_PASS"] = host
-				database = data_config["database_database"]
-				os.environ["DATABASE_DATABASE"] = host
-			except:
-				click.echo("Could not find database settings in config.")
-				return
+			return None
+		from utils import pg_pool
+		try:
+			pg_pool.configure(data_config, use_environment_variables = use_environment_variables)
+		except KeyError:
+			click.echo("Could not find database settings in config.")
+			return None
+	return config
 
-	if vector_store_location=="database":
-		from utils.pgvector_helper import PGVectorHelper
-		index = PGVectorHelper()
-	else:
-		warnings.simplefilter("ignore")
-		from utils.tafi_indexer import TafiIndexer
-		index = TafiIndexer(persist_dir = vector_store_directory)
+@click.command()
+@click.option("--config", default="None", prompt = "Config file name")
+@click.option("--filter", "filters", multiple = True, help = "Restrict retrieval to chunks with metadata field=value (repeatable)")
+@click.option("--table", default=None, help = "Table (or local index) to query, one of the configured ones; defaults to the configured table")
+def query(**kwargs):
+	for k in kwargs:
+		if kwargs[k]=="None":
+			kwargs[k] = None
+	from utils.metadata_index import parse_filters
+	try:
+		filters = parse_filters(kwargs["filters"])
+	except Exception as e:
+		click.echo(f"{e}")
+		return
+	config = load_query_config(kwargs["config"])
+	if config == None:
+		return
+
+	from utils.query_service import QueryService
+	service = QueryService(config)
+	try:
+		table = service.table_name(kwargs["table"])
+	except Exception as e:
+		click.echo(f"{e}")
+		return
+	click.echo(f"Loading {len(service.warm_tables)} index(es)...")
+	service.warm_up()
 
-	llm = LLMInvoker()
 	while(True):
 		q = input("] ")
 		if q=="quit":
 			print("\nGoodbye!\n")
 			sys.exit(1)
-		if vector_store_location == "database":
-			warnings.simplefilter("ignore")
-			response = pgindex.query_index(content_table, q)
-		else:
-			warnings.simplefilter("ignore")
-			response = index.query(index_name = index_name, query_string = q)
-		query_results = [r.text for r in response]
-		system = None
-		if "prompt_settings" in config:
-			if "system_prompt_template" in config["prompt_settings"]:
-				with open(config["prompt_settings"]["system_prompt_template"],"r") as fin:
-					system = fin.read()
-					system = system.format(query_results = query_results)
-		else:
-			system = f"""You are a helpful assistant with access to this information: 
-{ptext}
-When responding from user queries YOU MUST RESTRICT YOUR RESPONSE the provided information.
-"""
 		print("")
-		user = q
-		prompt = [{"role":"system","content":system},{"role":"user","content":user}]
-		for text in llm.ask_llm(prompt):
+		for text in service.answer(q, filters = filters, table = table):
 			print(text, end="", flush = True)
 		print("")
 		print("")
+
+@click.command()
+@click.option("--config", default="None", prompt = "Config file name")
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8000, type=int)
+@click.option("--max_concurrency", default=None, type=int)
+@click.option("--queue_size", default=None, type=int)
+@click.option("--timeout", default=None, type=float, help = "Per-request timeout in seconds")
+@click.option("--use_env", default=False, is_flag = True, help = "Take database credentials from environment variables without prompting")
+def serve(**kwargs):
+	for k in kwargs:
+		if kwargs[k]=="None":
+			kwargs[k] = None
+	config = load_query_config(kwargs["config"], use_environment_variables = True if kwargs["use_env"] else None)
+	if config == None:
+		return
+	server_settings = config.get("server_settings", {})
+	for k, default in [("max_concurrency", 8), ("queue_size", 32), ("timeout", 120)]:
+		if kwargs[k] == None:
+			kwargs[k] = server_settings.get(k, default)
+
+	import asyncio
+	from utils.query_service import QueryService
+	from utils.query_server import QueryServer
+	service = QueryService(config)
+	click.echo(f"Loading {len(service.warm_tables)} index(es)...")
+	service.warm_up()
+	server = QueryServer(service, max_concurrency = kwargs["max_concurrency"], queue_size = kwargs["queue_size"], request_timeout = kwargs["timeout"])
+	try:
+		asyncio.run(server.run(host = kwargs["host"], port = kwargs["port"]))
+	except KeyboardInterrupt:
+		print("\nGoodbye!\n")
+
 group.add_command(build_docs)
+group.add_command(dedup_docs)
 group.add_command(index_docs)
 group.add_command(query)
+group.add_command(serve)
 
 if __name__=="__main__":
 	group()
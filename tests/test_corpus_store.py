@@ -0,0 +1,91 @@
+import json
+import sqlite3
+import pytest
+from utils.corpus_store import CorpusStore, load_docs, save_docs
+
+
+def corpus():
+	# records shaped like chunk_sections' output, plus the older shapes a document file can hold
+	docs = {}
+	for n in range(5):
+		for offset in range(3):
+			docs[f"chunk_{n}_{offset}"] = {"text": f"Section: Part {n}\nContent: text {n}.{offset}", "source": f"file_{n % 2}.pdf", "section": f"Part {n}", "offset": offset}
+	docs["chunk_plain"] = "no section label, just text"
+	docs["chunk_label_only"] = {"text": "Section: Odd\nnot followed by content", "source": "file_0.pdf"}
+	docs["chunk_extra"] = {"text": "Section: Part 1\nContent: with extras", "section": "Part 1", "brand": "acme", "tags": ["a", "b"]}
+	docs["chunk_none"] = {"text": "Section: Untitled\nContent: no section name", "section": None}
+	return docs
+
+
+def expected(record):
+	# a bare string reads back as {"text": ...}, and None fields are not stored
+	if not isinstance(record, dict):
+		return {"text": record}
+	return {k: v for k, v in record.items() if v is not None}
+
+
+def test_replace_round_trip(tmp_path):
+	path = str(tmp_path / "corpus.db")
+	docs = corpus()
+	with CorpusStore(path) as store:
+		store.replace(docs)
+		assert list(store.items(batch_size = 4)) == [(doc_id, expected(docs[doc_id])) for doc_id in docs]
+		assert store.get(["chunk_3_1", "chunk_extra", "missing"]) == {"chunk_3_1": expected(docs["chunk_3_1"]), "chunk_extra": expected(docs["chunk_extra"])}
+		# replacing again drops what the new corpus does not have
+		store.replace(iter([("chunk_plain", docs["chunk_plain"])]), batch_size = 1)
+		assert list(store.items()) == [("chunk_plain", {"text": docs["chunk_plain"]})]
+	assert load_docs(path) == {"chunk_plain": {"text": docs["chunk_plain"]}}
+
+
+def test_section_prefix_is_stored_once(tmp_path):
+	path = str(tmp_path / "corpus.db")
+	docs = corpus()
+	save_docs(path, docs)
+	db = sqlite3.connect(path)
+	prefixes = [r[0] for r in db.execute("SELECT prefix FROM sections WHERE name = 'Part 1'")]
+	assert prefixes == ["Section: Part 1\nContent: "]
+	bodies = dict(db.execute("SELECT id, body FROM chunks"))
+	assert bodies["chunk_1_2"] == "text 1.2"
+	# no "Content: " label, so nothing is split off
+	assert bodies["chunk_label_only"] == docs["chunk_label_only"]["text"]
+	db.close()
+	with CorpusStore(path) as store:
+		assert store.get(["chunk_1_2", "chunk_label_only"]) == {"chunk_1_2": docs["chunk_1_2"], "chunk_label_only": docs["chunk_label_only"]}
+
+
+def test_json_and_store_read_back_the_same(tmp_path):
+	docs = corpus()
+	save_docs(str(tmp_path / "corpus.json"), docs)
+	save_docs(str(tmp_path / "corpus.db"), docs)
+	from_json = load_docs(str(tmp_path / "corpus.json"))
+	assert from_json == json.loads(json.dumps(docs))
+	assert load_docs(str(tmp_path / "corpus.db")) == {doc_id: expected(from_json[doc_id]) for doc_id in from_json}
+
+
+def test_readers_see_the_old_corpus_while_it_is_replaced(tmp_path):
+	path = str(tmp_path / "corpus.db")
+	old = {"old_chunk": {"text": "Section: Old\nContent: still here", "section": "Old"}}
+	save_docs(path, old)
+	seen = []
+	def stream():
+		for n in range(10):
+			if n == 5:
+				# WAL: another connection reads the last committed corpus while this transaction is open
+				with CorpusStore(path) as reader:
+					seen.append(list(reader.items()))
+			yield f"new_{n}", {"text": f"new {n}"}
+	with CorpusStore(path) as store:
+		store.replace(stream(), batch_size = 2)
+	assert seen == [list(old.items())]
+	assert [doc_id for doc_id, _ in load_docs(path).items()] == [f"new_{n}" for n in range(10)]
+
+
+def test_failed_replace_keeps_the_old_corpus(tmp_path):
+	path = str(tmp_path / "corpus.db")
+	save_docs(path, {"kept": "kept text"})
+	def stream():
+		yield "new_0", "new text"
+		raise RuntimeError("extraction failed")
+	with pytest.raises(RuntimeError):
+		save_docs(path, stream())
+	assert load_docs(path) == {"kept": {"text": "kept text"}}
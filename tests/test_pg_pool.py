@@ -0,0 +1,77 @@
+import os
+import threading
+import pytest
+from utils import pg_pool
+
+# Runs against the Postgres in DATABASE_* (or PG_DB_*), e.g.
+# PG_DB_HOST=localhost PG_DB_USER=postgres PG_DB_PASS=postgres PG_DB_DBASE=postgres python -m pytest tests/test_pg_pool.py
+pytestmark = pytest.mark.skipif(os.environ.get("DATABASE_HOST", os.environ.get("PG_DB_HOST")) == None,
+	reason = "no Postgres configured (set PG_DB_HOST, PG_DB_USER, PG_DB_PASS and PG_DB_DBASE)")
+
+
+@pytest.fixture
+def pool():
+	psycopg2 = pytest.importorskip("psycopg2")
+	pg_pool.close_all()
+	pg_pool.configure({"pool": {"pool_size": 1, "max_size": 2, "acquire_timeout": 1, "statement_timeout_ms": 500, "recycle_seconds": 0}})
+	yield pg_pool
+	pg_pool.close_all()
+
+
+def backend_pid(conn):
+	with conn.cursor() as cur:
+		cur.execute("SELECT pg_backend_pid()")
+		return cur.fetchone()[0]
+
+
+def test_vector_stores_share_one_engine(pool):
+	pytest.importorskip("llama_index.vector_stores.postgres")
+	a = pool.get_vector_store("pg_pool_test_a")
+	b = pool.get_vector_store("pg_pool_test_b")
+	assert pool.get_vector_store("pg_pool_test_a") is a
+	assert a._engine is pool.get_engine()
+	assert b._engine is pool.get_engine()
+
+
+def test_statement_timeout(pool):
+	import psycopg2
+	with pool.connection() as conn, conn.cursor() as cur:
+		cur.execute("SELECT current_setting('statement_timeout')")
+		assert cur.fetchone()[0] == "500ms"
+	with pytest.raises(psycopg2.errors.QueryCanceled):
+		with pool.connection() as conn, conn.cursor() as cur:
+			cur.execute("SELECT pg_sleep(2)")
+	# the cancelled transaction was rolled back on return, so the connection is reusable
+	with pool.connection() as conn, conn.cursor() as cur:
+		cur.execute("SELECT 1")
+		assert cur.fetchone()[0] == 1
+
+
+def test_checkout_and_return(pool):
+	with pool.connection(autocommit = True) as conn:
+		first = backend_pid(conn)
+	with pool.connection() as conn:
+		# the same backend, handed back without the previous borrower's autocommit
+		assert backend_pid(conn) == first
+		assert not conn.autocommit
+	held = threading.Event()
+	done = threading.Event()
+	def hold():
+		with pool.connection():
+			held.set()
+			done.wait(5)
+	t = threading.Thread(target = hold)
+	t.start()
+	held.wait(5)
+	try:
+		with pool.connection():
+			# max_size is 2: a third borrower waits acquire_timeout and gives up
+			with pytest.raises(Exception, match = "timed out waiting for a free connection"):
+				with pool.connection():
+					pass
+	finally:
+		done.set()
+		t.join()
+	with pool.connection() as conn:
+		backend_pid(conn)
+	assert pool.get_engine().pool.checkedout() == 0
@@ -0,0 +1,23 @@
+from utils import text_stream
+
+
+def stray_byte_file(tmp_path):
+	# valid UTF-8 past the detection sample, then one Windows-1252 byte mid-file
+	data = ("a" * 100 + "\n").encode() * 2000 + "café €\n".encode() + b"stray \xe9 byte\n" + "après ✓\n".encode()
+	path = tmp_path / "stray.txt"
+	path.write_bytes(data)
+	return path, data
+
+
+def test_iter_lines_keeps_utf8_around_a_stray_byte(tmp_path):
+	path, _ = stray_byte_file(tmp_path)
+	# block sizes that put the stray byte mid-block and split multi-byte characters across blocks
+	for block_size in [7, 4096, text_stream.BLOCK_SIZE]:
+		lines = list(text_stream.iter_lines(str(path), block_size = block_size))
+		assert lines[-3:] == ["café €", "stray é byte", "après ✓"]
+		assert lines[0] == "a" * 100
+
+
+def test_decode_keeps_utf8_around_a_stray_byte(tmp_path):
+	_, data = stray_byte_file(tmp_path)
+	assert text_stream.decode(data).split("\n")[-4:] == ["café €", "stray é byte", "après ✓", ""]
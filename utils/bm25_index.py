@@ -0,0 +1,135 @@
+import json
+import math
+import os
+import re
+import numpy as np
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+SPLIT_RE = re.compile(r"[-_./]")
+
+
+def tokenize(text):
+	# Keeps joined tokens like "ab-1234" or "v2.1" whole (product names, SKUs)
+	# and also indexes their parts, so "ab 1234" still matches.
+	tokens = []
+	for token in TOKEN_RE.findall(text.lower()):
+		tokens.append(token)
+		if SPLIT_RE.search(token):
+			tokens += [p for p in SPLIT_RE.split(token) if len(p) > 0]
+	return tokens
+
+
+class BM25Index:
+	"""Okapi BM25 over a fixed set of nodes.
+
+	Postings are three flat arrays (offsets into doc positions and term
+	frequencies, sorted by term) so they can be saved with np.save and
+	memory-mapped on load instead of parsed.
+	"""
+
+	def __init__(self, node_ids, vocab, offsets, postings_docs, postings_tf, doc_len, k1 = 1.2, b = 0.75):
+		self.node_ids = node_ids
+		self.vocab = vocab
+		self.offsets = offsets
+		self.postings_docs = postings_docs
+		self.postings_tf = postings_tf
+		self.doc_len = doc_len
+		self.k1 = k1
+		self.b = b
+		self.avgdl = float(doc_len.mean()) if len(doc_len) > 0 else 0.0
+		self.positions = None
+
+	@classmethod
+	def build(cls, node_ids, texts, k1 = 1.2, b = 0.75):
+		postings = {}
+		doc_len = np.zeros(len(node_ids), dtype = np.float32)
+		for pos, text in enumerate(texts):
+			tokens = tokenize(text)
+			doc_len[pos] = len(tokens)
+			counts = {}
+			for token in tokens:
+				counts[token] = counts.get(token, 0) + 1
+			for token in counts:
+				postings.setdefault(token, []).append((pos, counts[token]))
+		terms = sorted(postings)
+		vocab = {term: i for i, term in enumerate(terms)}
+		offsets = np.zeros(len(terms) + 1, dtype = np.int64)
+		for i, term in enumerate(terms):
+			offsets[i + 1] = offsets[i] + len(postings[term])
+		postings_docs = np.empty(offsets[-1], dtype = np.int32)
+		postings_tf = np.empty(offsets[-1], dtype = np.float32)
+		for i, term in enumerate(terms):
+			plist = postings[term]
+			postings_docs[offsets[i]:offsets[i + 1]] = [p[0] for p in plist]
+			postings_tf[offsets[i]:offsets[i + 1]] = [p[1] for p in plist]
+		return cls(list(node_ids), vocab, offsets, postings_docs, postings_tf, doc_len, k1 = k1, b = b)
+
+	@classmethod
+	def from_index(cls, index, k1 = 1.2, b = 0.75):
+		docs = index.docstore.docs
+		node_ids = list(docs.keys())
+		return cls.build(node_ids, [docs[n].get_content() for n in node_ids], k1 = k1, b = b)
+
+	def save(self, folder):
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+		np.save(os.path.join(folder, "offsets.npy"), self.offsets)
+		np.save(os.path.join(folder, "postings_docs.npy"), self.postings_docs)
+		np.save(os.path.join(folder, "postings_tf.npy"), self.postings_tf)
+		np.save(os.path.join(folder, "doc_len.npy"), self.doc_len)
+		with open(os.path.join(folder, "bm25.json"), "w") as fout:
+			json.dump({"k1": self.k1, "b": self.b, "node_ids": self.node_ids, "terms": sorted(self.vocab, key = self.vocab.get)}, fout)
+
+	@classmethod
+	def load(cls, folder):
+		with open(os.path.join(folder, "bm25.json"), "r") as fin:
+			meta = json.load(fin)
+		load = lambda name: np.load(os.path.join(folder, name), mmap_mode = "r")
+		return cls(
+			meta["node_ids"],
+			{term: i for i, term in enumerate(meta["terms"])},
+			load("offsets.npy"),
+			load("postings_docs.npy"),
+			load("postings_tf.npy"),
+			load("doc_len.npy"),
+			k1 = meta["k1"],
+			b = meta["b"]
+		)
+
+	def scores(self, query):
+		n = len(self.node_ids)
+		scores = np.zeros(n, dtype = np.float32)
+		for term in set(tokenize(query)):
+			i = self.vocab.get(term)
+			if i == None:
+				continue
+			start, end = self.offsets[i], self.offsets[i + 1]
+			docs = self.postings_docs[start:end]
+			tf = self.postings_tf[start:end]
+			df = end - start
+			idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+			norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avgdl)
+			scores[docs] += idf * tf * (self.k1 + 1) / (tf + norm)
+		return scores
+
+	def search(self, query, top_k = 10, node_ids = None):
+		scores = self.scores(query)
+		if node_ids is not None:
+			if self.positions is None:
+				self.positions = {node_id: i for i, node_id in enumerate(self.node_ids)}
+			allowed = np.zeros(len(scores), dtype = bool)
+			allowed[[self.positions[n] for n in node_ids if n in self.positions]] = True
+			scores[~allowed] = 0
+		hits = np.flatnonzero(scores)
+		if len(hits) > top_k:
+			hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+		hits = hits[np.argsort(-scores[hits], kind = "stable")]
+		return [(self.node_ids[i], float(scores[i])) for i in hits]
+
+
+def reciprocal_rank_fusion(rankings, k = 60):
+	fused = {}
+	for ranking in rankings:
+		for rank, node_id in enumerate(ranking):
+			fused[node_id] = fused.get(node_id, 0.0) + 1.0 / (k + rank + 1)
+	return sorted(fused.items(), key = lambda x: x[1], reverse = True)
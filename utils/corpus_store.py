@@ -0,0 +1,203 @@
+import os
+import json
+import sqlite3
+
+STORE_EXTENSIONS = [".db", ".sqlite", ".sqlite3"]
+CONTENT_MARK = "\nContent: "
+# keys a chunk record keeps in its own columns; anything else goes in extra as JSON
+RECORD_KEYS = ["text", "source", "section", "offset"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS sections (id INTEGER PRIMARY KEY, name TEXT, prefix TEXT NOT NULL, UNIQUE (name, prefix));
+CREATE TABLE IF NOT EXISTS chunks (
+	seq INTEGER PRIMARY KEY,
+	id TEXT NOT NULL UNIQUE,
+	source_id INTEGER REFERENCES sources (id),
+	section_id INTEGER REFERENCES sections (id),
+	offset INTEGER,
+	body TEXT NOT NULL,
+	extra TEXT
+);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source_id, offset);
+CREATE INDEX IF NOT EXISTS chunks_section ON chunks (section_id);
+"""
+
+SELECT = """SELECT c.id, c.body, c.offset, c.extra, s.name, s.prefix, src.name FROM chunks c
+	LEFT JOIN sections s ON s.id = c.section_id
+	LEFT JOIN sources src ON src.id = c.source_id"""
+
+
+def is_corpus_store(path):
+	return os.path.splitext(path)[1].lower() in STORE_EXTENSIONS
+
+
+def split_prefix(text):
+	# "Section: X\nContent: ..." -> ("Section: X\nContent: ", "..."); the prefix is stored once per section
+	at = text.find(CONTENT_MARK)
+	if not text.startswith("Section: ") or at == -1:
+		return "", text
+	return text[:at + len(CONTENT_MARK)], text[at + len(CONTENT_MARK):]
+
+
+class CorpusStore:
+	"""The chunked corpus (what build-docs writes and index-docs reads) in SQLite.
+
+	Chunks are rows keyed by their stable chunk id, in insertion order, with
+	the source file and section dictionary-encoded into their own tables:
+	the "Section: ...\\nContent: " label is stored once per section, not in
+	every chunk. Records read back exactly as chunk_doc_json produced them.
+	The database runs in WAL mode, so index-docs or a query can read while
+	build-docs appends.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.db = sqlite3.connect(path)
+		self.db.execute("PRAGMA journal_mode=WAL")
+		self.db.execute("PRAGMA synchronous=NORMAL")
+		self.db.executescript(SCHEMA)
+		self.sources = {}
+		self.sections = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		if self.db != None:
+			self.db.close()
+			self.db = None
+
+	def source_id(self, name):
+		if name == None:
+			return None
+		if name not in self.sources:
+			self.db.execute("INSERT OR IGNORE INTO sources (name) VALUES (?)", (name,))
+			self.sources[name] = self.db.execute("SELECT id FROM sources WHERE name = ?", (name,)).fetchone()[0]
+		return self.sources[name]
+
+	def section_id(self, name, prefix):
+		key = (name, prefix)
+		if key not in self.sections:
+			# UNIQUE does not treat NULL names as equal, so look them up with IS
+			row = self.db.execute("SELECT id FROM sections WHERE name IS ? AND prefix = ?", key).fetchone()
+			if row == None:
+				row = (self.db.execute("INSERT INTO sections (name, prefix) VALUES (?, ?)", key).lastrowid,)
+			self.sections[key] = row[0]
+		return self.sections[key]
+
+	def row(self, doc_id, record):
+		if not isinstance(record, dict):
+			record = {"text": record}
+		prefix, body = split_prefix(record["text"])
+		extra = {k: record[k] for k in record if k not in RECORD_KEYS}
+		return (doc_id, self.source_id(record.get("source")), self.section_id(record.get("section"), prefix), record.get("offset"), body,
+			json.dumps(extra) if len(extra) > 0 else None)
+
+	def record(self, row):
+		doc_id, body, offset, extra, section, prefix, source = row
+		record = {"text": (prefix or "") + body}
+		if source != None:
+			record["source"] = source
+		if section != None:
+			record["section"] = section
+		if offset != None:
+			record["offset"] = offset
+		if extra != None:
+			record.update(json.loads(extra))
+		return doc_id, record
+
+	def insert(self, docs):
+		self.db.executemany("""INSERT INTO chunks (id, source_id, section_id, offset, body, extra) VALUES (?, ?, ?, ?, ?, ?)
+			ON CONFLICT (id) DO UPDATE SET source_id = excluded.source_id, section_id = excluded.section_id,
+			offset = excluded.offset, body = excluded.body, extra = excluded.extra""",
+			(self.row(doc_id, docs[doc_id]) for doc_id in docs))
+
+	def replace(self, docs, batch_size = 1000):
+		"""Replaces the corpus with {chunk id: record}, or with (chunk id, record) pairs inserted batch_size at a time.
+
+		It is one transaction, so if the pairs stop with an error the old corpus is still there.
+		"""
+		from utils.index_sync import batched
+		self.sources = {}
+		self.sections = {}
+		try:
+			with self.db:
+				self.db.execute("DELETE FROM chunks")
+				self.db.execute("DELETE FROM sections")
+				self.db.execute("DELETE FROM sources")
+				for batch in batched(docs.items() if isinstance(docs, dict) else docs, batch_size):
+					self.insert(dict(batch))
+		finally:
+			# ids cached during a rolled back transaction do not exist
+			self.sources = {}
+			self.sections = {}
+		self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+	def get(self, ids):
+		"""{chunk id: record} for the ids that exist, by primary key lookups."""
+		found = {}
+		ids = list(ids)
+		# SQLite caps the number of bound parameters per statement
+		for i in range(0, len(ids), 500):
+			part = ids[i:i + 500]
+			rows = self.db.execute(f"{SELECT} WHERE c.id IN ({','.join('?' * len(part))})", part)
+			for row in rows:
+				doc_id, record = self.record(row)
+				found[doc_id] = record
+		return found
+
+	def items(self, batch_size = 1000):
+		"""Yields (chunk id, record) in insertion order, batch_size rows at a time."""
+		cur = self.db.execute(f"{SELECT} ORDER BY c.seq")
+		while True:
+			rows = cur.fetchmany(batch_size)
+			if len(rows) == 0:
+				break
+			for row in rows:
+				yield self.record(row)
+
+
+def iter_docs(path):
+	"""(chunk id, record) pairs from a corpus store, streamed, or from a JSON document file."""
+	if is_corpus_store(path):
+		with CorpusStore(path) as store:
+			yield from store.items()
+		return
+	with open(path, "r") as fin:
+		docs = json.load(fin)
+	for doc_id in docs:
+		yield doc_id, docs[doc_id]
+
+
+def load_docs(path):
+	return dict(iter_docs(path))
+
+
+def write_json(fout, items):
+	# the same text as json.dumps(dict(items), indent=4), written one record at a time
+	first = True
+	for doc_id, record in items:
+		fout.write(("{\n" if first else ",\n") + "    " + json.dumps(doc_id) + ": " + json.dumps(record, indent=4).replace("\n", "\n    "))
+		first = False
+	fout.write("{}" if first else "\n}")
+
+
+def save_docs(path, docs):
+	"""Writes {chunk id: record}, or a stream of (chunk id, record) pairs, without holding a stream in memory."""
+	if is_corpus_store(path):
+		with CorpusStore(path) as store:
+			store.replace(docs)
+		return
+	# written beside the old file and swapped in, so a stream that fails part way leaves the old file
+	tmp = path + ".tmp"
+	try:
+		with open(tmp, "w") as fout:
+			write_json(fout, docs.items() if isinstance(docs, dict) else docs)
+		os.replace(tmp, path)
+	finally:
+		if os.path.exists(tmp):
+			os.remove(tmp)
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import random
+import re
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+
+class MinHashDeduplicator:
+	def __init__(self, threshold = 0.85, num_perm = 64, shingle_size = 3, seed = 1):
+		if threshold <= 0 or threshold > 1:
+			raise Exception(f"{self.__class__}: threshold must be in (0, 1], got {threshold}.")
+		self.threshold = threshold
+		self.num_perm = num_perm
+		self.shingle_size = shingle_size
+		rng = random.Random(seed)
+		self.perms = [(rng.randint(1, MERSENNE_PRIME - 1), rng.randint(0, MERSENNE_PRIME - 1)) for _ in range(num_perm)]
+		self.bands, self.rows = self.pick_bands(threshold, num_perm)
+
+	@classmethod
+	def from_settings(cls, settings):
+		return cls(
+			threshold = settings.get("threshold", 0.85),
+			num_perm = settings.get("num_perm", 64),
+			shingle_size = settings.get("shingle_size", 3)
+		)
+
+	def pick_bands(self, threshold, num_perm):
+		# LSH candidate threshold is roughly (1/b)^(1/r); take the closest one
+		# at or below the requested threshold so real duplicates are not missed.
+		# Candidates are verified against the full signature afterwards.
+		best = None
+		for rows in range(1, num_perm + 1):
+			bands = num_perm // rows
+			t = (1.0 / bands) ** (1.0 / rows)
+			if t > threshold:
+				continue
+			if best is None or t > best[0]:
+				best = (t, bands, rows)
+		if best is None:
+			return num_perm, 1
+		return best[1], best[2]
+
+	def normalize(self, text):
+		return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+	def shingles(self, text):
+		words = self.normalize(text).split()
+		if len(words) <= self.shingle_size:
+			return {" ".join(words)}
+		return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+	def signature(self, text):
+		hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size = 4).digest(), "little") for s in self.shingles(text)]
+		return [min([((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes]) for a, b in self.perms]
+
+	def similarity(self, sig_a, sig_b):
+		same = sum(1 for x, y in zip(sig_a, sig_b) if x == y)
+		return same / self.num_perm
+
+	def dedup(self, docs, text_of = None):
+		"""Drops near-duplicate chunks, keeping the first occurrence.
+
+		Args:
+			docs (dict): chunk id -> chunk, in document order.
+			text_of (callable): returns the text of a chunk (defaults to the chunk itself).
+
+		Returns:
+			tuple: (kept docs dict, dict of dropped chunk id -> canonical chunk id).
+		"""
+		if text_of is None:
+			text_of = lambda x: x
+		kept = {}
+		duplicates = {}
+		exact = {}
+		signatures = {}
+		buckets = [{} for _ in range(self.bands)]
+		for doc_id in docs:
+			text = text_of(docs[doc_id])
+			norm = self.normalize(text)
+			if norm in exact:
+				duplicates[doc_id] = exact[norm]
+				continue
+			sig = self.signature(text)
+			canonical = None
+			keys = [tuple(sig[i * self.rows:(i + 1) * self.rows]) for i in range(self.bands)]
+			seen = set()
+			for band, key in enumerate(keys):
+				for candidate in buckets[band].get(key, []):
+					if candidate in seen:
+						continue
+					seen.add(candidate)
+					if self.similarity(sig, signatures[candidate]) >= self.threshold:
+						canonical = candidate
+						break
+				if canonical is not None:
+					break
+			if canonical is not None:
+				duplicates[doc_id] = canonical
+				continue
+			kept[doc_id] = docs[doc_id]
+			exact[norm] = doc_id
+			signatures[doc_id] = sig
+			for band, key in enumerate(keys):
+				buckets[band].setdefault(key, []).append(doc_id)
+		return kept, duplicates
+
+
+def load_duplicates(filename):
+	if not os.path.exists(filename):
+		return {}
+	with open(filename, "r") as fin:
+		return json.load(fin)
+
+
+def save_duplicates(filename, duplicates, merge = False):
+	if merge:
+		previous = load_duplicates(filename)
+		# chunks that pointed at something now dropped follow it to its canonical
+		for dropped in previous:
+			canonical = previous[dropped]
+			previous[dropped] = duplicates.get(canonical, canonical)
+		previous.update(duplicates)
+		duplicates = previous
+	with open(filename, "w") as fout:
+		fout.write(json.dumps(duplicates, indent = 4))
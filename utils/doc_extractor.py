@@ -1,39 +1,39 @@
 import csv
 import json
 import sys
-from base64 import b64decode
 from unidecode import unidecode
-from striprtf.striprtf import rtf_to_text
 import zipfile
-import xml.etree.ElementTree
-import json
+import tarfile
 import re
-import random
 import os
 import io
-from bs4 import BeautifulSoup
 #from google_helper import GoogleHelper
-import logging
-import pdfplumber
-import collections
-from dateparser.search import search_dates
-from xml.dom import minidom
-from pptx import Presentation
-from utils.doc_extractor_docx import DocExtractorDOCX
 from difflib import SequenceMatcher
 from itertools import pairwise
-from utils.llm_invoker import LLMInvoker
 from utils.json_repair import fix_json
+from utils import metrics
+
+# pdfplumber, BeautifulSoup, striprtf, the DOCX extractor and the LLM client
+# are imported in the methods that need them so that importing this module
+# (and starting the CLI) stays cheap.
 
 
 
 
 
 csv.field_size_limit(sys.maxsize)
+# extracted by unzipping them
+ZIP_FORMATS = ["docx", "pptx"]
+
 class DocExtractor:
-  def __init__(self, bucket = None, brand = None):
+  def __init__(self, bucket = None, brand = None, llm_settings = None, extract_settings = None):
     self.bucket = bucket
     self.brand = brand
+    # concurrency, requests_per_minute and retry settings for naming sections in process_files
+    self.llm_settings = llm_settings or {}
+    self.extract_settings = extract_settings or {}
+    # files given up on (timeouts, memory, zip bombs...), written out by write_quarantine
+    self.quarantined = []
     self.WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
     self.PARA = self.WORD_NAMESPACE + 'p'
     self.TEXT = self.WORD_NAMESPACE + 't'
@@ -140,6 +140,7 @@ class DocExtractor:
     return self.text_from_pdf_obj(pdfFileObj)
 
   def text_from_pdf_obj(self, pdfFileObj):
+    import pdfplumber
     content = []
     pdf = pdfplumber.open(pdfFileObj)
     for page in pdf.pages:
@@ -152,6 +153,7 @@ class DocExtractor:
     return self.text_from_docx_obj(docObj, include_images)
 
   def text_from_pptx_obj(sefl, docObj):
+    from bs4 import BeautifulSoup
     slide_text = {}
     toc = {}
     with zipfile.ZipFile(docObj) as docx:
@@ -187,6 +189,7 @@ class DocExtractor:
     return slide_text
 
   def text_from_docx_obj(self, docObj, include_images):
+    from utils.doc_extractor_docx import DocExtractorDOCX
     de_docx = DocExtractorDOCX()
     content_json = de_docx.process_file_obj(docObj,include_images)
     return content_json
@@ -204,6 +207,7 @@ class DocExtractor:
       isdoc=True
     text=[]
     if not isdoc and content.find("\\rtf1")>-1:
+      from striprtf.striprtf import rtf_to_text
       text = rtf_to_text(content)
       resume_data = text.split("\n")
       return resume_data
@@ -214,27 +218,34 @@ class DocExtractor:
       return resume_data
 
   def text_from_txt_file(self, path):
-    txtObj = open(path,"rb")
-    return self.text_from_txt_obj(txtObj)
-      
+    from utils import text_stream
+    return list(text_stream.iter_lines(path))
+
   def text_from_txt_obj(self, txtObj):
+    from utils import text_stream
     txt = txtObj.read()
-    txt = txt.decode()
+    txt = text_stream.decode(txt)
     return txt.split("\n")
 
+  def txt_sections(self, path):
+    # large text files are read lazily as ("part_N", lines) sections instead of one list of lines
+    from utils import text_stream
+    return text_stream.sections(text_stream.iter_lines(path), self.extract_settings.get("txt_section_chars", 8192))
+
+  def streams_txt(self, path):
+    return os.path.getsize(path) >= self.extract_settings.get("txt_stream_bytes", 64 * 1024 * 1024)
+
   def text_from_html_file(self, path):
     htmlObj = open(path,'r')
     return self.text_from_html_obj(htmlObj)
 
   def text_from_html_obj(self, htmlObj):
-    html = str(htmlObj.read())
-    soup = BeautifulSoup(html,features="html.parser")
-    for data in soup(['nav','figcaption','footer','aside',
-                      'head','svg','path','circle','link',
-                      'form','style','img','style', 'script']):
-      data.decompose()
-    resume_text =  soup.get_text(separator=u" ").splitlines()
-    return resume_text
+    # lxml when it is installed (same text, far faster), otherwise BeautifulSoup's html.parser
+    from utils import html_text
+    html = htmlObj.read()
+    if html_text.available():
+      return html_text.html_lines(html)
+    return html_text.bs4_lines(html)
 
   def text_from_rtf_file(self, path):
     docObj = open(path,'rb')
@@ -243,6 +254,7 @@ class DocExtractor:
   def text_from_rtf_obj(self, docObj):
     content = docObj.read()
     content = content.decode("utf-8")
+    from striprtf.striprtf import rtf_to_text
     text = rtf_to_text(content)
     resume_data = text.split("\n")
     return resume_data
@@ -299,24 +311,22 @@ class DocExtractor:
       text_content = None
     return text_content
 
-  def json_from_list(self, content):
-
-      if isinstance(content,list):
-        subsequences = []
-        for x,y in pairwise(content):
-          s = SequenceMatcher(None, x, y)
-          s = s.get_matching_blocks()[0]
-          if s.a==s.b:
-            subsequences.append([s.a,s.size])
-        new_content = {}
-        for i in range(0,len(content)):
-          if i<len(subsequences):
-            sub = subsequences[i]
-            content[i] = content[i][0:sub[0]]+content[i][sub[0]+sub[1]:]
-            new_content[f"part_{i}"] = content[i]
-          else:
-            new_content[f"part_{i}"] = content[i]
-        msg = f"""You're a helpful assistant who can organize and format 
+  def list_rename_prompt(self, content):
+    subsequences = []
+    for x,y in pairwise(content):
+      s = SequenceMatcher(None, x, y)
+      s = s.get_matching_blocks()[0]
+      if s.a==s.b:
+        subsequences.append([s.a,s.size])
+    new_content = {}
+    for i in range(0,len(content)):
+      if i<len(subsequences):
+        sub = subsequences[i]
+        content[i] = content[i][0:sub[0]]+content[i][sub[0]+sub[1]:]
+        new_content[f"part_{i}"] = content[i]
+      else:
+        new_content[f"part_{i}"] = content[i]
+    msg = f"""You're a helpful assistant who can organize and format 
   JSON so that it makes more sense and is more intuitive.
   Given the following JSON object, please reply with new JSON that is
    more contextually relevant. Please respond with JSON where the old key is a key in the JSON and your proposed new key as its value:
@@ -334,18 +344,28 @@ class DocExtractor:
   INPUT JSON: {json.dumps({x:new_content[x][0:100] for x in new_content})}.
   RECOMMENDED KEYS:
   """   
+    return new_content, msg
+
+  def rename_parts(self, new_content, all_txt):
+    data = fix_json(all_txt)
+    final_content = {}
+    for x in data:
+      y = data[x]
+      final_content[y] = new_content[x]
+    return final_content
+
+  def json_from_list(self, content):
+
+      if isinstance(content,list):
+        metrics.count("json_from_list_calls")
+        new_content, msg = self.list_rename_prompt(content)
+        from utils.llm_invoker import LLMInvoker
         llm_invoker = LLMInvoker("ollama")
         all_txt = ""
         for txt in llm_invoker.ask_llm(msg):
           all_txt+=txt
           # print(txt,end="",flush=True)
-        data = fix_json(all_txt)
-        final_content = {}
-        for x in data:
-          y = data[x]
-          final_content[y] = new_content[x]
-        
-        return final_content
+        return self.rename_parts(new_content, all_txt)
       elif isinstance(content,dict):
         return content
       else:
@@ -355,44 +375,238 @@ class DocExtractor:
     if (ext==None and filename!=None and filename.find(".")>-1):
       ext = os.path.splitext(filename)[1].replace(".","")
       print(ext)
+    problem = self.zip_problem(fileobj, ext)
+    if problem != None:
+      raise Exception(f"{self.__class__}: {filename} {problem}.")
     text_content = None
-    if ext =="pdf":
-      text_content = self.text_from_pdf_obj(fileobj)
-    elif ext=="rtf":
-      text_content = self.text_from_rtf_obj(fileobj)
-    elif ext=="doc":
-      text_content = self.text_from_doc_obj(fileobj)
-    elif ext=="pptx":
-      text_content = self.text_from_pptx_obj(fileobj)
-    elif ext=="docx":
-      text_content = self.text_from_docx_obj(fileobj, include_images = include_images)
-    elif ext=="html":
-      text_content = self.text_from_html_obj(fileobj)
-    elif ext=="txt":
-      text_content = self.text_from_txt_obj(fileobj)
+    with metrics.timer("extract", format=ext):
+      if ext =="pdf":
+        text_content = self.text_from_pdf_obj(fileobj)
+      elif ext=="rtf":
+        text_content = self.text_from_rtf_obj(fileobj)
+      elif ext=="doc":
+        text_content = self.text_from_doc_obj(fileobj)
+      elif ext=="pptx":
+        text_content = self.text_from_pptx_obj(fileobj)
+      elif ext=="docx":
+        text_content = self.text_from_docx_obj(fileobj, include_images = include_images)
+      elif ext=="html":
+        text_content = self.text_from_html_obj(fileobj)
+      elif ext=="txt":
+        text_content = self.text_from_txt_obj(fileobj)
+        text_content = [x for x in text_content if len(x.strip())>0]
+    metrics.count("extracted_files", format=ext)
     return text_content
 
-  def process_file(self, filename=None, ext=None, include_images = False):
+  def archive_members(self, path):
+    """Yields (member name, seekable in-memory file) for each document in a zip or tar archive ("-" reads a tar stream from stdin)."""
+    def wanted(name):
+      base = os.path.basename(name)
+      return not (base.startswith(".") or base.find("~")>-1 or name.startswith("__MACOSX/"))
+    if path == "-":
+      # a pipe cannot seek, so only tar (read member by member) works here
+      archive = tarfile.open(fileobj=sys.stdin.buffer, mode="r|*")
+    elif zipfile.is_zipfile(path):
+      with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+          if not info.is_dir() and wanted(info.filename) and self.member_fits(info.filename, info.file_size):
+            yield info.filename, io.BytesIO(zf.read(info))
+      return
+    elif tarfile.is_tarfile(path):
+      # streaming mode reads the (possibly compressed) archive once, front to back
+      archive = tarfile.open(path, mode="r|*")
+    else:
+      raise Exception(f"{self.__class__}: {path} is not a zip or tar archive.")
+    with archive:
+      for member in archive:
+        if member.isfile() and wanted(member.name) and self.member_fits(member.name, member.size):
+          yield member.name, io.BytesIO(archive.extractfile(member).read())
+
+  def member_fits(self, name, size):
+    # members are unpacked into memory, so an oversized (or zip bomb) member is skipped rather than read
+    limit = self.extract_settings.get("max_unzipped_mb", 1024)
+    if size > limit * 1024 * 1024:
+      self.quarantine(name, "too_large", f"unpacks to {size // (1024 * 1024)} MB, over the {limit} MB limit")
+      return False
+    return True
+
+  def extract_file(self, filename=None, ext=None, include_images = False):
     if (ext==None and filename!=None and filename.find(".")>-1):
       ext = os.path.splitext(filename)[1].replace(".","")
       print(ext)
+    problem = self.zip_problem(filename, ext)
+    if problem != None:
+      raise Exception(f"{self.__class__}: {filename} {problem}.")
     text_content = None
-    if ext =="pdf":
-      text_content = self.text_from_pdf_file(filename)
-    elif ext=="rtf":
-      text_content = self.text_from_rtf_file(filename)
-    elif ext=="doc":
-      text_content = self.text_from_doc_file(filename)
-    elif ext=="pptx":
-      text_content = self.text_from_pptx_file(filename)
-    elif ext=="docx":
-      text_content = self.text_from_docx_file(filename, include_images = include_images)
-    elif ext=="html":
-      text_content = self.text_from_html_file(filename)
-    elif ext=="txt":
-      text_content = self.text_from_txt_file(filename)
-      text_content = [x for x in text_content if len(x.strip())>0]
-    return self.json_from_list(text_content)
+    with metrics.timer("extract", format=ext):
+      if ext =="pdf":
+        text_content = self.text_from_pdf_file(filename)
+      elif ext=="rtf":
+        text_content = self.text_from_rtf_file(filename)
+      elif ext=="doc":
+        text_content = self.text_from_doc_file(filename)
+      elif ext=="pptx":
+        text_content = self.text_from_pptx_file(filename)
+      elif ext=="docx":
+        text_content = self.text_from_docx_file(filename, include_images = include_images)
+      elif ext=="html":
+        text_content = self.text_from_html_file(filename)
+      elif ext=="txt" and self.streams_txt(filename):
+        text_content = self.txt_sections(filename)
+      elif ext=="txt":
+        text_content = self.text_from_txt_file(filename)
+        text_content = [x for x in text_content if len(x.strip())>0]
+    metrics.count("extracted_files", format=ext)
+    return text_content
+
+  def process_file(self, filename=None, ext=None, include_images = False):
+    return self.json_from_list(self.extract_file(filename, ext = ext, include_images = include_images))
+
+  def process_files(self, filenames, include_images = False):
+    # every file is extracted first so the LLM section naming runs as one rate-limited batch
+    if self.extract_settings.get("supervise", True):
+      return self.name_sections(filenames, self.extract_supervised(filenames, include_images = include_images))
+    contents = []
+    html = self.extract_html_files([f for f in filenames if os.path.splitext(f)[1]==".html"])
+    for f in filenames:
+      print(os.path.basename(f))
+      if f in html:
+        contents.append(html.pop(f))
+      else:
+        contents.append(self.extract_file(f, include_images = include_images))
+    return self.name_sections(filenames, contents)
+
+  def supervisor(self):
+    from utils.extract_workers import ExtractSupervisor
+    return ExtractSupervisor(workers = self.extract_settings.get("extract_workers"), timeout = self.extract_settings.get("file_timeout", 300),
+      memory_mb = self.extract_settings.get("memory_mb", 4096), llm_settings = self.llm_settings, extract_settings = self.extract_settings)
+
+  def supervised_content(self, name, status, result, seconds):
+    # the content of one supervised extraction, or None once it is quarantined
+    ext = os.path.splitext(name)[1].replace(".","")
+    metrics.observe("extract_seconds", seconds, format=ext, mode="supervised")
+    if status != "ok":
+      self.quarantine(name, status, result, seconds)
+      return None
+    metrics.count("extracted_files", format=ext)
+    return result
+
+  def extract_supervised(self, filenames, include_images = False):
+    # each file is extracted in a worker process with a timeout and a memory cap; the ones that fail are quarantined (content None)
+    contents = [None] * len(filenames)
+    supervised = []
+    for i, f in enumerate(filenames):
+      if os.path.splitext(f)[1]==".txt" and self.streams_txt(f):
+        # read lazily here later on, a block at a time
+        print(os.path.basename(f))
+        contents[i] = self.txt_sections(f)
+      else:
+        supervised.append(i)
+    for j, status, result, seconds in self.supervisor().run([filenames[i] for i in supervised], include_images = include_images):
+      contents[supervised[j]] = self.supervised_content(filenames[supervised[j]], status, result, seconds)
+    return contents
+
+  def zip_problem(self, f, ext = None):
+    # docx and pptx list their unpacked sizes up front, so a zip bomb is refused before anything is unpacked
+    if ext == None and isinstance(f, str):
+      ext = os.path.splitext(f)[1].replace(".","")
+    if ext not in ZIP_FORMATS:
+      return None
+    limit = self.extract_settings.get("max_unzipped_mb", 1024)
+    try:
+      with zipfile.ZipFile(f) as zf:
+        infos = zf.infolist()
+    except (zipfile.BadZipFile, OSError):
+      # not a zip after all; the extractor reports that
+      return None
+    finally:
+      if not isinstance(f, str):
+        f.seek(0)
+    unzipped = sum(i.file_size for i in infos)
+    if unzipped > limit * 1024 * 1024:
+      return f"unzips to {unzipped // (1024 * 1024)} MB in {len(infos)} entries, over the {limit} MB limit"
+    return None
+
+  def quarantine(self, name, reason, detail, seconds = None):
+    print(f"QUARANTINED {name}: {reason} ({detail})")
+    metrics.count("quarantined_files", reason=reason)
+    self.quarantined.append({"file": name, "reason": reason, "detail": detail, "seconds": round(seconds, 3) if seconds != None else None})
+
+  def write_quarantine(self):
+    # the report describes the last run only, so a clean run removes it
+    filename = self.extract_settings.get("quarantine_file", "quarantine.json")
+    if len(self.quarantined) == 0:
+      if os.path.exists(filename):
+        os.remove(filename)
+      return None
+    with open(filename, "w") as fout:
+      fout.write(json.dumps(self.quarantined, indent=4))
+    return filename
+
+  def extract_html_files(self, paths):
+    # web-archive folders hold many pages, so they are parsed across processes up front
+    from utils import html_text
+    workers = self.extract_settings.get("html_workers", os.cpu_count() or 1)
+    if workers <= 1 or len(paths) < 2 * workers:
+      return {}
+    extracted = {}
+    with metrics.timer("extract", format="html", mode="bulk"):
+      for path, lines in html_text.extract_paths(paths, workers = workers):
+        extracted[path] = lines
+    metrics.count("extracted_files", len(extracted), format="html")
+    return extracted
+
+  def process_archive(self, path, include_images = False):
+    # nothing is unpacked to disk: members are read into memory as workers free up and sent to them
+    names = []
+    if self.extract_settings.get("supervise", True):
+      def members():
+        for name, fileobj in self.archive_members(path):
+          names.append(name)
+          yield name, fileobj.getvalue()
+      contents = {}
+      for i, status, result, seconds in self.supervisor().run(members(), include_images = include_images):
+        contents[i] = self.supervised_content(names[i], status, result, seconds)
+      return names, self.name_sections(names, [contents.get(i) for i in range(len(names))])
+    # "supervise": false extracts the members here, one at a time
+    contents = []
+    for name, fileobj in self.archive_members(path):
+      print(name)
+      names.append(name)
+      content = None
+      problem = self.zip_problem(fileobj, os.path.splitext(name)[1].replace(".",""))
+      if problem != None:
+        self.quarantine(name, "zip_bomb", problem)
+      else:
+        try:
+          content = self.process_object(filename = name, fileobj = fileobj, include_images = include_images)
+        except Exception as e:
+          self.quarantine(name, "error", f"{e.__class__.__name__}: {e}")
+      contents.append(content)
+      fileobj.close()
+    return names, self.name_sections(names, contents)
+
+  def name_sections(self, filenames, contents):
+    pending = [i for i in range(len(contents)) if isinstance(contents[i], list)]
+    if len(pending) == 0:
+      return contents
+    parts = {}
+    prompts = []
+    for i in pending:
+      metrics.count("json_from_list_calls")
+      parts[i], msg = self.list_rename_prompt(contents[i])
+      prompts.append(msg)
+    from utils.llm_invoker import LLMInvoker
+    replies = LLMInvoker("ollama").map(prompts, return_exceptions = True, **self.llm_settings)
+    for i, reply in zip(pending, replies):
+      try:
+        if isinstance(reply, Exception):
+          raise reply
+        contents[i] = self.rename_parts(parts[i], reply)
+      except Exception as e:
+        print(f"Could not name the sections of {filenames[i]} ({e}); keeping part_N keys")
+        contents[i] = parts[i]
+    return contents
 
 if __name__=="__main__":
   de = DocExtractor()
@@ -8,7 +8,6 @@ from collections import Counter
 import os
 import sys
 from unidecode import unidecode
-from PIL import Image
 
 class DocExtractorDOCX:
 	def __init__(self):
@@ -196,6 +195,7 @@ class DocExtractorDOCX:
 				with open(dst_fname, "wb") as dst_f:
 					dst_f.write(docx.read(fname))
 					try:
+						from PIL import Image
 						im = Image.open(dst_fname)
 						img_name = fname.split("/")[-1]
 						images[img_name] = 1
@@ -0,0 +1,167 @@
+import os
+import time
+import atexit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+THREAD_VARS = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TOKENIZERS_PARALLELISM"]
+
+# set in each worker process by init_worker
+worker_model = None
+
+
+def load_model(model_name, backend = "torch", onnx_file = None):
+	from sentence_transformers import SentenceTransformer
+	kwargs = {"device": "cpu"}
+	if backend != "torch":
+		# needs sentence-transformers>=3.2 with its onnx/openvino extra installed
+		kwargs["backend"] = backend
+		if onnx_file != None:
+			kwargs["model_kwargs"] = {"file_name": onnx_file}
+	return SentenceTransformer(model_name, **kwargs)
+
+
+def pin_threads(threads, cores = None):
+	# the env vars only take effect if set before torch/onnxruntime start their pools
+	for var in THREAD_VARS:
+		os.environ[var] = "false" if var == "TOKENIZERS_PARALLELISM" else str(threads)
+	if cores != None and hasattr(os, "sched_setaffinity"):
+		os.sched_setaffinity(0, cores)
+	try:
+		import torch
+		torch.set_num_threads(threads)
+		torch.set_num_interop_threads(1)
+	except (ImportError, RuntimeError):
+		pass
+
+
+def init_worker(model_name, backend, onnx_file, threads, pin_cores, slot):
+	global worker_model
+	cores = None
+	if pin_cores and hasattr(os, "sched_getaffinity"):
+		with slot.get_lock():
+			i = slot.value
+			slot.value += 1
+		available = sorted(os.sched_getaffinity(0))
+		cores = set(available[(i * threads + k) % len(available)] for k in range(threads))
+	pin_threads(threads, cores)
+	worker_model = load_model(model_name, backend, onnx_file)
+
+
+def encode_batch(texts):
+	return worker_model.encode(texts, batch_size = len(texts), convert_to_numpy = True, show_progress_bar = False).astype(np.float32)
+
+
+class EmbeddingEngine(BaseEmbedding):
+	"""Sentence-transformers embeddings spread over worker processes.
+
+	Batches of batch_size texts go to `workers` processes, each limited to
+	threads_per_worker threads (and optionally pinned to its own cores).
+	Queries and small batches are embedded in-process. backend "onnx" or
+	"openvino" runs the exported model instead of torch; onnx_file picks a
+	variant such as "onnx/model_qint8_avx512_vnni.onnx".
+	"""
+
+	workers: int = 1
+	threads_per_worker: int = 2
+	batch_size: int = 64
+	backend: str = "torch"
+	onnx_file: Optional[str] = None
+	pin_cores: bool = False
+	verify: bool = False
+	tolerance: float = 1e-3
+
+	_local = PrivateAttr(default = None)
+	_executor = PrivateAttr(default = None)
+	_embedded = PrivateAttr(default = 0)
+	_seconds = PrivateAttr(default = 0.0)
+	_verified = PrivateAttr(default = False)
+
+	@classmethod
+	def from_settings(cls, settings = None, model_name = DEFAULT_MODEL):
+		settings = settings or {}
+		threads = settings.get("threads_per_worker", 2)
+		workers = settings.get("workers", max(1, (os.cpu_count() or 1) // threads))
+		batch_size = settings.get("batch_size", 64)
+		return cls(model_name = settings.get("model", model_name),
+			workers = workers,
+			threads_per_worker = threads,
+			batch_size = batch_size,
+			# one llama_index batch is one round of work for every worker (llama_index caps it at 2048)
+			embed_batch_size = min(batch_size * workers, 2048),
+			backend = settings.get("backend", "torch"),
+			onnx_file = settings.get("onnx_file"),
+			pin_cores = settings.get("pin_cores", False),
+			verify = settings.get("verify", False),
+			tolerance = settings.get("tolerance", 1e-3))
+
+	@classmethod
+	def class_name(cls):
+		return "EmbeddingEngine"
+
+	def local_model(self):
+		if self._local == None:
+			self._local = load_model(self.model_name, self.backend, self.onnx_file)
+		return self._local
+
+	def executor(self):
+		if self._executor == None:
+			ctx = multiprocessing.get_context("spawn")
+			slot = ctx.Value("i", 0)
+			self._executor = ProcessPoolExecutor(max_workers = self.workers, mp_context = ctx, initializer = init_worker,
+				initargs = (self.model_name, self.backend, self.onnx_file, self.threads_per_worker, self.pin_cores, slot))
+			atexit.register(self.close)
+		return self._executor
+
+	def encode(self, texts):
+		if self.workers <= 1 or len(texts) <= self.batch_size:
+			return self.local_model().encode(texts, batch_size = self.batch_size, convert_to_numpy = True, show_progress_bar = False).astype(np.float32)
+		batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+		return np.concatenate(list(self.executor().map(encode_batch, batches)))
+
+	def check(self, texts, embeddings):
+		"""Compares against the plain torch model the index was built with before this engine existed."""
+		sample = texts[:32]
+		reference = load_model(self.model_name).encode(sample, convert_to_numpy = True, show_progress_bar = False)
+		a = embeddings[:len(sample)]
+		cos = np.sum(a * reference, axis = 1) / (np.linalg.norm(a, axis = 1) * np.linalg.norm(reference, axis = 1))
+		drift = float(np.max(1 - cos))
+		print(f"EMBEDDING CHECK ({self.backend}{', ' + self.onnx_file if self.onnx_file else ''}): max cosine distance from torch {drift:.2e} over {len(sample)} chunks")
+		if drift > self.tolerance:
+			raise Exception(f"{self.__class__}: Embeddings differ from the torch model by {drift:.2e} (tolerance {self.tolerance}).")
+
+	def _get_text_embeddings(self, texts):
+		start = time.perf_counter()
+		embeddings = self.encode(texts)
+		self._seconds += time.perf_counter() - start
+		self._embedded += len(texts)
+		if self.verify and not self._verified:
+			self._verified = True
+			self.check(texts, embeddings)
+		return embeddings.tolist()
+
+	def _get_text_embedding(self, text):
+		return self._get_text_embeddings([text])[0]
+
+	def _get_query_embedding(self, query):
+		return self.local_model().encode([query], convert_to_numpy = True, show_progress_bar = False)[0].astype(np.float32).tolist()
+
+	async def _aget_query_embedding(self, query):
+		return self._get_query_embedding(query)
+
+	def throughput(self):
+		return self._embedded / self._seconds if self._seconds > 0 else 0.0
+
+	def close(self):
+		if self._executor != None:
+			self._executor.shutdown()
+			self._executor = None
+		if self._embedded > 0:
+			print(f"EMBEDDED {self._embedded} chunks in {self._seconds:.1f}s ({self.throughput():.0f} chunks/s, {self.workers} workers x {self.threads_per_worker} threads, {self.backend})")
+			self._embedded = 0
+			self._seconds = 0.0
@@ -0,0 +1,160 @@
+import os
+import io
+import time
+import multiprocessing
+from collections import deque
+from multiprocessing.connection import wait
+
+
+def task_name(item):
+	# a path, or the name of an in-memory (name, bytes) file such as an archive member
+	return item[0] if isinstance(item, tuple) else item
+
+
+def worker(conn, llm_settings, extract_settings, memory_mb):
+	if memory_mb:
+		try:
+			import resource
+			limit = int(memory_mb * 1024 * 1024)
+			resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+		except (ImportError, ValueError, OSError):
+			# not enforceable here (e.g. Windows); the timeout still applies
+			pass
+	profiler = None
+	if os.environ.get("RAGTIME_PROFILE"):
+		# set by --profile in the parent
+		from utils import profiling
+		profiler = profiling.start_worker()
+	from utils.doc_extractor import DocExtractor
+	de = DocExtractor(llm_settings = llm_settings, extract_settings = extract_settings)
+	while True:
+		task = conn.recv()
+		if task == None:
+			if profiler != None:
+				profiling.stop_worker(profiler)
+			break
+		item, include_images = task
+		try:
+			if isinstance(item, tuple):
+				name, data = item
+				fileobj = io.BytesIO(data)
+				problem = de.zip_problem(fileobj, os.path.splitext(name)[1].replace(".",""))
+			else:
+				problem = de.zip_problem(item)
+			if problem != None:
+				conn.send(("zip_bomb", problem))
+				continue
+			if isinstance(item, tuple):
+				conn.send(("ok", de.process_object(filename = name, fileobj = fileobj, include_images = include_images)))
+			else:
+				conn.send(("ok", de.extract_file(item, include_images = include_images)))
+		except MemoryError:
+			conn.send(("memory", f"needed more than the {memory_mb} MB address space limit"))
+			# what is left of the heap is not worth reusing; the supervisor starts a fresh worker
+			break
+		except Exception as e:
+			conn.send(("error", f"{e.__class__.__name__}: {e}"))
+
+
+class ExtractSupervisor:
+	"""Runs DocExtractor.extract_file (or process_object, for files in memory) over many files in worker processes it can kill.
+
+	Each worker extracts one file at a time under an address-space limit of
+	memory_mb. A file that is still running after timeout seconds, runs out
+	of memory or takes its worker down is reported with a reason and its
+	worker is replaced; the other workers carry on meanwhile.
+	"""
+
+	def __init__(self, workers = None, timeout = 300, memory_mb = 4096, llm_settings = None, extract_settings = None):
+		self.workers = workers or os.cpu_count() or 1
+		self.timeout = timeout
+		self.memory_mb = memory_mb
+		self.llm_settings = llm_settings
+		self.extract_settings = extract_settings
+		self.context = multiprocessing.get_context()
+
+	def start_worker(self):
+		conn, child = self.context.Pipe()
+		process = self.context.Process(target = worker, args = (child, self.llm_settings, self.extract_settings, self.memory_mb), daemon = True)
+		process.start()
+		child.close()
+		return {"process": process, "conn": conn, "task": None, "started": None}
+
+	def stop_worker(self, w, kill = False):
+		if w["process"].is_alive() and not kill:
+			try:
+				w["conn"].send(None)
+			except (BrokenPipeError, ConnectionError):
+				pass
+			# a profiled worker writes its stats on the way out
+			w["process"].join(timeout = 10)
+		if w["process"].is_alive():
+			w["process"].kill()
+		w["process"].join()
+		w["conn"].close()
+
+	def finished(self, w, ready):
+		# (status, result) once the worker's file is done or has to be given up, else None
+		if w["conn"] in ready:
+			try:
+				return w["conn"].recv()
+			except (EOFError, ConnectionError):
+				pass
+		if w["conn"] in ready or w["process"].sentinel in ready:
+			w["process"].join(timeout = 1)
+			return "crashed", f"the worker died (exit code {w['process'].exitcode})"
+		if time.monotonic() - w["started"] >= self.timeout:
+			return "timeout", f"still running after {self.timeout} s"
+		return None
+
+	def run(self, items, include_images = False):
+		"""Yields (index, status, result, seconds) for each item as it finishes: status "ok" with the extracted
+		content, or "timeout", "memory", "zip_bomb", "crashed" or "error" with a description.
+
+		Items are paths or (name, bytes) pairs for files already in memory.
+		They are pulled from items only as workers free up, so a generator of
+		archive members never has more than one member per worker unpacked.
+		"""
+		pending = enumerate(items)
+		exhausted = False
+		workers = []
+		try:
+			while True:
+				idle = [w for w in workers if w["task"] == None]
+				while not exhausted and (len(idle) > 0 or len(workers) < self.workers):
+					task = next(pending, None)
+					if task == None:
+						exhausted = True
+						break
+					if len(idle) > 0:
+						w = idle.pop()
+					else:
+						w = self.start_worker()
+						workers.append(w)
+					w["task"] = task
+					w["started"] = time.monotonic()
+					print(os.path.basename(task_name(task[1])))
+					w["conn"].send((task[1], include_images))
+				busy = [w for w in workers if w["task"] != None]
+				if len(busy) == 0:
+					break
+				deadline = min(w["started"] for w in busy) + self.timeout
+				ready = wait([w["conn"] for w in busy] + [w["process"].sentinel for w in busy], timeout = max(0, deadline - time.monotonic()))
+				for n, w in enumerate(workers):
+					if w["task"] == None:
+						continue
+					done = self.finished(w, ready)
+					if done == None:
+						continue
+					status, result = done
+					i = w["task"][0]
+					seconds = time.monotonic() - w["started"]
+					w["task"] = None
+					if status in ["timeout", "memory", "crashed"]:
+						# killed mid-file if it timed out; the others have exited already
+						self.stop_worker(w, kill = True)
+						workers[n] = self.start_worker() if not exhausted else w
+					yield i, status, result, seconds
+		finally:
+			for w in workers:
+				self.stop_worker(w, kill = w["task"] != None)
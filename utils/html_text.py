@@ -0,0 +1,72 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# the elements text_from_html_obj has always dropped
+BOILERPLATE = ["nav", "figcaption", "footer", "aside", "head", "svg", "path", "circle", "link", "form", "style", "img", "script"]
+
+
+def available():
+	try:
+		import lxml.html
+		return True
+	except ImportError:
+		return False
+
+
+def html_lines(html):
+	"""Lines of text of an HTML page (str or bytes) without its boilerplate elements, using lxml's C parser.
+
+	Gives the same text as BeautifulSoup's get_text(separator=" ").splitlines()
+	after decomposing BOILERPLATE: every text run is a separate string joined
+	with a space, and comments and processing instructions are skipped.
+	"""
+	import lxml.html
+	from lxml import etree
+	if isinstance(html, bytes):
+		try:
+			html = html.decode("utf-8")
+		except UnicodeDecodeError:
+			pass
+	if isinstance(html, str):
+		# already decoded, so a <meta charset> in it must not be applied again
+		html = html.encode("utf-8")
+		parser = lxml.html.HTMLParser(encoding = "utf-8")
+	else:
+		# not UTF-8: let libxml2 go by the page's declared charset
+		parser = lxml.html.HTMLParser()
+	try:
+		root = lxml.html.document_fromstring(html, parser = parser)
+	except etree.ParserError:
+		return []
+	# emptied rather than removed so the text on either side stays two strings, as it did with decompose()
+	for el in list(root.iter(*BOILERPLATE)):
+		el.clear(keep_tail = True)
+	return " ".join(root.itertext()).splitlines()
+
+
+def bs4_lines(html):
+	"""The original BeautifulSoup extraction, used when lxml is not installed."""
+	from bs4 import BeautifulSoup
+	if isinstance(html, bytes):
+		html = html.decode("utf-8", errors = "replace")
+	soup = BeautifulSoup(html, features = "html.parser")
+	for data in soup(BOILERPLATE):
+		data.decompose()
+	return soup.get_text(separator = u" ").splitlines()
+
+
+def read_lines(path):
+	with open(path, "rb") as fin:
+		return html_lines(fin.read()) if available() else bs4_lines(fin.read())
+
+
+def extract_paths(paths, workers = None, chunksize = 16):
+	"""Yields (path, lines) for many HTML files, parsed in `workers` processes (in order)."""
+	workers = workers or os.cpu_count() or 1
+	if workers <= 1 or len(paths) < 2 * workers:
+		for path in paths:
+			yield path, read_lines(path)
+		return
+	with ProcessPoolExecutor(max_workers = workers) as pool:
+		for path, lines in zip(paths, pool.map(read_lines, paths, chunksize = chunksize)):
+			yield path, lines
@@ -0,0 +1,82 @@
+import sys
+import time
+import threading
+from importlib.abc import MetaPathFinder
+
+# A friendlier cut of "python -X importtime": which modules made startup slow,
+# sorted, with self time (excluding nested imports) next to cumulative time.
+
+timings = {}
+installed = None
+local = threading.local()
+
+
+class TimingLoader:
+	def __init__(self, loader):
+		self.loader = loader
+
+	def __getattr__(self, name):
+		return getattr(self.loader, name)
+
+	def create_module(self, spec):
+		return self.loader.create_module(spec)
+
+	def exec_module(self, module):
+		stack = getattr(local, "stack", None)
+		if stack == None:
+			stack = local.stack = []
+		stack.append(0.0)
+		start = time.perf_counter()
+		try:
+			self.loader.exec_module(module)
+		finally:
+			elapsed = time.perf_counter() - start
+			nested = stack.pop()
+			if len(stack) > 0:
+				stack[-1] += elapsed
+			timings[module.__name__] = (elapsed - nested, elapsed)
+
+
+class TimingFinder(MetaPathFinder):
+	def find_spec(self, fullname, path, target = None):
+		for finder in sys.meta_path:
+			if finder is self or not hasattr(finder, "find_spec"):
+				continue
+			spec = finder.find_spec(fullname, path, target)
+			if spec != None:
+				if spec.loader != None and hasattr(spec.loader, "exec_module"):
+					spec.loader = TimingLoader(spec.loader)
+				return spec
+		return None
+
+
+def install():
+	global installed
+	if installed == None:
+		installed = TimingFinder()
+		sys.meta_path.insert(0, installed)
+	return installed
+
+
+def uninstall():
+	global installed
+	if installed != None and installed in sys.meta_path:
+		sys.meta_path.remove(installed)
+	installed = None
+
+
+def top(n = 25, key = "cumulative"):
+	col = 1 if key == "cumulative" else 0
+	return sorted(timings.items(), key = lambda x:x[1][col], reverse = True)[:n]
+
+
+def report(n = 25, out = None):
+	if out == None:
+		out = sys.stderr
+	if len(timings) == 0:
+		return
+	total = sum(t[0] for t in timings.values())
+	print(f"\nIMPORTS: {len(timings)} modules, {total*1000:.0f} ms total", file = out)
+	print(f"{'self ms':>9} {'cum ms':>9}  module", file = out)
+	for name, (self_time, cumulative) in top(n):
+		print(f"{self_time*1000:9.1f} {cumulative*1000:9.1f}  {name}", file = out)
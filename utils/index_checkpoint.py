@@ -0,0 +1,107 @@
+import os
+import json
+import shutil
+import hashlib
+
+
+def advance_digest(digest, doc_id):
+	return hashlib.sha1((digest + doc_id).encode("utf-8")).hexdigest()
+
+
+class IndexCheckpoint:
+	"""Durable progress of a batched index build.
+
+	The checkpoint file records how many documents have been committed and a
+	digest chained over their ids, so a resumed run can skip exactly those
+	documents (and refuse to resume if the document file changed). Stores
+	that only keep the index in memory pass snapshot_dir: every `every`
+	batches the index is persisted to a fresh folder there before the file
+	is replaced, so the file always names a complete snapshot. Stores that
+	commit each batch themselves (pgvector) leave it None.
+	"""
+
+	def __init__(self, filename, every = 1, snapshot_dir = None):
+		self.filename = filename
+		self.every = max(1, every)
+		self.snapshot_dir = snapshot_dir
+		self.state = None
+		self.progress = None
+		self.pending = 0
+		self.resumed = False
+
+	def load(self):
+		try:
+			with open(self.filename, "r") as fin:
+				return json.load(fin)
+		except FileNotFoundError:
+			return None
+
+	def start(self, resume = False):
+		self.state = self.load() if resume else None
+		self.resumed = self.state != None
+		if self.state == None:
+			# a checkpoint left by an earlier run belongs to a different build
+			self.clear()
+			self.state = {"documents": 0, "nodes": 0, "batches": 0, "digest": "", "snapshot": None}
+		else:
+			print(f"RESUMING after {self.state['documents']} documents ({self.state['nodes']} chunks, {self.state['batches']} batches)")
+		self.progress = dict(self.state)
+		self.pending = 0
+		return self.state
+
+	def snapshot(self):
+		return self.state["snapshot"] if self.state != None else None
+
+	def skip(self, docs):
+		"""Yields the documents after the committed ones, checking the skipped ones are the same documents."""
+		done = self.state["documents"]
+		digest = ""
+		skipped = 0
+		for doc in docs:
+			if skipped < done:
+				digest = advance_digest(digest, doc.doc_id)
+				skipped += 1
+				if skipped == done and digest != self.state["digest"]:
+					raise Exception(f"{self.__class__}: The documents changed since the checkpoint in {self.filename}; run again without --resume.")
+				continue
+			yield doc
+		if skipped < done:
+			raise Exception(f"{self.__class__}: The checkpoint in {self.filename} covers {done} documents but only {skipped} were given; run again without --resume.")
+
+	def commit(self, batch, nodes, persist = None):
+		for doc in batch:
+			self.progress["digest"] = advance_digest(self.progress["digest"], doc.doc_id)
+		self.progress["documents"] += len(batch)
+		self.progress["nodes"] += nodes
+		self.progress["batches"] += 1
+		self.pending += 1
+		if self.pending < self.every:
+			return
+		if self.snapshot_dir != None:
+			folder = os.path.join(self.snapshot_dir, f"{self.progress['batches']:06d}")
+			shutil.rmtree(folder, ignore_errors = True)
+			persist(folder)
+			self.progress["snapshot"] = folder
+		self.save(self.progress)
+		if self.snapshot_dir != None and self.state["snapshot"] != None and self.state["snapshot"] != self.progress["snapshot"]:
+			shutil.rmtree(self.state["snapshot"], ignore_errors = True)
+		self.state = dict(self.progress)
+		self.pending = 0
+
+	def save(self, state):
+		folder = os.path.dirname(os.path.abspath(self.filename))
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+		tmp = self.filename + ".tmp"
+		with open(tmp, "w") as fout:
+			json.dump(state, fout, indent = 4)
+			fout.flush()
+			os.fsync(fout.fileno())
+		os.replace(tmp, self.filename)
+
+	def clear(self):
+		for f in [self.filename, self.filename + ".tmp"]:
+			if os.path.exists(f):
+				os.remove(f)
+		if self.snapshot_dir != None:
+			shutil.rmtree(self.snapshot_dir, ignore_errors = True)
@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+MIN_INDEX_BYTES = 64 * 1024
+
+
+def estimate_index_bytes(index):
+	# Only in-memory stores hold vectors; a pgvector-backed index is just a
+	# handle. Node text and docstore overhead are roughly the size of the
+	# float vectors again, hence the factor of two.
+	if hasattr(index, "nbytes"):
+		return max(index.nbytes, MIN_INDEX_BYTES)
+	vector_store = getattr(index, "vector_store", None)
+	data = getattr(vector_store, "data", None)
+	embedding_dict = getattr(data, "embedding_dict", None)
+	total = 0
+	if embedding_dict:
+		for embedding in embedding_dict.values():
+			total += 2 * (8 * len(embedding) + 64)
+	return max(total, MIN_INDEX_BYTES)
+
+
+class IndexRegistry:
+	"""Thread-safe LRU cache of loaded indexes, keyed by table or index name."""
+
+	def __init__(self, loader, max_indexes = 16, max_memory_mb = None, sizeof = estimate_index_bytes):
+		self.loader = loader
+		self.max_indexes = max_indexes
+		self.max_bytes = None if max_memory_mb == None else int(max_memory_mb * 1024 * 1024)
+		self.sizeof = sizeof
+		self.entries = OrderedDict()
+		self.loading = {}
+		self.lock = threading.Lock()
+
+	@classmethod
+	def from_settings(cls, loader, settings = None):
+		settings = settings or {}
+		return cls(loader, max_indexes = settings.get("max_indexes", 16), max_memory_mb = settings.get("max_memory_mb"))
+
+	def __contains__(self, key):
+		with self.lock:
+			return key in self.entries
+
+	def __len__(self):
+		with self.lock:
+			return len(self.entries)
+
+	def get(self, key):
+		with self.lock:
+			if key in self.entries:
+				self.entries.move_to_end(key)
+				return self.entries[key][0]
+			load_lock = self.loading.setdefault(key, threading.Lock())
+		# one loader per key; other threads asking for the same key wait for it
+		with load_lock:
+			with self.lock:
+				if key in self.entries:
+					self.entries.move_to_end(key)
+					return self.entries[key][0]
+			try:
+				index = self.loader(key)
+				if index == None:
+					raise Exception(f"{self.__class__}: Could not load index \"{key}\".")
+				nbytes = self.sizeof(index)
+				with self.lock:
+					self.entries[key] = (index, nbytes)
+					self.evict()
+			finally:
+				# also after a failed load, so the lock of a missing index does not stay behind
+				with self.lock:
+					self.loading.pop(key, None)
+		return index
+
+	def put(self, key, index):
+		with self.lock:
+			self.entries[key] = (index, self.sizeof(index))
+			self.entries.move_to_end(key)
+			self.evict()
+
+	def total_bytes(self):
+		return sum(nbytes for _, nbytes in self.entries.values())
+
+	def evict(self):
+		# caller holds the lock; the most recently used index is never evicted
+		while len(self.entries) > 1:
+			over_count = self.max_indexes != None and len(self.entries) > self.max_indexes
+			over_memory = self.max_bytes != None and self.total_bytes() > self.max_bytes
+			if not over_count and not over_memory:
+				break
+			key, _ = self.entries.popitem(last = False)
+			print(f"evicted index {key}")
+
+	def invalidate(self, key):
+		with self.lock:
+			self.entries.pop(key, None)
+
+	def warm_up(self, keys, workers = 4):
+		keys = list(keys)
+		if len(keys) == 0:
+			return
+		with ThreadPoolExecutor(max_workers = min(workers, len(keys))) as pool:
+			list(pool.map(self.get, keys))
+
+	def stats(self):
+		with self.lock:
+			return {"indexes": list(self.entries.keys()), "count": len(self.entries), "bytes": self.total_bytes()}
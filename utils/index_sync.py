@@ -0,0 +1,57 @@
+import hashlib
+
+
+def chunk_id(text):
+	return "chunk_" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+
+
+def batched(items, size):
+	"""Yields lists of up to size items, pulling from items (a list or a generator) only as needed."""
+	batch = []
+	for item in items:
+		batch.append(item)
+		if len(batch) >= size:
+			yield batch
+			batch = []
+	if len(batch) > 0:
+		yield batch
+
+
+def node_id(i, doc):
+	# used as the node parsers' id_func: the same document always yields the
+	# same node ids, so a resumed or repeated build matches a fresh one
+	return f"{doc.doc_id}_{i}"
+
+
+def doc_text(record):
+	# processed_docs.json used to map ids straight to text; newer files map
+	# ids to {"text", "source", "section"} records.
+	if isinstance(record, dict):
+		return record["text"]
+	return record
+
+
+def doc_metadata(doc_id, record):
+	metadata = {"id": doc_id}
+	if isinstance(record, dict):
+		for k in record:
+			if k != "text" and record[k] is not None:
+				metadata[k] = record[k]
+	return metadata
+
+
+def diff_docs(docs, existing_ids):
+	"""Splits llama_index Documents against the ref doc ids already indexed.
+
+	Returns:
+		tuple: (documents not yet in the index, ids in the index that are no longer in docs).
+	"""
+	existing_ids = set(existing_ids)
+	current_ids = set()
+	new_docs = []
+	for doc in docs:
+		current_ids.add(doc.doc_id)
+		if doc.doc_id not in existing_ids:
+			new_docs.append(doc)
+	stale_ids = sorted(existing_ids - current_ids)
+	return new_docs, stale_ids
@@ -1,6 +1,5 @@
 import json
 import re
-import openai
 
 def openai_json_fixer(jsonstr, model):
   system = """
@@ -32,6 +31,7 @@ Please correct this JSON:
   if model.find("-1106")==-1:
     del args["response_format"]
 
+  import openai
   response = openai.chat.completions.create( **args )
   return response
 
@@ -1,19 +1,162 @@
-import openai
 import os
 import json
-import os
-import logging
-from pydantic import BaseModel
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from utils.json_repair import fix_json, clean_json
-import warnings
-import requests
+from utils import metrics
+
+RETRYABLE_STATUS = [408, 409, 429, 500, 502, 503, 504]
+# openai and requests exceptions that are worth another attempt
+RETRYABLE_ERRORS = ["RateLimitError", "APITimeoutError", "APIConnectionError", "InternalServerError",
+    "Timeout", "ConnectionError", "ChunkedEncodingError"]
+
+
+class TokenBucket:
+    """Lets `rate` calls per second through on average, with bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity != None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def status_code(e):
+    code = getattr(e, "status_code", None)
+    if code == None and getattr(e, "response", None) != None:
+        code = getattr(e.response, "status_code", None)
+    return code
+
+
+def is_retryable(e):
+    code = status_code(e)
+    if code != None:
+        return code in RETRYABLE_STATUS
+    return any(c.__name__ in RETRYABLE_ERRORS for c in type(e).__mro__)
+
+
+def retry_after(e):
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def backoff(attempt, base_delay, max_delay):
+    # full jitter, so workers that hit a 429 together do not all retry together
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def map_prompts(new_invoker, prompts, model=None, concurrency=4, requests_per_minute=None, burst=None, max_retries=5,
+        base_delay=1.0, max_delay=60.0, return_exceptions=False, progress=True):
+    """Runs every prompt through its own invoker from new_invoker() and returns the replies in prompt order.
+
+    At most `concurrency` calls are in flight and, with requests_per_minute,
+    calls start no faster than that. Rate limits, timeouts and 5xx replies
+    are retried up to max_retries times with jittered exponential backoff
+    (or the server's Retry-After). A prompt that still fails raises, or with
+    return_exceptions its exception is returned in its place.
+    """
+    prompts = list(prompts)
+    if len(prompts) == 0:
+        return []
+    bucket = None
+    if requests_per_minute:
+        bucket = TokenBucket(requests_per_minute / 60.0, burst)
+    state = {"done": 0, "failed": 0, "retries": 0, "reported": 0.0}
+    lock = threading.Lock()
+    start = time.monotonic()
+
+    def report(final=False):
+        now = time.monotonic()
+        if not progress or (not final and now - state["reported"] < 1.0):
+            return
+        state["reported"] = now
+        elapsed = now - start
+        print(f"LLM {state['done']}/{len(prompts)} done, {state['failed']} failed, {state['retries']} retries ({state['done'] / max(elapsed, 1e-6) * 60:.0f}/min)")
+
+    def run(prompt):
+        attempt = 0
+        while True:
+            if bucket != None:
+                bucket.acquire()
+            try:
+                result = "".join(new_invoker().ask_llm(prompt, model))
+                break
+            except Exception as e:
+                if attempt >= max_retries or not is_retryable(e):
+                    with lock:
+                        state["done"] += 1
+                        state["failed"] += 1
+                        report()
+                    metrics.count("llm_failures", error=e.__class__.__name__)
+                    if return_exceptions:
+                        return e
+                    raise
+                metrics.count("llm_retries", error=e.__class__.__name__)
+                with lock:
+                    state["retries"] += 1
+                time.sleep(max(backoff(attempt, base_delay, max_delay), retry_after(e)))
+                attempt += 1
+        with lock:
+            state["done"] += 1
+            report()
+        return result
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(prompts))), thread_name_prefix="llm")
+    try:
+        results = list(pool.map(run, prompts))
+    finally:
+        # after a failure, prompts that have not started are dropped
+        pool.shutdown(cancel_futures=True)
+    report(final=True)
+    return results
+
+
+# one client per base url, shared by the invokers map() creates
+openai_clients = {}
+openai_lock = threading.Lock()
+
+
+def openai_client(base_url):
+    import openai
+    with openai_lock:
+        if base_url not in openai_clients:
+            # local OpenAI-compatible servers do not check the key, but the client insists on one
+            openai_clients[base_url] = openai.OpenAI(base_url=base_url, api_key=os.getenv("OPENAI_API_KEY") or "unused")
+        return openai_clients[base_url]
+
 
 class LLMInvoker:
-    def __init__(self, llm="openai", json_output=False):
+    def __init__(self, llm="openai", json_output=False, base_url=None):
         self.json_output = json_output
         self.default_llm = llm
         self.all_text = ""
         self.last_response = ""
+        # OPENAI_BASE_URL and OLLAMA_HOST are the variables the OpenAI SDK and Ollama read themselves
+        if base_url == None and llm == "openai":
+            base_url = os.getenv("OPENAI_BASE_URL")
+        elif base_url == None and llm == "ollama":
+            base_url = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+            if base_url.find("://") == -1:
+                base_url = "http://" + base_url
+        self.base_url = base_url.rstrip("/") if base_url != None else None
 
     def json(self):
         json_value = None
@@ -37,6 +180,13 @@ class LLMInvoker:
           return "llama3"
 
     def ask_llm(self, prompt, model=None, stream=True):
+        return metrics.stream("llm", self.stream_llm(prompt, model, stream), llm=self.default_llm)
+
+    def map(self, prompts, model=None, **settings):
+        """ask_llm for many prompts at once; settings are map_prompts' (concurrency, requests_per_minute, max_retries, ...)."""
+        return map_prompts(lambda: self.__class__(self.default_llm, self.json_output, self.base_url), prompts, model=model, **settings)
+
+    def stream_llm(self, prompt, model=None, stream=True):
         model = self.pick_model(model)
 
         for itm in self.call_llm(
@@ -50,26 +200,29 @@ class LLMInvoker:
                         self.all_text += content
                         yield content
             elif self.default_llm=="ollama":
+                self.all_text += itm
                 yield itm
     def ask_ollama(self, prompt):
-        full_text = ""
-        all_text=""
-        for response in requests.post('http://localhost:11434/api/chat', stream=True, data=json.dumps({
+        import requests
+        messages = prompt if isinstance(prompt, list) else [{"role":"user","content":prompt}]
+        response = requests.post(f"{self.base_url}/api/chat", stream=True, timeout=(10, 600), data=json.dumps({
           "model": "llama3",
-          "messages":[{"role":"user","content":prompt}]
-        })):
-          txt = response.decode().strip()
-          all_text+=txt
-          try:
-            data = json.loads(all_text)
-            txt = data["message"]["content"]
-            yield txt
-            full_text+=txt
-            all_text = ""
-          except Exception as e:
-            # print(e)
+          "messages": messages
+        }))
+        # raises requests.HTTPError, which map() retries for 429 and 5xx
+        response.raise_for_status()
+        # the reply is one JSON object per line; network chunks can split a line or hold several
+        for line in response.iter_lines():
+          if not line:
             continue
-        return full_text
+          data = json.loads(line)
+          if "error" in data:
+            raise Exception(f"{self.__class__}: Ollama error: {data['error']}")
+          txt = data.get("message", {}).get("content", "")
+          if txt:
+            yield txt
+          if data.get("done"):
+            break
 
     def ask_openai(self, prompt, model="gpt-4o", stream=True):
         args = {
@@ -87,5 +240,8 @@ class LLMInvoker:
         ):
             del args["response_format"]
 
+        if self.base_url != None:
+            return openai_client(self.base_url).chat.completions.create(**args)
+        import openai
         response = openai.chat.completions.create(**args)
         return response
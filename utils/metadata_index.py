@@ -0,0 +1,103 @@
+import json
+import os
+import numpy as np
+
+SKIP_FIELDS = ["id"]
+
+
+class MetadataIndex:
+	"""Posting lists of node positions for every (field, value) pair in node metadata.
+
+	All lists live in one sorted int32 array, memory-mapped on load. A filter
+	is OR across the values given for one field and AND across fields.
+	"""
+
+	def __init__(self, node_ids, directory, postings):
+		self.node_ids = node_ids
+		self.directory = directory
+		self.postings = postings
+
+	@classmethod
+	def build(cls, node_ids, metadatas):
+		lists = {}
+		for pos, metadata in enumerate(metadatas):
+			for field in metadata:
+				value = metadata[field]
+				if field in SKIP_FIELDS or not isinstance(value, (str, int, float, bool)):
+					continue
+				lists.setdefault(field, {}).setdefault(str(value), []).append(pos)
+		directory = {}
+		chunks = []
+		offset = 0
+		for field in sorted(lists):
+			directory[field] = {}
+			for value in sorted(lists[field]):
+				plist = lists[field][value]
+				directory[field][value] = [offset, len(plist)]
+				chunks.append(np.array(plist, dtype = np.int32))
+				offset += len(plist)
+		postings = np.concatenate(chunks) if len(chunks) > 0 else np.zeros(0, dtype = np.int32)
+		return cls(list(node_ids), directory, postings)
+
+	@classmethod
+	def from_index(cls, index):
+		docs = index.docstore.docs
+		node_ids = list(docs.keys())
+		return cls.build(node_ids, [docs[n].metadata for n in node_ids])
+
+	def save(self, folder):
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+		np.save(os.path.join(folder, "postings.npy"), self.postings)
+		with open(os.path.join(folder, "metadata_index.json"), "w") as fout:
+			json.dump({"node_ids": self.node_ids, "directory": self.directory}, fout)
+
+	@classmethod
+	def load(cls, folder):
+		with open(os.path.join(folder, "metadata_index.json"), "r") as fin:
+			meta = json.load(fin)
+		return cls(meta["node_ids"], meta["directory"], np.load(os.path.join(folder, "postings.npy"), mmap_mode = "r"))
+
+	def fields(self):
+		return {field: list(self.directory[field].keys()) for field in self.directory}
+
+	def posting_list(self, field, value):
+		entry = self.directory.get(field, {}).get(str(value))
+		if entry == None:
+			return np.zeros(0, dtype = np.int32)
+		return np.asarray(self.postings[entry[0]:entry[0] + entry[1]])
+
+	def match_positions(self, filters):
+		result = None
+		# smallest field first keeps the intersections short
+		fields = []
+		for field in filters:
+			values = filters[field]
+			if not isinstance(values, (list, tuple, set)):
+				values = [values]
+			positions = np.zeros(0, dtype = np.int32)
+			for value in values:
+				positions = np.union1d(positions, self.posting_list(field, value))
+			fields.append(positions)
+		for positions in sorted(fields, key = len):
+			result = positions if result is None else np.intersect1d(result, positions, assume_unique = True)
+			if len(result) == 0:
+				break
+		return result
+
+	def match(self, filters):
+		positions = self.match_positions(filters)
+		if positions is None:
+			return None
+		return [self.node_ids[i] for i in positions]
+
+
+def parse_filters(filter_args):
+	"""Turns CLI-style ["source=a.pdf", "source=b.pdf", "brand=x"] into {"source": ["a.pdf", "b.pdf"], "brand": ["x"]}."""
+	filters = {}
+	for arg in filter_args or []:
+		if arg.find("=") == -1:
+			raise Exception(f"Filters must look like field=value, got \"{arg}\".")
+		field, value = arg.split("=", 1)
+		filters.setdefault(field.strip(), []).append(value.strip())
+	return filters
@@ -0,0 +1,218 @@
+import json
+import time
+import threading
+from contextlib import nullcontext
+
+# Process-wide timers, counters and histograms. Nothing is recorded until
+# enable() is called; until then timer() hands back a shared no-op context and
+# the other calls return after one global check.
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+RATE_BUCKETS = [1, 5, 10, 20, 50, 100, 200, 500, 1000]
+
+registry = None
+NOOP = nullcontext()
+
+
+class Histogram:
+	def __init__(self, buckets):
+		self.buckets = buckets
+		self.counts = [0] * len(buckets)
+		self.count = 0
+		self.sum = 0.0
+		self.min = None
+		self.max = None
+
+	def observe(self, value):
+		self.count += 1
+		self.sum += value
+		self.min = value if self.min == None else min(self.min, value)
+		self.max = value if self.max == None else max(self.max, value)
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				self.counts[i] += 1
+				break
+
+	def to_dict(self):
+		return {"count": self.count, "sum": self.sum, "mean": self.sum / self.count if self.count else 0, "min": self.min, "max": self.max,
+			"buckets": {str(b): c for b, c in zip(self.buckets, self.counts)}}
+
+
+class Metrics:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.counters = {}
+		self.histograms = {}
+
+	def count(self, name, n, labels):
+		key = (name, labels)
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + n
+
+	def observe(self, name, value, buckets, labels):
+		key = (name, labels)
+		with self.lock:
+			if key not in self.histograms:
+				self.histograms[key] = Histogram(buckets or LATENCY_BUCKETS)
+			self.histograms[key].observe(value)
+
+	def to_dict(self):
+		with self.lock:
+			return {
+				"counters": [{"name": k[0], "labels": dict(k[1]), "value": v} for k, v in sorted(self.counters.items())],
+				"histograms": [dict({"name": k[0], "labels": dict(k[1])}, **h.to_dict()) for k, h in sorted(self.histograms.items(), key = lambda x:x[0])],
+			}
+
+	def to_prometheus(self, prefix = "ragtime_"):
+		def fmt(labels, extra = None):
+			pairs = list(labels) + ([extra] if extra else [])
+			if len(pairs) == 0:
+				return ""
+			return "{" + ",".join(f"{k}=\"{str(v)}\"" for k, v in pairs) + "}"
+		lines = []
+		with self.lock:
+			seen = set()
+			for (name, labels), value in sorted(self.counters.items()):
+				if name not in seen:
+					lines.append(f"# TYPE {prefix}{name}_total counter")
+					seen.add(name)
+				lines.append(f"{prefix}{name}_total{fmt(labels)} {value}")
+			for (name, labels), h in sorted(self.histograms.items(), key = lambda x:x[0]):
+				if name not in seen:
+					lines.append(f"# TYPE {prefix}{name} histogram")
+					seen.add(name)
+				cumulative = 0
+				for bound, c in zip(h.buckets, h.counts):
+					cumulative += c
+					lines.append(f"{prefix}{name}_bucket{fmt(labels, ('le', bound))} {cumulative}")
+				lines.append(f"{prefix}{name}_bucket{fmt(labels, ('le', '+Inf'))} {h.count}")
+				lines.append(f"{prefix}{name}_sum{fmt(labels)} {h.sum}")
+				lines.append(f"{prefix}{name}_count{fmt(labels)} {h.count}")
+		return "\n".join(lines) + "\n"
+
+
+class Timer:
+	def __init__(self, name, labels):
+		self.name = name
+		self.labels = labels
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *exc):
+		registry.observe(f"{self.name}_seconds", time.perf_counter() - self.start, None, self.labels)
+		return False
+
+
+def label_key(labels):
+	return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def enable():
+	global registry
+	if registry == None:
+		registry = Metrics()
+	return registry
+
+
+def disable():
+	global registry
+	registry = None
+
+
+def enabled():
+	return registry != None
+
+
+def timer(name, **labels):
+	"""with metrics.timer("extract", format="pdf"): ... records extract_seconds."""
+	if registry == None:
+		return NOOP
+	return Timer(name, label_key(labels))
+
+
+def count(name, n = 1, **labels):
+	if registry == None:
+		return
+	registry.count(name, n, label_key(labels))
+
+
+def observe(name, value, buckets = None, **labels):
+	if registry == None:
+		return
+	registry.observe(name, value, buckets, label_key(labels))
+
+
+def stream(name, tokens, **labels):
+	"""Wraps a token generator to record first-token latency, total time, token count and tokens/s.
+	Time spent by the consumer between tokens counts too, as the caller sees it."""
+	if registry == None:
+		return tokens
+	return timed_stream(name, tokens, labels)
+
+
+def timed_stream(name, tokens, labels):
+	start = time.perf_counter()
+	first = None
+	n = 0
+	try:
+		for token in tokens:
+			if first == None:
+				first = time.perf_counter() - start
+				observe(f"{name}_first_token_seconds", first, **labels)
+			n += 1
+			yield token
+	finally:
+		total = time.perf_counter() - start
+		observe(f"{name}_seconds", total, **labels)
+		count(f"{name}_tokens", n, **labels)
+		if n > 1 and total > first:
+			observe(f"{name}_tokens_per_second", (n - 1) / (total - first), buckets = RATE_BUCKETS, **labels)
+
+
+def instrument_embed_model(embed_model):
+	"""Times embedding calls through llama_index's callback events (embed_seconds, embed_chunks)."""
+	if registry == None:
+		return embed_model
+	from llama_index.core.callbacks import CallbackManager, CBEventType, EventPayload
+	from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+
+	class EmbeddingMetrics(BaseCallbackHandler):
+		def __init__(self):
+			super().__init__(event_starts_to_ignore = [], event_ends_to_ignore = [])
+			self.starts = {}
+
+		def on_event_start(self, event_type, payload = None, event_id = "", parent_id = "", **kwargs):
+			if event_type == CBEventType.EMBEDDING:
+				self.starts[event_id] = time.perf_counter()
+			return event_id
+
+		def on_event_end(self, event_type, payload = None, event_id = "", **kwargs):
+			start = self.starts.pop(event_id, None)
+			if start == None:
+				return
+			observe("embed_seconds", time.perf_counter() - start)
+			if payload != None and EventPayload.CHUNKS in payload:
+				count("embed_chunks", len(payload[EventPayload.CHUNKS]))
+
+		def start_trace(self, trace_id = None):
+			pass
+
+		def end_trace(self, trace_id = None, trace_map = None):
+			pass
+
+	embed_model.callback_manager = CallbackManager([EmbeddingMetrics()])
+	return embed_model
+
+
+def export(filename, fmt = None):
+	if registry == None:
+		return
+	if fmt == None:
+		fmt = "prometheus" if filename.endswith(".prom") or filename.endswith(".txt") else "json"
+	with open(filename, "w") as fout:
+		if fmt == "prometheus":
+			fout.write(registry.to_prometheus())
+		else:
+			json.dump(registry.to_dict(), fout, indent = 4)
@@ -0,0 +1,189 @@
+import os
+import threading
+from contextlib import contextmanager
+import psycopg2
+
+# One pool per process, shared by every Postgres path. It is a single
+# SQLAlchemy engine: the llama_index PGVectorStore objects cached per table by
+# get_vector_store() all run on it, and raw psycopg2 access (id listing,
+# deletes, bulk COPY) borrows its connections through connection(), so
+# max_size caps the connections of the whole process.
+
+_lock = threading.Lock()
+_settings = {}
+_engine = None
+_async_engine = None
+_vector_stores = {}
+
+DEFAULT_POOL_SETTINGS = {
+  "pool_size": 1,
+  "max_size": 10,
+  "connect_timeout": 3,
+  "acquire_timeout": 30,
+  "statement_timeout_ms": 30000,
+  "health_check": True,
+  "recycle_seconds": 300
+}
+
+
+def configure(database_settings=None, use_environment_variables=True):
+  """Sets connection and pool parameters. Must be called before the first connection is made."""
+  global _settings
+  database_settings = database_settings or {}
+  settings = dict(DEFAULT_POOL_SETTINGS)
+  settings.update(database_settings.get("pool", {}))
+  if use_environment_variables:
+    # main.py has always used DATABASE_*, the vector stores PG_DB_*
+    settings["host"] = os.environ.get("DATABASE_HOST", os.environ.get("PG_DB_HOST"))
+    settings["user"] = os.environ.get("DATABASE_USER", os.environ.get("PG_DB_USER"))
+    settings["password"] = os.environ.get("DATABASE_PASS", os.environ.get("PG_DB_PASS"))
+    settings["database"] = os.environ.get("DATABASE_DATABASE", os.environ.get("PG_DB_DBASE"))
+    settings["port"] = int(os.environ.get("DATABASE_PORT", 5432))
+  else:
+    settings["host"] = database_settings["database_host"]
+    settings["user"] = database_settings["database_user"]
+    settings["password"] = database_settings["database_pass"]
+    settings["database"] = database_settings["database_database"]
+    settings["port"] = int(database_settings.get("database_port", 5432))
+  with _lock:
+    if _engine != None:
+      raise Exception("pg_pool: already connected; call close_all() before reconfiguring.")
+    _settings = settings
+
+
+def get_settings():
+  if len(_settings) == 0:
+    configure()
+  return _settings
+
+
+def connection_params():
+  settings = get_settings()
+  return {
+    "connect_timeout": settings["connect_timeout"],
+    "options": f"-c statement_timeout={int(settings['statement_timeout_ms'])}",
+    "application_name": "ragtime"
+  }
+
+
+def engine_kwargs():
+  settings = get_settings()
+  # Connections are opened on demand. Up to pool_size of them stay open between
+  # uses; the rest, up to max_size in total, are closed as they are returned.
+  pool_size = min(settings["pool_size"], settings["max_size"])
+  return {
+    "pool_size": pool_size,
+    "max_overflow": settings["max_size"] - pool_size,
+    "pool_timeout": settings["acquire_timeout"],
+    # a SELECT 1 on each checkout, so a connection the server dropped is replaced before use
+    "pool_pre_ping": settings["health_check"],
+    # reopened at the first checkout after this many seconds since it was opened (not since it was last used); 0 never
+    "pool_recycle": settings["recycle_seconds"] if settings["recycle_seconds"] > 0 else -1
+  }
+
+
+def get_engine():
+  global _engine
+  if _engine != None:
+    return _engine
+  with _lock:
+    if _engine == None:
+      from sqlalchemy import create_engine
+      _engine = create_engine(sqlalchemy_url(), connect_args=connection_params(), **engine_kwargs())
+  return _engine
+
+
+def get_async_engine():
+  # PGVectorStore needs one alongside the sync engine; only its async methods use it, which this
+  # tree does not call, and it connects lazily, so it is held to a single connection
+  global _async_engine
+  if _async_engine != None:
+    return _async_engine
+  with _lock:
+    if _async_engine == None:
+      from sqlalchemy.ext.asyncio import create_async_engine
+      _async_engine = create_async_engine(sqlalchemy_url("postgresql+asyncpg"), pool_size=1, max_overflow=0,
+        pool_timeout=get_settings()["acquire_timeout"], pool_pre_ping=get_settings()["health_check"])
+  return _async_engine
+
+
+@contextmanager
+def connection(autocommit=False):
+  """A raw psycopg2 connection borrowed from the shared engine's pool."""
+  from sqlalchemy.exc import TimeoutError as PoolTimeout
+  try:
+    fairy = get_engine().raw_connection()
+  except PoolTimeout:
+    raise Exception("pg_pool: timed out waiting for a free connection.")
+  conn = fairy.dbapi_connection
+  try:
+    conn.autocommit = autocommit
+    yield conn
+  finally:
+    if conn.closed != 0:
+      # dropped from the pool instead of being handed out again
+      fairy.invalidate()
+    else:
+      if not conn.autocommit:
+        conn.rollback()
+      conn.autocommit = False
+    fairy.close()
+
+
+def sqlalchemy_url(drivername="postgresql+psycopg2"):
+  settings = get_settings()
+  from sqlalchemy.engine import URL
+  return URL.create(drivername, username=settings["user"], password=settings["password"],
+    host=settings["host"], port=settings["port"], database=settings["database"])
+
+
+def get_vector_store(table_name, embed_dim=384):
+  if table_name in _vector_stores:
+    return _vector_stores[table_name]
+  engine = get_engine()
+  async_engine = get_async_engine()
+  with _lock:
+    if table_name not in _vector_stores:
+      from llama_index.vector_stores.postgres import PGVectorStore
+      # every table runs on the one shared engine rather than creating its own
+      _vector_stores[table_name] = PGVectorStore(
+        table_name=table_name,
+        embed_dim=embed_dim,
+        engine=engine,
+        async_engine=async_engine
+      )
+  return _vector_stores[table_name]
+
+
+def close_all():
+  global _engine, _async_engine
+  with _lock:
+    if _engine != None:
+      _engine.dispose()
+    if _async_engine != None:
+      # nothing here has used it; dropping the pool without awaiting is enough
+      _async_engine.sync_engine.dispose(close=False)
+    _engine = None
+    _async_engine = None
+    _vector_stores.clear()
+
+
+if __name__=="__main__":
+  # Smoke test against a local Postgres, e.g.
+  # DATABASE_HOST=localhost DATABASE_USER=postgres DATABASE_PASS=postgres DATABASE_DATABASE=postgres python -m utils.pg_pool
+  from concurrent.futures import ThreadPoolExecutor
+  configure({"pool": {"pool_size": 1, "max_size": 4, "statement_timeout_ms": 1000, "recycle_seconds": 0}})
+  def check(i):
+    with connection() as conn, conn.cursor() as cur:
+      cur.execute("SELECT pg_backend_pid(), current_setting('statement_timeout')")
+      return cur.fetchone()
+  with ThreadPoolExecutor(16) as pool:
+    results = list(pool.map(check, range(64)))
+  print(f"{len(results)} queries on {len(set(r[0] for r in results))} backend connections, statement_timeout={results[0][1]}")
+  try:
+    with connection() as conn, conn.cursor() as cur:
+      cur.execute("SELECT pg_sleep(2)")
+    print("statement timeout NOT enforced")
+  except psycopg2.errors.QueryCanceled:
+    print("statement timeout enforced")
+  close_all()
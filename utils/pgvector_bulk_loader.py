@@ -0,0 +1,146 @@
+import csv
+import io
+import json
+import time
+from psycopg2 import sql
+from utils import pg_pool
+from utils import metrics
+from utils.index_sync import batched
+from llama_index.core.schema import MetadataMode
+from llama_index.core.vector_stores.utils import node_to_metadata_dict
+
+
+# method -> (indexed expression, operator class, distance operator, query expression)
+QUANTIZED_EXPRESSIONS = {
+  "binary": ("binary_quantize(embedding)::bit({dim})", "bit_hamming_ops", "<~>", "binary_quantize(%(embedding)s::vector)::bit({dim})"),
+  "halfvec": ("embedding::halfvec({dim})", "halfvec_cosine_ops", "<=>", "%(embedding)s::halfvec({dim})")
+}
+
+
+def vector_literal(embedding):
+  return "[" + ",".join(repr(float(x)) for x in embedding) + "]"
+
+
+def quantized_expressions(method, embed_dim):
+  if method not in QUANTIZED_EXPRESSIONS:
+    raise Exception(f"Unknown pgvector quantization method \"{method}\" (expected binary or halfvec).")
+  expr, ops, op, query_expr = QUANTIZED_EXPRESSIONS[method]
+  return expr.format(dim=int(embed_dim)), ops, op, query_expr.format(dim=int(embed_dim))
+
+
+class PGVectorBulkLoader:
+  """Streams embeddings into a PGVectorStore-layout table with COPY and builds the vector index once at the end."""
+
+  def __init__(self, embed_model, node_parser, embed_dim=384, settings=None):
+    settings = settings or {}
+    self.embed_model = embed_model
+    self.node_parser = node_parser
+    self.embed_dim = embed_dim
+    self.batch_size = settings.get("batch_size", 1000)
+    self.truncate = settings.get("truncate", True)
+    self.index_method = settings.get("index_method", "hnsw")
+    self.hnsw_m = settings.get("hnsw_m", 16)
+    self.hnsw_ef_construction = settings.get("hnsw_ef_construction", 64)
+    self.ivfflat_lists = settings.get("ivfflat_lists", 100)
+    self.maintenance_work_mem = settings.get("maintenance_work_mem", "1GB")
+    self.parallel_workers = settings.get("parallel_workers", 2)
+    self.quantization = settings.get("quantization")
+    self.metadata_indexes = settings.get("metadata_indexes", ["source", "section"])
+
+  def table_ident(self, table_name):
+    return sql.Identifier(f"data_{table_name}".lower())
+
+  def index_ident(self, table_name):
+    return sql.Identifier(f"data_{table_name}_embedding_idx".lower())
+
+  def prepare_table(self, cur, table_name):
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cur.execute(sql.SQL("""CREATE TABLE IF NOT EXISTS {} (
+      id BIGSERIAL PRIMARY KEY,
+      text VARCHAR NOT NULL,
+      metadata_ JSON,
+      node_id VARCHAR,
+      embedding VECTOR({}))""").format(self.table_ident(table_name), sql.Literal(self.embed_dim)))
+    cur.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(self.index_ident(table_name)))
+    if self.truncate:
+      cur.execute(sql.SQL("TRUNCATE {}").format(self.table_ident(table_name)))
+
+  def batches(self, docs):
+    return batched(docs, self.batch_size)
+
+  def csv_rows(self, nodes, embeddings):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for node, embedding in zip(nodes, embeddings):
+      metadata = node_to_metadata_dict(node, remove_text=True, flat_metadata=False)
+      writer.writerow([
+        node.get_content(metadata_mode=MetadataMode.NONE).replace("\x00", ""),
+        json.dumps(metadata),
+        node.node_id,
+        vector_literal(embedding)
+      ])
+    buf.seek(0)
+    return buf
+
+  def copy_batch(self, cur, table_name, docs):
+    with metrics.timer("chunk"):
+      nodes = self.node_parser.get_nodes_from_documents(docs)
+    texts = [n.get_content(metadata_mode=MetadataMode.EMBED) for n in nodes]
+    embeddings = self.embed_model.get_text_embedding_batch(texts)
+    copy = sql.SQL("COPY {} (text, metadata_, node_id, embedding) FROM STDIN WITH (FORMAT csv)").format(self.table_ident(table_name))
+    with metrics.timer("store", store="database"):
+      cur.execute("SET LOCAL statement_timeout = 0")
+      cur.copy_expert(copy.as_string(cur), self.csv_rows(nodes, embeddings))
+    metrics.count("stored_nodes", len(nodes), store="database")
+    return len(nodes)
+
+  def build_vector_index(self, cur, table_name):
+    # SET LOCAL so the pooled connection goes back with its usual settings
+    cur.execute("SET LOCAL statement_timeout = 0")
+    cur.execute(sql.SQL("SET LOCAL maintenance_work_mem = {}").format(sql.Literal(self.maintenance_work_mem)))
+    cur.execute(sql.SQL("SET LOCAL max_parallel_maintenance_workers = {}").format(sql.Literal(self.parallel_workers)))
+    # With quantization the index is built over the quantized expression
+    # (bit or halfvec) and PGVectorHelper rescores the shortlist with the
+    # stored float vectors.
+    indexed = sql.SQL("embedding vector_cosine_ops")
+    if self.quantization != None:
+      expr, ops, _, _ = quantized_expressions(self.quantization["method"], self.embed_dim)
+      indexed = sql.SQL("(" + expr + ") " + ops)
+    if self.index_method == "hnsw":
+      stmt = sql.SQL("CREATE INDEX {} ON {} USING hnsw ({}) WITH (m = {}, ef_construction = {})").format(
+        self.index_ident(table_name), self.table_ident(table_name), indexed,
+        sql.Literal(self.hnsw_m), sql.Literal(self.hnsw_ef_construction))
+    elif self.index_method == "ivfflat":
+      stmt = sql.SQL("CREATE INDEX {} ON {} USING ivfflat ({}) WITH (lists = {})").format(
+        self.index_ident(table_name), self.table_ident(table_name), indexed, sql.Literal(self.ivfflat_lists))
+    elif self.index_method == None or self.index_method == "none":
+      self.build_metadata_indexes(cur, table_name)
+      return
+    else:
+      raise Exception(f"{self.__class__}: Unknown index_method \"{self.index_method}\" (expected hnsw, ivfflat or none).")
+    cur.execute(stmt)
+    self.build_metadata_indexes(cur, table_name)
+    cur.execute(sql.SQL("ANALYZE {}").format(self.table_ident(table_name)))
+
+  def build_metadata_indexes(self, cur, table_name):
+    # btree on metadata_->>'key' so filtered queries only visit matching rows
+    for key in self.metadata_indexes:
+      cur.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} ((metadata_->>{}))").format(
+        sql.Identifier(f"data_{table_name}_meta_{key}_idx".lower()), self.table_ident(table_name), sql.Literal(key)))
+
+  def load(self, docs, table_name):
+    with pg_pool.connection() as db:
+      with db, db.cursor() as cur:
+        self.prepare_table(cur, table_name)
+    loaded = 0
+    start = time.time()
+    for batch in self.batches(docs):
+      with pg_pool.connection() as db:
+        with db, db.cursor() as cur:
+          loaded += self.copy_batch(cur, table_name, batch)
+      print(f"copied {loaded} rows into data_{table_name} ({loaded / max(time.time() - start, 1e-6):.0f} rows/s)")
+    print(f"building {self.index_method} index on data_{table_name}")
+    with pg_pool.connection() as db:
+      with db, db.cursor() as cur:
+        self.build_vector_index(cur, table_name)
+    return loaded
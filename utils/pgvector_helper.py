@@ -1,39 +1,41 @@
 from loguru import logger
 import os
-from llama_index.indices.vector_store import VectorStoreIndex
-from llama_index.embeddings import LangchainEmbedding
-
-from llama_index import Document, StorageContext, ServiceContext, get_response_synthesizer
-#from langchain.llms.vertexai import VertexAI
-from langchain_community.llms import VertexAI
-#from langchain.embeddings import HuggingFaceEmbeddings 
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from llama_index.vector_stores import PGVectorStore
-from llama_index.node_parser import SimpleNodeParser
+from llama_index.core import VectorStoreIndex
+
+from llama_index.core import Document, StorageContext, ServiceContext, get_response_synthesizer
+from llama_index.core.node_parser import SimpleNodeParser
+from llama_index.core.schema import NodeWithScore
+from llama_index.core.vector_stores.utils import metadata_dict_to_node
+from llama_index.core.vector_stores.types import MetadataFilter, MetadataFilters, FilterOperator
 import psycopg2
+from psycopg2 import sql
+from utils import pg_pool
+from utils import metrics
+from utils.index_sync import diff_docs, batched, node_id
+from utils.index_checkpoint import IndexCheckpoint
+from utils.index_registry import IndexRegistry
 
 
 class PGVectorHelper:
-  def __init__(self):
-    self.indices = {}
+  def __init__(self, registry_settings=None, quantization=None, embedding_settings=None, indexing_settings=None):
+    self.indices = IndexRegistry.from_settings(self.load_index, registry_settings)
+    indexing_settings = indexing_settings or {}
+    self.batch_size = indexing_settings.get("batch_size", 1000)
+    self.checkpoint_dir = indexing_settings.get("checkpoint_dir", ".")
+    # rows are committed as each batch is written, so checkpointing costs one small file write per batch
+    self.checkpoints = indexing_settings.get("checkpoint_every", 1) > 0
+    self.quantization = quantization
+    self.embedding_settings = embedding_settings
+    self.embed_model = None
   def get_vector_store(self, table_name):
     os.environ["PGVECTOR_VECTOR_SIZE"] = "384"
-    vector_store = PGVectorStore.from_params(
-      database=os.environ["PG_DB_DBASE"],
-      host=os.environ["PG_DB_HOST"],
-      password=os.environ["PG_DB_PASS"],
-      port=5432,
-      user=os.environ["PG_DB_USER"],
-      table_name=table_name,
-      embed_dim=384
-    )
-    return vector_store
+    return pg_pool.get_vector_store(table_name, embed_dim=384)
 
   def load_index(self, index_name, metadata_fields=["url"]):
       return VectorStoreIndex.from_vector_store(vector_store=get_vector_store(), service_context=get_service_context())
 
   def get_node_parser(self):
-      return SimpleNodeParser.from_defaults(chunk_size=1024, chunk_overlap=20)
+      return SimpleNodeParser.from_defaults(chunk_size=1024, chunk_overlap=20, id_func=node_id)
 
   def get_service_context(self):
       embed_model = self.get_embed_model()
@@ -47,7 +49,14 @@ class PGVectorHelper:
       return service_context
 
   def get_embed_model(self):
-     return LangchainEmbedding(HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2"))
+     if self.embed_model == None and self.embedding_settings != None:
+       from utils.embedding_engine import EmbeddingEngine
+       self.embed_model = metrics.instrument_embed_model(EmbeddingEngine.from_settings(self.embedding_settings))
+     elif self.embed_model == None:
+       from llama_index.embeddings.langchain import LangchainEmbedding
+       from langchain_community.embeddings import HuggingFaceEmbeddings
+       self.embed_model = metrics.instrument_embed_model(LangchainEmbedding(HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")))
+     return self.embed_model
      #return LangchainEmbedding(HuggingFaceEmbeddings(model_name="sangmini/msmarco-cotmae-MiniLM-L12_en-ko-ja"))
 
   def load_index(self, name): 
@@ -55,28 +64,126 @@ class PGVectorHelper:
     return VectorStoreIndex.from_vector_store(vector_store=self.get_vector_store(name), service_context=self.get_service_context())
 
 
-  def query_index(self, name, query):
+  def warm_up(self, table_names):
+    self.indices.warm_up(table_names)
+
+  def metadata_filters(self, filters):
+    # OR across the values of one field, AND across fields
+    items = []
+    for field in filters:
+      values = filters[field] if isinstance(filters[field], (list, tuple)) else [filters[field]]
+      if len(values) == 1:
+        items.append(MetadataFilter(key=field, value=values[0], operator=FilterOperator.EQ))
+      else:
+        items.append(MetadataFilter(key=field, value=list(values), operator=FilterOperator.IN))
+    return MetadataFilters(filters=items)
+
+  def filter_clause(self, filters):
+    clauses = []
+    params = {}
+    for i, field in enumerate(filters):
+      values = filters[field] if isinstance(filters[field], (list, tuple)) else [filters[field]]
+      clauses.append(sql.SQL("metadata_->>{} = ANY({})").format(sql.Placeholder(f"filter_key_{i}"), sql.Placeholder(f"filter_values_{i}")))
+      params[f"filter_key_{i}"] = field
+      params[f"filter_values_{i}"] = [str(v) for v in values]
+    if len(clauses) == 0:
+      return sql.SQL(""), params
+    return sql.SQL("WHERE ") + sql.SQL(" AND ").join(clauses), params
+
+  def query_quantized(self, name, query, similarity_top_k=5, filters=None):
+    from utils.pgvector_bulk_loader import quantized_expressions, vector_literal
+    expr, _, op, query_expr = quantized_expressions(self.quantization["method"], 384)
+    shortlist = similarity_top_k * self.quantization.get("rescore_factor", 10)
+    where, params = self.filter_clause(filters or {})
+    stmt = sql.SQL("""SELECT text, metadata_, 1 - (embedding <=> %(embedding)s::vector) AS score FROM (
+        SELECT text, metadata_, embedding FROM {} {} ORDER BY """ + expr + " " + op + " " + query_expr + """ LIMIT %(shortlist)s
+      ) shortlist ORDER BY embedding <=> %(embedding)s::vector LIMIT %(top_k)s""").format(sql.Identifier(f"data_{name}".lower()), where)
+    params.update({
+      "embedding": vector_literal(self.get_embed_model().get_query_embedding(query)),
+      "shortlist": shortlist,
+      "top_k": similarity_top_k
+    })
+    with pg_pool.connection() as db:
+      with db.cursor() as cur:
+        cur.execute("SET LOCAL hnsw.ef_search = %s", (max(40, shortlist),))
+        cur.execute(stmt, params)
+        rows = cur.fetchall()
+    return [NodeWithScore(node=metadata_dict_to_node(metadata, text=text), score=score) for text, metadata, score in rows]
+
+  def query_index(self, name, query, filters=None):
     print("querying index")
-    if name not in self.indices:
-      self.indices["name"] = self.load_index(name)
-    index = self.indices["name"]
-    query_engine = index.as_retriever(similarity_top_k=5)
+    if self.quantization != None:
+      return self.query_quantized(name, query, filters=filters)
+    index = self.indices.get(name)
+    if filters:
+      query_engine = index.as_retriever(similarity_top_k=5, filters=self.metadata_filters(filters))
+    else:
+      query_engine = index.as_retriever(similarity_top_k=5)
     response = query_engine.retrieve(query)
     return response
 
 
 
-  def build_index_from_docs(self, docs, table_name):
-   
-    storage_context = StorageContext.from_defaults(
-      vector_store = self.get_vector_store(table_name)
-    )
-    service_context = self.get_service_context()
-    index = VectorStoreIndex.from_documents(docs,
-                                                include_embeddings=True,
-                                                storage_context=storage_context,
-                                                service_context=service_context,
-                                                show_progress=True
-                                                )
+  def build_index_from_docs(self, docs, table_name, resume=False):
+    index = VectorStoreIndex.from_vector_store(vector_store=self.get_vector_store(table_name), service_context=self.get_service_context())
+    checkpoint = None
+    if self.checkpoints:
+      checkpoint = IndexCheckpoint(os.path.join(self.checkpoint_dir, f"{table_name}_checkpoint.json"))
+      checkpoint.start(resume)
+    self.add_to_index(docs, index, checkpoint=checkpoint, table_name=table_name)
+    if checkpoint != None:
+      checkpoint.clear()
     return index
 
+  def bulk_load_from_docs(self, docs, table_name, settings=None):
+    from utils.pgvector_bulk_loader import PGVectorBulkLoader
+    loader = PGVectorBulkLoader(self.get_embed_model(), self.get_node_parser(), embed_dim=384, settings=settings)
+    return loader.load(docs, table_name)
+
+  def get_ref_doc_ids(self, table_name):
+    with pg_pool.connection() as db:
+      try:
+        with db.cursor() as cur:
+          cur.execute(sql.SQL("SELECT DISTINCT metadata_->>'doc_id' FROM {}").format(sql.Identifier(f"data_{table_name}".lower())))
+          return [r[0] for r in cur.fetchall() if r[0] != None]
+      except psycopg2.errors.UndefinedTable:
+        return None
+
+  def delete_ref_docs(self, table_name, ref_doc_ids):
+    with pg_pool.connection() as db:
+      with db, db.cursor() as cur:
+        cur.execute(sql.SQL("DELETE FROM {} WHERE metadata_->>'doc_id' = ANY(%s)").format(sql.Identifier(f"data_{table_name}".lower())), (list(ref_doc_ids),))
+
+  def add_to_index(self, docs, index, checkpoint=None, table_name=None):
+    # each batch is parsed, embedded and written before the next is read
+    parser = self.get_node_parser()
+    total = 0
+    first = True
+    if checkpoint != None:
+      docs = checkpoint.skip(docs)
+      total = checkpoint.state["documents"]
+    for batch in batched(docs, self.batch_size):
+      if first and checkpoint != None and checkpoint.resumed:
+        # the batch after the checkpoint may have been written, in whole or in part, before the run stopped
+        self.delete_ref_docs(table_name, [doc.doc_id for doc in batch])
+      first = False
+      nodes = parser.get_nodes_from_documents(batch)
+      index.insert_nodes(nodes, show_progress=False)
+      total += len(batch)
+      logger.info(f"indexed {total} documents")
+      if checkpoint != None:
+        checkpoint.commit(batch, len(nodes))
+      del batch, nodes
+
+  def sync_index_from_docs(self, docs, table_name):
+    existing_ids = self.get_ref_doc_ids(table_name)
+    if existing_ids == None:
+      return self.build_index_from_docs(docs, table_name)
+    new_docs, stale_ids = diff_docs(docs, existing_ids)
+    print(f"syncing {table_name}: {len(new_docs)} new, {len(stale_ids)} removed")
+    index = self.indices.get(table_name)
+    if len(new_docs)>0:
+      self.add_to_index(new_docs, index)
+    if len(stale_ids)>0:
+      self.delete_ref_docs(table_name, stale_ids)
+    return index
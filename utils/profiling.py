@@ -0,0 +1,230 @@
+import os
+import io
+import sys
+import glob
+import time
+import threading
+from collections import Counter
+
+# cProfile, a sampling profiler and tracemalloc for one CLI command, set up by
+# the --profile and --trace_malloc options. Nothing here is imported unless
+# one of them is given. Extraction workers profile themselves when
+# WORKER_ENV is set and leave "<file>.<pid>" stats for the main process to merge.
+
+WORKER_ENV = "RAGTIME_PROFILE"
+MODES = ["cprofile", "sample"]
+
+
+class Sampler:
+	"""Records the stack of every thread each interval seconds from a background thread.
+
+	Cheaper than cProfile (nothing runs per call) and it sees worker threads
+	too, at the cost of missing anything shorter than the interval.
+	"""
+
+	def __init__(self, interval = 0.005):
+		self.interval = interval
+		self.stacks = Counter()
+		self.samples = 0
+		self.stopped = threading.Event()
+		self.thread = None
+
+	def start(self):
+		self.thread = threading.Thread(target = self.run, name = "profile-sampler", daemon = True)
+		self.thread.start()
+
+	def stop(self):
+		self.stopped.set()
+		self.thread.join()
+
+	def run(self):
+		me = threading.get_ident()
+		names = {}
+		labels = {}
+		cwd = os.getcwd()
+		while not self.stopped.wait(self.interval):
+			self.samples += 1
+			for ident, frame in sys._current_frames().items():
+				if ident == me:
+					continue
+				if ident not in names:
+					names = {t.ident: t.name for t in threading.enumerate()}
+				stack = []
+				while frame != None:
+					code = frame.f_code
+					if code not in labels:
+						filename = os.path.relpath(code.co_filename, cwd) if code.co_filename.startswith(cwd) else code.co_filename
+						labels[code] = f"{code.co_name} ({filename}:{code.co_firstlineno})"
+					stack.append(labels[code])
+					frame = frame.f_back
+				stack.append(names.get(ident, str(ident)))
+				self.stacks[tuple(reversed(stack))] += 1
+
+	def write(self, filename):
+		# collapsed stacks, one "thread;outer;...;inner count" line each (flamegraph.pl, speedscope)
+		with open(filename, "w") as fout:
+			for stack, n in self.stacks.most_common():
+				fout.write(";".join(stack) + f" {n}\n")
+
+	def summary(self, top = 25):
+		own = Counter()
+		total = Counter()
+		for stack, n in self.stacks.items():
+			own[stack[-1]] += n
+			for name in set(stack[1:]):
+				total[name] += n
+		lines = [f"{self.samples} samples every {self.interval*1000:.0f} ms",
+			f"{'self %':>7} {'total %':>8}  function"]
+		for name, n in own.most_common(top):
+			lines.append(f"{100*n/max(1, self.samples):7.1f} {100*total[name]/max(1, self.samples):8.1f}  {name}")
+		return "\n".join(lines)
+
+
+class Profile:
+	"""Profiles one command; report() writes the stats file and returns the summary."""
+
+	def __init__(self, filename, mode = "cprofile", top = 25):
+		if mode not in MODES:
+			raise Exception(f"{self.__class__}: Unknown profile mode \"{mode}\" (expected {', '.join(MODES)}).")
+		self.filename = filename
+		self.mode = mode
+		self.top = top
+		self.profiler = None
+		self.start_time = None
+		self.elapsed = None
+
+	def start(self):
+		self.start_time = time.perf_counter()
+		if self.mode == "sample":
+			self.profiler = Sampler()
+			self.profiler.start()
+			return
+		import cProfile
+		for stale in worker_files(self.filename):
+			os.remove(stale)
+		os.environ[WORKER_ENV] = self.filename
+		self.profiler = cProfile.Profile()
+		self.profiler.enable()
+
+	def stop(self):
+		self.elapsed = time.perf_counter() - self.start_time
+		if self.mode == "sample":
+			self.profiler.stop()
+		else:
+			self.profiler.disable()
+			os.environ.pop(WORKER_ENV, None)
+
+	def report(self):
+		elapsed = self.elapsed
+		if self.mode == "sample":
+			self.profiler.write(self.filename)
+			return f"{elapsed:.2f} s, collapsed stacks in {self.filename}\n" + self.profiler.summary(self.top)
+		import pstats
+		out = io.StringIO()
+		stats = pstats.Stats(self.profiler, stream = out)
+		workers = worker_files(self.filename)
+		for f in workers:
+			stats.add(f)
+			os.remove(f)
+		stats.dump_stats(self.filename)
+		# pstats would head the listing with the (deleted) worker files
+		stats.files = []
+		stats.sort_stats("cumulative").print_stats(self.top)
+		stats.sort_stats("tottime").print_stats(self.top)
+		merged = f" (with {len(workers)} worker processes)" if len(workers) > 0 else ""
+		return f"{elapsed:.2f} s, stats{merged} in {self.filename} (python -m pstats {self.filename})\n" + out.getvalue()
+
+
+def worker_files(filename):
+	return glob.glob(glob.escape(filename) + ".[0-9]*")
+
+
+def start_worker():
+	"""Starts cProfile in a worker process if the parent command is being profiled; returns it (or None)."""
+	if os.environ.get(WORKER_ENV) == None:
+		return None
+	import cProfile
+	profiler = cProfile.Profile()
+	profiler.enable()
+	return profiler
+
+
+def stop_worker(profiler):
+	if profiler != None:
+		profiler.disable()
+		profiler.dump_stats(f"{os.environ[WORKER_ENV]}.{os.getpid()}")
+
+
+class MallocTrace:
+	"""tracemalloc over one command: the top allocation sites near the peak and at the end.
+
+	By the time a command returns most of what it built is freed, so a
+	background thread also snapshots whenever the traced size has grown 10%
+	past the last snapshot (a handful of snapshots even for a run that grows
+	to gigabytes).
+	"""
+
+	def __init__(self, filename, top = 25, frames = 10, interval = 0.1):
+		self.filename = filename
+		self.top = top
+		self.frames = frames
+		self.interval = interval
+		self.stopped = threading.Event()
+		self.thread = None
+		self.peak_snapshot = None
+		self.peak_size = 0
+		self.snapshot = None
+		self.current = 0
+		self.peak = 0
+
+	def start(self):
+		import tracemalloc
+		tracemalloc.start(self.frames)
+		self.thread = threading.Thread(target = self.watch, name = "trace-malloc", daemon = True)
+		self.thread.start()
+
+	def watch(self):
+		import tracemalloc
+		while not self.stopped.wait(self.interval):
+			current = tracemalloc.get_traced_memory()[0]
+			if current > self.peak_size * 1.1:
+				self.peak_snapshot = tracemalloc.take_snapshot()
+				self.peak_size = current
+
+	def sites(self, title, snapshot):
+		import tracemalloc
+		# the tracing machinery's own allocations are noise
+		snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")])
+		stats = snapshot.statistics("lineno")
+		lines = [title, f"{'MB':>8} {'blocks':>9}  allocated at"]
+		for stat in stats[:self.top]:
+			frame = stat.traceback[0]
+			lines.append(f"{stat.size/1024/1024:8.2f} {stat.count:9d}  {frame.filename}:{frame.lineno}")
+		return lines, stats
+
+	def stop(self):
+		import tracemalloc
+		self.stopped.set()
+		self.thread.join()
+		self.snapshot = tracemalloc.take_snapshot()
+		self.current, self.peak = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+
+	def report(self):
+		snapshot = self.snapshot
+		current = self.current
+		peak = self.peak
+		report = [f"traced peak {peak/1024/1024:.1f} MB, {current/1024/1024:.1f} MB still held at exit", ""]
+		if self.peak_snapshot != None and self.peak_size > current:
+			lines, stats = self.sites(f"at {self.peak_size/1024/1024:.1f} MB, the largest snapshot:", self.peak_snapshot)
+		else:
+			lines, stats = self.sites("at exit:", snapshot)
+		report += lines
+		with open(self.filename, "w") as fout:
+			fout.write("\n".join(report) + "\n")
+			for stat in stats[:min(self.top, 5)]:
+				fout.write(f"\n{stat.size/1024/1024:.2f} MB in {stat.count} blocks from:\n")
+				fout.write("\n".join(stat.traceback.format(most_recent_first = True)) + "\n")
+			if self.peak_snapshot != None and self.peak_size > current:
+				fout.write("\n" + "\n".join(self.sites("at exit:", snapshot)[0]) + "\n")
+		return f"tracemalloc report in {self.filename}\n" + "\n".join(report[:13])
@@ -0,0 +1,116 @@
+import re
+from string import Formatter
+from loguru import logger
+from utils import metrics
+
+DEFAULT_TEMPLATE = """You are a helpful assistant with access to this information:
+{query_results}
+When responding from user queries YOU MUST RESTRICT YOUR RESPONSE the provided information.
+"""
+FIELDS = ["query_results", "question"]
+# chat formats add a few tokens of framing per message
+MESSAGE_OVERHEAD = 4
+
+
+class PromptBuilder:
+	"""Builds the chat prompt for a question from retrieved nodes within a token budget.
+
+	The template is parsed once into literal and field segments. Retrieved
+	chunks are taken best score first, exact duplicates (ignoring case and
+	whitespace) are dropped, long chunks are cut to max_chunk_tokens, and the
+	chunk that overflows the budget is cut to fit if at least
+	min_chunk_tokens of room is left.
+	"""
+
+	def __init__(self, template = None, max_prompt_tokens = 3000, max_chunk_tokens = 512, min_chunk_tokens = 32, model = "gpt-4o", separator = "\n\n"):
+		import tiktoken
+		try:
+			self.encoding = tiktoken.encoding_for_model(model)
+		except KeyError:
+			self.encoding = tiktoken.get_encoding("cl100k_base")
+		self.max_prompt_tokens = max_prompt_tokens
+		self.max_chunk_tokens = max_chunk_tokens
+		self.min_chunk_tokens = min_chunk_tokens
+		self.separator = separator
+		self.separator_tokens = self.count(separator)
+		self.segments = self.compile(template if template != None else DEFAULT_TEMPLATE)
+		self.fixed_tokens = sum(self.count(s) for s, is_field in self.segments if not is_field)
+		# the question is sent as the user message and again wherever the template has {question}
+		self.question_copies = 1 + sum(1 for s, is_field in self.segments if is_field and s == "question")
+
+	@classmethod
+	def from_settings(cls, prompt_settings = None):
+		prompt_settings = prompt_settings or {}
+		template = None
+		if "system_prompt_template" in prompt_settings:
+			with open(prompt_settings["system_prompt_template"], "r") as fin:
+				template = fin.read()
+		return cls(template = template,
+			max_prompt_tokens = prompt_settings.get("max_prompt_tokens", 3000),
+			max_chunk_tokens = prompt_settings.get("max_chunk_tokens", 512),
+			min_chunk_tokens = prompt_settings.get("min_chunk_tokens", 32),
+			model = prompt_settings.get("tokenizer_model", "gpt-4o"))
+
+	def compile(self, template):
+		segments = []
+		try:
+			parsed = list(Formatter().parse(template))
+		except ValueError as e:
+			raise Exception(f"{self.__class__}: Could not parse the system prompt template ({e}); literal braces must be doubled.")
+		for literal, field, _, _ in parsed:
+			if literal:
+				segments.append((literal, False))
+			if field != None:
+				if field not in FIELDS:
+					raise Exception(f"{self.__class__}: Unknown field \"{{{field}}}\" in the system prompt template (expected {', '.join(FIELDS)}).")
+				segments.append((field, True))
+		return segments
+
+	def count(self, text):
+		return len(self.encoding.encode(text, disallowed_special = ()))
+
+	def truncate(self, text, max_tokens):
+		tokens = self.encoding.encode(text, disallowed_special = ())
+		if len(tokens) <= max_tokens:
+			return text, len(tokens), False
+		return self.encoding.decode(tokens[:max_tokens]), max_tokens, True
+
+	def fit(self, results, budget):
+		stats = {"retrieved": len(results), "used": 0, "duplicates": 0, "truncated": 0, "dropped": 0, "context_tokens": 0}
+		ranked = sorted(results, key = lambda r:r.score if r.score != None else float("-inf"), reverse = True)
+		seen = set()
+		chunks = []
+		remaining = budget
+		for r in ranked:
+			text = r.text
+			key = re.sub(r"\s+", " ", text).strip().lower()
+			if key in seen:
+				stats["duplicates"] += 1
+				continue
+			seen.add(key)
+			cost = self.separator_tokens if len(chunks) > 0 else 0
+			text, tokens, truncated = self.truncate(text, self.max_chunk_tokens)
+			if tokens + cost > remaining:
+				if remaining - cost < self.min_chunk_tokens:
+					stats["dropped"] += 1
+					continue
+				text, tokens, _ = self.truncate(text, remaining - cost)
+				truncated = True
+			if truncated:
+				stats["truncated"] += 1
+			chunks.append(text)
+			remaining -= tokens + cost
+			stats["used"] += 1
+		stats["context_tokens"] = budget - remaining
+		return self.separator.join(chunks), stats
+
+	def build(self, q, results):
+		overhead = self.fixed_tokens + self.count(q) * self.question_copies + 2 * MESSAGE_OVERHEAD
+		context, stats = self.fit(results, max(self.max_prompt_tokens - overhead, 0))
+		values = {"query_results": context, "question": q}
+		system = "".join(values[s] if is_field else s for s, is_field in self.segments)
+		stats["prompt_tokens"] = overhead + stats["context_tokens"]
+		logger.info(f"prompt: {stats['prompt_tokens']} tokens ({stats['context_tokens']} context from {stats['used']}/{stats['retrieved']} chunks, {stats['duplicates']} duplicate, {stats['truncated']} truncated, {stats['dropped']} dropped)")
+		metrics.observe("prompt_tokens", stats["prompt_tokens"], buckets = [250, 500, 1000, 2000, 4000, 8000, 16000, 32000])
+		metrics.count("prompt_chunks_dropped", stats["dropped"] + stats["duplicates"])
+		return [{"role":"system","content":system},{"role":"user","content":q}], stats
@@ -0,0 +1,223 @@
+import json
+import os
+import numpy as np
+
+BLOCK_ROWS = 16384
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype = np.uint8)
+
+
+def popcount(bits):
+	if hasattr(np, "bitwise_count"):
+		return np.bitwise_count(bits)
+	return POPCOUNT[bits]
+
+
+def normalize(vectors):
+	vectors = np.asarray(vectors, dtype = np.float32)
+	norms = np.linalg.norm(vectors, axis = -1, keepdims = True)
+	norms[norms == 0] = 1
+	return vectors / norms
+
+
+class QuantizedVectors:
+	"""Int8 or 1-bit copies of unit-normalized embeddings.
+
+	The quantized codes stay in memory and produce a shortlist. If a float32
+	copy of the vectors was saved next to them, it is memory-mapped from disk
+	and only the shortlisted rows are read to rescore exactly (cosine
+	similarity); without it the codes alone rank the results.
+	"""
+
+	def __init__(self, node_ids, method, codes, floats, scale = None, dim = None):
+		if method not in ("int8", "binary"):
+			raise Exception(f"{self.__class__}: Unknown quantization method \"{method}\" (expected int8 or binary).")
+		self.node_ids = node_ids
+		self.method = method
+		self.codes = codes
+		self.floats = floats
+		self.scale = scale
+		self.dim = floats.shape[1] if floats is not None else dim
+		self.positions = {node_id: i for i, node_id in enumerate(node_ids)}
+
+	@classmethod
+	def build(cls, node_ids, embeddings, method = "int8", dim = 0):
+		embeddings = np.asarray(embeddings, dtype = np.float32)
+		if len(embeddings) == 0:
+			# an index whose documents were all deleted; dim only matters for the shapes
+			embeddings = embeddings.reshape(0, dim)
+		floats = normalize(embeddings)
+		scale = None
+		if method == "int8":
+			# symmetric per-dimension scale (initial = 0 so that no rows give a scale of 1)
+			scale = np.abs(floats).max(axis = 0, initial = 0) / 127.0
+			scale[scale == 0] = 1
+			codes = np.clip(np.rint(floats / scale), -127, 127).astype(np.int8)
+		elif method == "binary":
+			codes = np.packbits(floats > 0, axis = 1)
+		else:
+			codes = None
+		return cls(list(node_ids), method, codes, floats, scale = scale)
+
+	@classmethod
+	def from_index(cls, index, method = "int8"):
+		embedding_dict = index.vector_store.data.embedding_dict
+		node_ids = list(embedding_dict.keys())
+		return cls.build(node_ids, [embedding_dict[n] for n in node_ids], method = method)
+
+	@property
+	def nbytes(self):
+		# resident memory; the float vectors are memory-mapped
+		return self.codes.nbytes + (0 if self.scale is None else self.scale.nbytes)
+
+	def save(self, folder, rescore = True):
+		"""Writes the codes, plus a float32 copy of the vectors to rescore from if rescore.
+
+		The local vector store already holds the vectors, but as JSON that has
+		to be loaded whole, so the copy adds 4 bytes per dimension and chunk on
+		disk (not in memory).
+		"""
+		if not os.path.exists(folder):
+			os.makedirs(folder)
+		np.save(os.path.join(folder, "codes.npy"), self.codes)
+		floats_file = os.path.join(folder, "floats.npy")
+		if rescore:
+			np.save(floats_file, self.floats)
+		elif os.path.exists(floats_file):
+			os.remove(floats_file)
+		if self.scale is not None:
+			np.save(os.path.join(folder, "scale.npy"), self.scale)
+		with open(os.path.join(folder, "quantized.json"), "w") as fout:
+			json.dump({"method": self.method, "dim": self.dim, "node_ids": self.node_ids}, fout)
+
+	@classmethod
+	def load(cls, folder):
+		with open(os.path.join(folder, "quantized.json"), "r") as fin:
+			meta = json.load(fin)
+		scale = None
+		if os.path.exists(os.path.join(folder, "scale.npy")):
+			scale = np.load(os.path.join(folder, "scale.npy"))
+		floats = None
+		if os.path.exists(os.path.join(folder, "floats.npy")):
+			floats = np.load(os.path.join(folder, "floats.npy"), mmap_mode = "r")
+		return cls(
+			meta["node_ids"],
+			meta["method"],
+			np.load(os.path.join(folder, "codes.npy")),
+			floats,
+			scale = scale,
+			dim = meta.get("dim")
+		)
+
+	def approximate_scores(self, query, rows = None):
+		codes = self.codes if rows is None else self.codes[rows]
+		scores = np.empty(len(codes), dtype = np.float32)
+		if self.method == "int8":
+			# Fold the dequantization scale into the query, then widen each
+			# block of int8 codes to float32 so the dot product runs in BLAS
+			# (NumPy has no BLAS path for integer matmul).
+			weights = (query * self.scale).astype(np.float32)
+			for start in range(0, len(codes), BLOCK_ROWS):
+				block = codes[start:start + BLOCK_ROWS]
+				scores[start:start + len(block)] = block.astype(np.float32) @ weights
+		else:
+			bits = np.packbits(query > 0)
+			for start in range(0, len(codes), BLOCK_ROWS):
+				block = codes[start:start + BLOCK_ROWS]
+				scores[start:start + len(block)] = -popcount(np.bitwise_xor(block, bits)).sum(axis = 1, dtype = np.int32)
+		return scores
+
+	def estimated_similarity(self, scores):
+		# cosine similarity as far as the codes can tell, for results that are not rescored
+		if self.method == "int8":
+			return scores
+		# the angle between two vectors is about pi times the fraction of sign bits that differ
+		return np.cos(np.pi * -scores / max(self.dim, 1))
+
+	def search(self, query_embedding, top_k = 2, rescore_factor = 10, node_ids = None, rows = None):
+		if len(self.node_ids) == 0:
+			return []
+		query = normalize(query_embedding)
+		if node_ids is not None:
+			rows = np.array(sorted(self.positions[n] for n in node_ids if n in self.positions), dtype = np.int64)
+		if rows is not None and len(rows) == 0:
+			return []
+		scores = self.approximate_scores(query, rows)
+		if self.floats is None:
+			shortlist_size = min(len(scores), top_k)
+		else:
+			shortlist_size = min(len(scores), max(top_k * rescore_factor, top_k))
+		shortlist = np.argpartition(-scores, shortlist_size - 1)[:shortlist_size]
+		if self.floats is None:
+			order = shortlist[np.argsort(-scores[shortlist], kind = "stable")]
+			similarity = self.estimated_similarity(scores[order])
+			if rows is not None:
+				order = rows[order]
+			return [(self.node_ids[i], float(score)) for i, score in zip(order, similarity)]
+		if rows is not None:
+			shortlist = rows[shortlist]
+		shortlist = np.sort(shortlist)
+		exact = np.asarray(self.floats[shortlist]) @ query
+		order = np.argsort(-exact, kind = "stable")[:top_k]
+		return [(self.node_ids[shortlist[i]], float(exact[i])) for i in order]
+
+	def exact_search(self, query_embedding, top_k = 2, rows = None):
+		if self.floats is None:
+			raise Exception(f"{self.__class__}: Exact search needs the float vectors, which were not saved with these codes.")
+		query = normalize(query_embedding)
+		scores = np.zeros(len(self.node_ids), dtype = np.float32)
+		for start in range(0, len(scores), BLOCK_ROWS):
+			block = np.asarray(self.floats[start:start + BLOCK_ROWS])
+			scores[start:start + len(block)] = block @ query
+		if rows is not None:
+			excluded = np.ones(len(scores), dtype = bool)
+			excluded[rows] = False
+			scores[excluded] = -np.inf
+		order = np.argsort(-scores, kind = "stable")[:min(top_k, len(scores) if rows is None else len(rows))]
+		return [(self.node_ids[i], float(scores[i])) for i in order]
+
+	def recall_at_k(self, queries = None, k = 10, rescore_factor = 10, sample = 100, seed = 1, rescore = True):
+		"""Fraction of the exact top-k found by quantized search (plus rescoring, if rescore).
+
+		Without queries, a sample of the stored vectors is held out: they are
+		used as queries against the remaining vectors only, so that no query
+		trivially finds itself.
+		"""
+		rows = None
+		if queries is None:
+			rng = np.random.default_rng(seed)
+			picks = rng.choice(len(self.node_ids), size = min(sample, len(self.node_ids) - 1), replace = False) if len(self.node_ids) > 1 else []
+			queries = [np.asarray(self.floats[i]) for i in picks]
+			rows = np.setdiff1d(np.arange(len(self.node_ids)), picks)
+		if len(queries) == 0:
+			return 1.0
+		searched = self if rescore else QuantizedVectors(self.node_ids, self.method, self.codes, None, scale = self.scale, dim = self.dim)
+		found = 0
+		total = 0
+		for query in queries:
+			exact = {n for n, _ in self.exact_search(query, top_k = k, rows = rows)}
+			approx = {n for n, _ in searched.search(query, top_k = k, rescore_factor = rescore_factor, rows = rows)}
+			found += len(exact & approx)
+			total += len(exact)
+		return found / total
+
+
+class QuantizedIndex:
+	"""Query-time stand-in for a local VectorStoreIndex that keeps only the
+	quantized vectors and the docstore in memory."""
+
+	def __init__(self, vectors, docstore, embed_model, rescore_factor = 10):
+		self.vectors = vectors
+		self.docstore = docstore
+		self.embed_model = embed_model
+		self.rescore_factor = rescore_factor
+
+	@property
+	def nbytes(self):
+		return self.vectors.nbytes
+
+	def retrieve(self, query_string, similarity_top_k = 2, node_ids = None, embedding = None):
+		from llama_index.core.schema import NodeWithScore
+		if embedding is None:
+			embedding = self.embed_model.get_query_embedding(query_string)
+		hits = self.vectors.search(embedding, top_k = similarity_top_k, rescore_factor = self.rescore_factor, node_ids = node_ids)
+		return [NodeWithScore(node = self.docstore.get_node(node_id), score = score) for node_id, score in hits]
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from utils import metrics
+
+MAX_HEADER_BYTES = 64 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+TOKEN_QUEUE_SIZE = 64
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 503: "Service Unavailable"}
+
+
+class QueryServer:
+	"""Minimal asyncio HTTP server streaming QueryService answers as server-sent events.
+
+	POST /query with {"q": "...", "filters": {"source": ["a.pdf"]}, "table": "..."} streams
+	"data: {"token": ...}" events and ends with "event: done". GET /health
+	reports load. At most max_concurrency answers run at once; up to
+	queue_size more wait, and anything beyond that gets a 503 straight away.
+	"""
+
+	def __init__(self, service, max_concurrency = 8, queue_size = 32, request_timeout = 120):
+		self.service = service
+		self.max_concurrency = max_concurrency
+		self.queue_size = queue_size
+		self.request_timeout = request_timeout
+		self.executor = ThreadPoolExecutor(max_workers = max_concurrency, thread_name_prefix = "query")
+		self.slots = None
+		self.active = 0
+		self.waiting = 0
+		self.served = 0
+
+	async def read_request(self, reader):
+		head = await reader.readuntil(b"\r\n\r\n")
+		lines = head.decode("latin-1").split("\r\n")
+		method, path, _ = lines[0].split(" ", 2)
+		headers = {}
+		for line in lines[1:]:
+			if line.find(":") > -1:
+				k, v = line.split(":", 1)
+				headers[k.strip().lower()] = v.strip()
+		length = int(headers.get("content-length", 0))
+		if length > MAX_BODY_BYTES:
+			raise ValueError("body too large")
+		body = await reader.readexactly(length) if length > 0 else b""
+		return method, path.split("?")[0], headers, body
+
+	async def send_json(self, writer, status, payload):
+		body = json.dumps(payload).encode()
+		writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+			"Content-Type: application/json\r\n"
+			f"Content-Length: {len(body)}\r\n"
+			"Connection: close\r\n\r\n").encode() + body)
+		await writer.drain()
+
+	async def send_text(self, writer, status, text):
+		body = text.encode()
+		writer.write((f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+			"Content-Type: text/plain; version=0.0.4\r\n"
+			f"Content-Length: {len(body)}\r\n"
+			"Connection: close\r\n\r\n").encode() + body)
+		await writer.drain()
+
+	async def send_event(self, writer, data, event = None):
+		msg = ""
+		if event != None:
+			msg += f"event: {event}\n"
+		msg += f"data: {json.dumps(data)}\n\n"
+		writer.write(msg.encode())
+		await writer.drain()
+
+	def produce(self, loop, queue, q, filters, table, cancelled):
+		# runs in a worker thread; blocks on the bounded queue when the client reads slowly
+		def put(item):
+			asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+		answer = self.service.answer(q, filters = filters, table = table)
+		try:
+			for text in answer:
+				if cancelled.is_set():
+					return
+				put(("token", text))
+			put(("done", None))
+		except Exception as e:
+			if not cancelled.is_set():
+				put(("error", str(e)))
+		finally:
+			# closes the LLM stream (and its HTTP response) now rather than whenever it is collected
+			answer.close()
+
+	def answer_finished(self, producer):
+		if not producer.cancelled():
+			# retrieved so that asyncio does not log it as never retrieved
+			producer.exception()
+		self.active -= 1
+		self.slots.release()
+
+	async def stream_answer(self, writer, q, filters, table):
+		"""Streams one answer; the caller's slot is released once the worker thread has finished, not when the response ends."""
+		loop = asyncio.get_running_loop()
+		queue = asyncio.Queue(maxsize = TOKEN_QUEUE_SIZE)
+		cancelled = threading.Event()
+		deadline = time.monotonic() + self.request_timeout
+		producer = loop.run_in_executor(self.executor, self.produce, loop, queue, q, filters, table, cancelled)
+		try:
+			writer.write(("HTTP/1.1 200 OK\r\n"
+				"Content-Type: text/event-stream\r\n"
+				"Cache-Control: no-cache\r\n"
+				"Connection: close\r\n\r\n").encode())
+			while True:
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					raise asyncio.TimeoutError()
+				kind, value = await asyncio.wait_for(queue.get(), timeout = remaining)
+				if kind == "token":
+					await self.send_event(writer, {"token": value})
+				elif kind == "error":
+					await self.send_event(writer, {"error": value}, event = "error")
+					break
+				else:
+					await self.send_event(writer, {}, event = "done")
+					break
+		except asyncio.TimeoutError:
+			await self.send_event(writer, {"error": f"timed out after {self.request_timeout}s"}, event = "error")
+		finally:
+			cancelled.set()
+			# unblock a producer waiting on a full queue
+			while not queue.empty():
+				queue.get_nowait()
+			# a timed-out answer keeps its slot until its thread returns (a stalled LLM call included), so
+			# abandoned answers cannot fill the executor while new requests are admitted
+			producer.add_done_callback(self.answer_finished)
+
+	async def handle_query(self, writer, body):
+		try:
+			payload = json.loads(body or b"{}")
+			q = payload["q"]
+		except Exception:
+			await self.send_json(writer, 400, {"error": "expected a JSON body with a \"q\" field"})
+			return
+		try:
+			# checked before queueing, so a bad table is a 400 rather than an error event
+			table = self.service.table_name(payload.get("table"))
+		except Exception:
+			await self.send_json(writer, 400, {"error": f"unknown table \"{payload['table']}\"", "tables": self.service.tables})
+			return
+		if self.waiting >= self.queue_size:
+			await self.send_json(writer, 503, {"error": "server busy", "active": self.active, "waiting": self.waiting})
+			return
+		self.waiting += 1
+		try:
+			await asyncio.wait_for(self.slots.acquire(), timeout = self.request_timeout)
+		except asyncio.TimeoutError:
+			await self.send_json(writer, 503, {"error": "timed out waiting for a free slot"})
+			return
+		finally:
+			self.waiting -= 1
+		self.active += 1
+		await self.stream_answer(writer, q, payload.get("filters"), table)
+		self.served += 1
+
+	async def handle(self, reader, writer):
+		try:
+			try:
+				request = await asyncio.wait_for(self.read_request(reader), timeout = 10)
+			except ValueError:
+				await self.send_json(writer, 413, {"error": "request too large"})
+				return
+			method, path, headers, body = request
+			if path == "/health":
+				await self.send_json(writer, 200, {"active": self.active, "waiting": self.waiting, "served": self.served})
+			elif path == "/metrics" and metrics.enabled():
+				await self.send_text(writer, 200, metrics.registry.to_prometheus())
+			elif path == "/query":
+				if method != "POST":
+					await self.send_json(writer, 405, {"error": "use POST"})
+				else:
+					await self.handle_query(writer, body)
+			else:
+				await self.send_json(writer, 404, {"error": "not found"})
+		except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+			pass
+		finally:
+			try:
+				writer.close()
+				await writer.wait_closed()
+			except ConnectionError:
+				pass
+
+	async def run(self, host = "127.0.0.1", port = 8000):
+		self.slots = asyncio.Semaphore(self.max_concurrency)
+		server = await asyncio.start_server(self.handle, host, port, limit = MAX_HEADER_BYTES)
+		print(f"Serving on http://{host}:{port} (max {self.max_concurrency} concurrent, {self.queue_size} queued, {self.request_timeout}s timeout)")
+		async with server:
+			await server.serve_forever()
@@ -0,0 +1,70 @@
+import warnings
+from utils import metrics
+
+
+class QueryService:
+	"""Retrieval plus answer generation for one config, kept warm across questions."""
+
+	def __init__(self, config):
+		self.config = config
+		self.vector_store_location = config["vector_store_location"]
+		self.registry_settings = config.get("index_registry", {})
+		if self.vector_store_location == "database":
+			from utils.pgvector_helper import PGVectorHelper
+			data_config = config["database_settings"]
+			self.content_table = data_config["content_table_name"]
+			self.index = PGVectorHelper(registry_settings = self.registry_settings, quantization = data_config.get("quantization"), embedding_settings = config.get("embedding_settings"))
+			self.default_table = self.content_table
+		else:
+			warnings.simplefilter("ignore")
+			self.local_config = config["local_settings"]
+			self.index_name = self.local_config["index_name"]
+			if "shards" in self.local_config:
+				from utils.sharded_index import ShardedIndexer
+				self.index = ShardedIndexer(persist_dir = self.local_config["vector_store_folder"], shard_settings = self.local_config["shards"], registry_settings = self.registry_settings, quantization = self.local_config.get("quantization"), embedding_settings = config.get("embedding_settings"))
+			else:
+				from utils.tafi_indexer import TafiIndexer
+				self.index = TafiIndexer(persist_dir = self.local_config["vector_store_folder"], registry_settings = self.registry_settings, quantization = self.local_config.get("quantization"), embedding_settings = config.get("embedding_settings"))
+			self.default_table = self.index_name
+		self.warm_tables = self.registry_settings.get("warm_tables", [self.default_table])
+		# a question can pick any table (or local index) that is configured, not arbitrary ones
+		self.tables = list(dict.fromkeys([self.default_table] + self.warm_tables + self.registry_settings.get("tables", [])))
+		from utils.prompt_builder import PromptBuilder
+		self.prompt_builder = PromptBuilder.from_settings(config.get("prompt_settings"))
+
+	def warm_up(self):
+		self.index.warm_up(self.warm_tables)
+		if self.vector_store_location == "local":
+			# loads the embedding model too
+			self.index.vector_store.get_embed_model()
+		else:
+			self.index.get_embed_model()
+
+	def table_name(self, table = None):
+		"""The table (or local index) to query: table if it is configured, the default one if table is None."""
+		if table == None:
+			return self.default_table
+		if table not in self.tables:
+			raise Exception(f"{self.__class__}: Unknown table \"{table}\" (expected one of {', '.join(self.tables)}).")
+		return table
+
+	def retrieve(self, q, filters = None, table = None):
+		table = self.table_name(table)
+		warnings.simplefilter("ignore")
+		metrics.count("queries", filtered = bool(filters))
+		with metrics.timer("retrieve", store = self.vector_store_location):
+			if self.vector_store_location == "database":
+				return self.index.query_index(table, q, filters = filters)
+			return self.index.query(index_name = table, query_string = q, mode = self.local_config.get("retrieval_mode", "vector"), filters = filters)
+
+	def build_prompt(self, q, response):
+		prompt, _ = self.prompt_builder.build(q, response)
+		return prompt
+
+	def answer(self, q, filters = None, llm = None, table = None):
+		from utils.llm_invoker import LLMInvoker
+		if llm == None:
+			llm = LLMInvoker()
+		prompt = self.build_prompt(q, self.retrieve(q, filters = filters, table = table))
+		for text in llm.ask_llm(prompt):
+			yield text
@@ -0,0 +1,281 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from utils.tafi_indexer import TafiIndexer
+from utils.tafi_vector_stores import TafiSimpleVectorStore
+from utils import metrics
+from llama_index.core import Document
+
+SHARD_BY = ["hash", "source"]
+
+
+def shard_number(key, count):
+	# stable across processes and runs, unlike hash()
+	return int(hashlib.sha1(str(key).encode("utf-8")).hexdigest()[:8], 16) % count
+
+
+def add_digest(total, *parts):
+	# a sum of sha1s does not depend on the order the documents stream in
+	h = hashlib.sha1()
+	for part in parts:
+		h.update(part.encode("utf-8", "surrogatepass") + b"\0")
+	return (total + int(h.hexdigest(), 16)) % (1 << 160)
+
+
+def doc_digests(ids, content, doc):
+	"""Adds doc to the running digests of a shard's chunk ids and of its chunks (id, text and metadata)."""
+	metadata = json.dumps(doc.metadata, sort_keys = True, default = str)
+	return add_digest(ids, doc.doc_id), add_digest(content, doc.doc_id, doc.text, metadata)
+
+
+def shard_server(conn, shard_dirs, index_name, quantization):
+	"""Runs in a child process that owns some shards; the parent sends query embeddings, so no model is loaded here."""
+	import warnings
+	warnings.simplefilter("ignore")
+	from llama_index.core.embeddings import MockEmbedding
+	# placeholder: load_index_from_storage wants an embed model, but every query arrives already embedded
+	placeholder = MockEmbedding(embed_dim = 384)
+	shards = {i: TafiIndexer(persist_dir = d, quantization = quantization, embed_model = placeholder) for i, d in shard_dirs.items()}
+	while True:
+		request = conn.recv()
+		if request == None:
+			break
+		try:
+			hits = []
+			for i in shards:
+				for r in shards[i].query(index_name = index_name, **request):
+					hits.append((r.node.node_id, r.node.get_content(), r.node.metadata, r.score))
+			conn.send(("ok", hits))
+		except Exception as e:
+			conn.send(("error", f"{e.__class__.__name__}: {e}"))
+	conn.close()
+
+
+class ShardedIndexer:
+	"""A local index split into shard_settings["count"] independent TafiIndexer stores.
+
+	Chunks go to a shard by a hash of their id ("hash") or of their source file
+	("source", so re-parsing one file touches one shard). Each shard lives in
+	<persist_dir>/<index_name>_shard_NN with its own BM25, metadata and
+	quantized indexes. A build streams the chunks into per-shard spool files
+	and then builds the shards one by one, each in batches, skipping shards
+	whose chunks (text and metadata) are unchanged. Queries embed once,
+	search every shard in parallel ("threads", or "processes" that each keep
+	their shards loaded) and merge the top k.
+	"""
+
+	def __init__(self, persist_dir = None, shard_settings = None, registry_settings = None, quantization = None, embedding_settings = None, indexing_settings = None):
+		shard_settings = shard_settings or {}
+		self.persist_dir = persist_dir
+		self.count = shard_settings.get("count", 4)
+		self.by = shard_settings.get("by", "hash")
+		if self.by not in SHARD_BY:
+			raise Exception(f"{self.__class__}: Unknown shard key \"{self.by}\" (expected {' or '.join(SHARD_BY)}).")
+		self.parallel = shard_settings.get("parallel", "threads")
+		self.workers = shard_settings.get("workers", min(self.count, os.cpu_count() or 1))
+		self.registry_settings = registry_settings
+		self.quantization = quantization
+		self.indexing_settings = indexing_settings
+		self.vector_store = TafiSimpleVectorStore(persist_dir = persist_dir, embedding_settings = embedding_settings)
+		self.shards = {}
+		self.shard_lock = threading.Lock()
+		self.live = {}
+		self.pool = None
+		self.servers = {}
+		self.server_lock = threading.Lock()
+
+	def shard_dir(self, index_name, i):
+		return os.path.join(self.persist_dir, f"{index_name}_shard_{i:02d}")
+
+	def spool_dir(self, index_name):
+		return os.path.join(self.persist_dir, f"{index_name}_spool")
+
+	def spool_file(self, index_name, i):
+		return os.path.join(self.spool_dir(index_name), f"shard_{i:02d}.jsonl")
+
+	def manifest_file(self, index_name):
+		return os.path.join(self.persist_dir, f"{index_name}_shards.json")
+
+	def load_manifest(self, index_name):
+		try:
+			with open(self.manifest_file(index_name), "r") as fin:
+				return json.load(fin)
+		except FileNotFoundError:
+			return None
+
+	def save_manifest(self, index_name, manifest):
+		if not os.path.exists(self.persist_dir):
+			os.makedirs(self.persist_dir)
+		tmp = self.manifest_file(index_name) + ".tmp"
+		with open(tmp, "w") as fout:
+			json.dump(manifest, fout, indent = 4)
+		os.replace(tmp, self.manifest_file(index_name))
+
+	def live_shards(self, index_name):
+		if index_name not in self.live:
+			manifest = self.load_manifest(index_name)
+			if manifest == None:
+				raise Exception(f"{self.__class__}: No shard manifest for \"{index_name}\" in {self.persist_dir}; run index-docs first.")
+			self.live[index_name] = [int(i) for i in manifest["shards"] if manifest["shards"][i]["docs"] > 0]
+		return self.live[index_name]
+
+	def shard(self, index_name, i):
+		with self.shard_lock:
+			if (index_name, i) not in self.shards:
+				self.shards[(index_name, i)] = TafiIndexer(persist_dir = self.shard_dir(index_name, i), registry_settings = self.registry_settings,
+					quantization = self.quantization, embed_model = self.vector_store.get_embed_model(), indexing_settings = self.indexing_settings)
+			return self.shards[(index_name, i)]
+
+	def partition(self, docs, index_name):
+		"""Writes each document to its shard's spool file as it streams past.
+
+		Returns:
+			dict: shard number -> {"docs", "ids" and "digest"} of the chunks spooled for it.
+		"""
+		folder = self.spool_dir(index_name)
+		shutil.rmtree(folder, ignore_errors = True)
+		os.makedirs(folder)
+		parts = {i: {"docs": 0, "ids": 0, "digest": 0} for i in range(self.count)}
+		files = {i: open(self.spool_file(index_name, i), "w", encoding = "utf-8") for i in range(self.count)}
+		try:
+			for doc in docs:
+				key = doc.metadata.get("source") if self.by == "source" else doc.doc_id
+				i = shard_number(key if key != None else doc.doc_id, self.count)
+				files[i].write(doc.to_json() + "\n")
+				parts[i]["docs"] += 1
+				parts[i]["ids"], parts[i]["digest"] = doc_digests(parts[i]["ids"], parts[i]["digest"], doc)
+		finally:
+			for f in files.values():
+				f.close()
+		for part in parts.values():
+			part["ids"] = f"{part['ids']:040x}"
+			part["digest"] = f"{part['digest']:040x}"
+		return parts
+
+	def spooled(self, index_name, i):
+		# read back lazily, so the shard's indexer holds one batch at a time
+		with open(self.spool_file(index_name, i), "r", encoding = "utf-8") as fin:
+			for line in fin:
+				yield Document.from_json(line)
+
+	def build(self, docs, index_name, incremental = False, with_llm = False, resume = False):
+		manifest = self.load_manifest(index_name)
+		if manifest != None and (manifest["count"] != self.count or manifest["by"] != self.by):
+			print(f"SHARD LAYOUT CHANGED ({manifest['count']} by {manifest['by']} -> {self.count} by {self.by}): rebuilding every shard")
+			for i in manifest["shards"]:
+				shutil.rmtree(self.shard_dir(index_name, int(i)), ignore_errors = True)
+			manifest = None
+		if manifest == None:
+			manifest = {"count": self.count, "by": self.by, "shards": {}}
+		try:
+			for i, part in self.partition(docs, index_name).items():
+				self.build_shard(index_name, i, part, manifest, incremental = incremental, with_llm = with_llm, resume = resume)
+				# written after every shard so an interrupted build keeps what finished
+				self.save_manifest(index_name, manifest)
+		finally:
+			shutil.rmtree(self.spool_dir(index_name), ignore_errors = True)
+		self.save_manifest(index_name, manifest)
+		self.live.pop(index_name, None)
+		self.close()
+
+	def build_shard(self, index_name, i, part, manifest, incremental = False, with_llm = False, resume = False):
+		previous = manifest["shards"].get(str(i))
+		if previous != None and previous["digest"] == part["digest"]:
+			print(f"SHARD {i:02d}: unchanged ({part['docs']} chunks)")
+			return
+		folder = self.shard_dir(index_name, i)
+		if part["docs"] == 0:
+			shutil.rmtree(folder, ignore_errors = True)
+		elif incremental and previous != None and previous.get("ids") != part["ids"]:
+			print(f"SHARD {i:02d}: syncing {part['docs']} chunks")
+			self.shard(index_name, i).sync_from_docs(docs = self.spooled(index_name, i), index_name = index_name, with_llm = with_llm)
+		else:
+			# a sync only adds and removes chunk ids, so changed text or metadata under the same ids is rebuilt
+			print(f"SHARD {i:02d}: building {part['docs']} chunks")
+			if not resume:
+				shutil.rmtree(folder, ignore_errors = True)
+			self.shard(index_name, i).index_from_docs(docs = self.spooled(index_name, i), index_name = index_name, with_llm = with_llm, resume = resume)
+		self.shards.pop((index_name, i), None)
+		manifest["shards"][str(i)] = part
+
+	def index_from_docs(self, docs = None, index_name = None, with_llm = False, resume = False):
+		# finished shards are already in the manifest; the interrupted one resumes from its own checkpoint
+		self.build(docs, index_name, incremental = False, with_llm = with_llm, resume = resume)
+
+	def sync_from_docs(self, docs = None, index_name = None, with_llm = False):
+		self.build(docs, index_name, incremental = True, with_llm = with_llm)
+
+	def warm_up(self, index_names):
+		for index_name in index_names:
+			if self.parallel == "processes":
+				self.start_servers(index_name)
+			else:
+				for i in self.live_shards(index_name):
+					self.shard(index_name, i).warm_up([index_name])
+
+	def start_servers(self, index_name):
+		"""Starts the shard processes of index_name if they are not running; returns them and the lock for their pipes."""
+		with self.server_lock:
+			if index_name not in self.servers:
+				ctx = multiprocessing.get_context("spawn")
+				live = self.live_shards(index_name)
+				servers = []
+				for w in range(min(self.workers, len(live))):
+					mine = {i: self.shard_dir(index_name, i) for i in live[w::self.workers]}
+					parent, child = ctx.Pipe()
+					proc = ctx.Process(target = shard_server, args = (child, mine, index_name, self.quantization), daemon = True)
+					proc.start()
+					servers.append((proc, parent))
+				self.servers[index_name] = (servers, threading.Lock())
+			return self.servers[index_name]
+
+	def query_servers(self, index_name, request):
+		from llama_index.core.schema import NodeWithScore, TextNode
+		servers, lock = self.start_servers(index_name)
+		# one query at a time per pipe; the shards within it are searched in parallel
+		with lock:
+			for _, conn in servers:
+				conn.send(request)
+			replies = [conn.recv() for _, conn in servers]
+		hits = []
+		for status, payload in replies:
+			if status == "error":
+				raise Exception(f"{self.__class__}: Shard search failed: {payload}")
+			for node_id, text, metadata, score in payload:
+				hits.append(NodeWithScore(node = TextNode(id_ = node_id, text = text, metadata = metadata), score = score))
+		return hits
+
+	def query(self, index_name = None, index = None, query_string = None, mode = "vector", similarity_top_k = 2, fusion_top_k = 20, prefilter_top_k = 200, filters = None):
+		embedding = self.vector_store.get_embed_model().get_query_embedding(query_string)
+		request = {"query_string": query_string, "query_embedding": embedding, "mode": mode, "similarity_top_k": similarity_top_k,
+			"fusion_top_k": fusion_top_k, "prefilter_top_k": prefilter_top_k, "filters": filters}
+		with metrics.timer("shard_search", parallel = self.parallel):
+			if self.parallel == "processes":
+				hits = self.query_servers(index_name, request)
+			else:
+				live = self.live_shards(index_name)
+				if self.pool == None:
+					self.pool = ThreadPoolExecutor(max_workers = self.workers, thread_name_prefix = "shard")
+				hits = []
+				for shard_hits in self.pool.map(lambda i: self.shard(index_name, i).query(index_name = index_name, **request), live):
+					hits += shard_hits
+		# vector scores are cosine similarities and compare across shards; hybrid RRF scores are per-shard ranks
+		return sorted(hits, key = lambda x:x.score, reverse = True)[:similarity_top_k]
+
+	def close(self):
+		if self.pool != None:
+			self.pool.shutdown()
+			self.pool = None
+		with self.server_lock:
+			for servers, _ in self.servers.values():
+				for proc, conn in servers:
+					try:
+						conn.send(None)
+					except (BrokenPipeError, OSError):
+						pass
+					proc.join(timeout = 5)
+			self.servers = {}
@@ -4,36 +4,189 @@ import warnings
 
 from pydantic import BaseModel
 from utils.tafi_vector_stores import *
+from utils.index_sync import diff_docs
+from utils.index_checkpoint import IndexCheckpoint
+from utils.index_registry import IndexRegistry
+from utils.bm25_index import BM25Index, reciprocal_rank_fusion
+from utils.quantized_vectors import QuantizedVectors, QuantizedIndex
+from utils.metadata_index import MetadataIndex
+from utils import metrics
 from llama_index.core import Document
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore import SimpleDocumentStore
 
 
 class TafiIndexer:
-	def __init__(self, persist_dir = None):
-		self.vector_store = TafiSimpleVectorStore(persist_dir = persist_dir)
+	def __init__(self, persist_dir = None, registry_settings = None, quantization = None, embedding_settings = None, embed_model = None, indexing_settings = None):
+		indexing_settings = indexing_settings or {}
+		self.vector_store = TafiSimpleVectorStore(persist_dir = persist_dir, embedding_settings = embedding_settings, batch_size = indexing_settings.get("batch_size", 1000))
+		# the local store is rewritten in full at each checkpoint, so not after every batch
+		self.checkpoint_every = indexing_settings.get("checkpoint_every", 10)
+		# shards of one index share a single loaded model
+		self.vector_store.loaded_embed_model = embed_model
 		self.persist_dir = persist_dir
+		self.indices = IndexRegistry.from_settings(self.get_index, registry_settings)
+		self.lexical = {}
+		self.metadata = {}
+		self.quantization = quantization
+
+	def warm_up(self, index_names):
+		self.indices.warm_up(index_names)
 
 	def get_index(self, index_id):
+		if self.quantization != None:
+			return self.get_quantized_index(index_id)
 		index = self.vector_store.load_index(index_id = index_id, with_llm = False)
 		return index
 
-	def query(self, index_name = None, index = None, query_string = None):
+	def quantized_dir(self, index_name):
+		return os.path.join(self.persist_dir, f"{index_name}_{self.quantization['method']}")
+
+	def get_quantized_index(self, index_name):
+		# only the quantized codes and the docstore are loaded, not the float vector store
+		vectors = QuantizedVectors.load(self.quantized_dir(index_name))
+		docstore = SimpleDocumentStore.from_persist_dir(self.persist_dir)
+		return QuantizedIndex(vectors, docstore, self.vector_store.get_embed_model(), rescore_factor = self.quantization.get("rescore_factor", 10))
+
+	def build_quantized_vectors(self, index, index_name):
+		vectors = QuantizedVectors.from_index(index, method = self.quantization["method"])
+		rescore = self.quantization.get("rescore", True)
+		vectors.save(self.quantized_dir(index_name), rescore = rescore)
+		recall = vectors.recall_at_k(k = 10, rescore_factor = self.quantization.get("rescore_factor", 10), rescore = rescore)
+		on_disk = f", {vectors.floats.nbytes} bytes of float32 on disk to rescore from" if rescore else ", not rescored"
+		print(f"QUANTIZED {index_name} ({vectors.method}): {vectors.nbytes} bytes resident vs {vectors.floats.nbytes} float32{on_disk}, held-out recall@10 {recall:.3f}")
+		return vectors
+
+	def vector_retrieve(self, index, query_string, similarity_top_k = 2, node_ids = None, query_embedding = None):
+		if isinstance(index, QuantizedIndex):
+			return index.retrieve(query_string, similarity_top_k = similarity_top_k, node_ids = node_ids, embedding = query_embedding)
+		if node_ids == None:
+			query_engine = index.as_retriever(similarity_top_k=similarity_top_k)
+		else:
+			query_engine = index.as_retriever(similarity_top_k=similarity_top_k, node_ids=node_ids)
+		return query_engine.retrieve(QueryBundle(query_str = query_string, embedding = query_embedding))
+
+	def lexical_dir(self, index_name):
+		return os.path.join(self.persist_dir, f"{index_name}_bm25")
+
+	def get_lexical_index(self, index_name):
+		if index_name not in self.lexical:
+			folder = self.lexical_dir(index_name)
+			if not os.path.exists(folder):
+				return None
+			self.lexical[index_name] = BM25Index.load(folder)
+		return self.lexical[index_name]
+
+	def build_lexical_index(self, index, index_name):
+		lexical = BM25Index.from_index(index)
+		lexical.save(self.lexical_dir(index_name))
+		self.lexical.pop(index_name, None)
+		return lexical
+
+	def metadata_dir(self, index_name):
+		return os.path.join(self.persist_dir, f"{index_name}_metadata")
+
+	def get_metadata_index(self, index_name):
+		if index_name not in self.metadata:
+			folder = self.metadata_dir(index_name)
+			if not os.path.exists(folder):
+				return None
+			self.metadata[index_name] = MetadataIndex.load(folder)
+		return self.metadata[index_name]
+
+	def build_metadata_index(self, index, index_name):
+		metadata = MetadataIndex.from_index(index)
+		metadata.save(self.metadata_dir(index_name))
+		self.metadata.pop(index_name, None)
+		return metadata
+
+	def build_aux_indexes(self, index, index_name):
+		self.build_lexical_index(index, index_name)
+		self.build_metadata_index(index, index_name)
+		self.cache_index(index, index_name)
+
+	def query(self, index_name = None, index = None, query_string = None, mode = "vector", similarity_top_k = 2, fusion_top_k = 20, prefilter_top_k = 200, filters = None, query_embedding = None):
 		if index==None and index_name!=None:
-			index = self.vector_store.load_index(index_name, with_llm = False)
-		query_engine = index.as_retriever(similarity_top_k=2)
-		response = query_engine.retrieve(query_string)
+			index = self.indices.get(index_name)
+		allowed = None
+		if filters:
+			# only nodes matching the filter are scored at all
+			metadata = self.get_metadata_index(index_name)
+			if metadata == None:
+				raise Exception(f"{self.__class__}: No metadata index for \"{index_name}\"; re-run index-docs to filter.")
+			allowed = metadata.match(filters)
+			if len(allowed) == 0:
+				return []
+		lexical = None
+		if mode != "vector" and index_name != None:
+			lexical = self.get_lexical_index(index_name)
+		if lexical == None:
+			response = self.vector_retrieve(index, query_string, similarity_top_k = similarity_top_k, node_ids = allowed, query_embedding = query_embedding)
+		elif mode == "prefilter":
+			# score vectors only for the best lexical matches
+			candidates = [node_id for node_id, _ in lexical.search(query_string, top_k = prefilter_top_k, node_ids = allowed)]
+			if len(candidates) == 0:
+				candidates = allowed
+			response = self.vector_retrieve(index, query_string, similarity_top_k = similarity_top_k, node_ids = candidates, query_embedding = query_embedding)
+		elif mode == "hybrid":
+			vector_hits = self.vector_retrieve(index, query_string, similarity_top_k = max(similarity_top_k, fusion_top_k), node_ids = allowed, query_embedding = query_embedding)
+			lexical_hits = lexical.search(query_string, top_k = fusion_top_k, node_ids = allowed)
+			by_id = {r.node.node_id:r.node for r in vector_hits}
+			fused = reciprocal_rank_fusion([[r.node.node_id for r in vector_hits], [node_id for node_id, _ in lexical_hits]])
+			response = []
+			for node_id, score in fused[:similarity_top_k]:
+				node = by_id.get(node_id)
+				if node == None:
+					node = index.docstore.get_node(node_id)
+				response.append(NodeWithScore(node = node, score = score))
+		else:
+			raise Exception(f"{self.__class__}: Unknown retrieval mode \"{mode}\" (expected vector, hybrid or prefilter).")
 		response = sorted(response, key = lambda x:x.score, reverse=True)
 		return response
 
+	def cache_index(self, index, index_name):
+		if self.quantization != None:
+			self.build_quantized_vectors(index, index_name)
+			self.indices.invalidate(index_name)
+		else:
+			self.indices.put(index_name, index)
+
 	def add_to_index(self, docs = None, index = None, index_name = None, with_llm = False):
 		if index == None and index_name!=None:
 			self.vector_store.add_to_index(docs = docs, index_name = index_name, with_llm = with_llm)
 		else:
 			self.vector_store.add_to_index(docs = docs, index = index, with_llm = with_llm)
 
-	def index_from_docs(self, docs = None, index_name = None, with_llm = False):
-		index = self.vector_store.index_from_docs(docs = docs, index_name = index_name, with_llm = with_llm)
+	def checkpoint(self, index_name):
+		return IndexCheckpoint(os.path.join(self.persist_dir, f"{index_name}_checkpoint.json"), every = self.checkpoint_every,
+			snapshot_dir = os.path.join(self.persist_dir, f"{index_name}_checkpoint"))
+
+	def index_from_docs(self, docs = None, index_name = None, with_llm = False, resume = False):
+		checkpoint = None
+		if self.checkpoint_every > 0:
+			checkpoint = self.checkpoint(index_name)
+			checkpoint.start(resume)
+		index = self.vector_store.index_from_docs(docs = docs, index_name = index_name, with_llm = with_llm, checkpoint = checkpoint)
 		index.set_index_id(index_name)
-		index.storage_context.persist(persist_dir=self.persist_dir)
+		with metrics.timer("store", store = "local"):
+			index.storage_context.persist(persist_dir=self.persist_dir)
+			self.build_aux_indexes(index, index_name)
+		metrics.count("stored_nodes", len(index.docstore.docs), store = "local")
+		if checkpoint != None:
+			checkpoint.clear()
 		return index
 
-
+	def sync_from_docs(self, docs = None, index_name = None, with_llm = False):
+		index = self.vector_store.load_index(index_id = index_name, with_llm = with_llm)
+		if index == None:
+			return self.index_from_docs(docs = docs, index_name = index_name, with_llm = with_llm)
+		new_docs, stale_ids = diff_docs(docs, index.ref_doc_info.keys())
+		print(f"SYNCING {index_name}: {len(new_docs)} new, {len(stale_ids)} removed")
+		if len(new_docs)>0:
+			self.add_to_index(docs = new_docs, index = index, with_llm = with_llm)
+		for ref_doc_id in stale_ids:
+			index.delete_ref_doc(ref_doc_id, delete_from_docstore = True)
+		with metrics.timer("store", store = "local"):
+			index.storage_context.persist(persist_dir=self.persist_dir)
+			self.build_aux_indexes(index, index_name)
+		return index
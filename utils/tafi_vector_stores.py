@@ -1,14 +1,9 @@
 import os
-from pydantic import BaseModel
 import warnings
-from llama_index.embeddings.langchain import LangchainEmbedding
 
 from llama_index.core import Document
 from llama_index.core import StorageContext,ServiceContext,get_response_synthesizer
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from llama_index.vector_stores.redis import RedisVectorStore
-from llama_index.vector_stores.postgres import PGVectorStore
-from llama_index.core.node_parser import SimpleNodeParser
+from llama_index.core.node_parser import SimpleNodeParser, SentenceSplitter
 from llama_index.core import VectorStoreIndex
 
 from llama_index.core import (
@@ -16,18 +11,45 @@ from llama_index.core import (
     load_index_from_storage
 )
 from llama_index.core.node_parser import JSONNodeParser
-from langchain_community.vectorstores import redis
 import json
-import psycopg2
-redis._check_redis_module_exist = lambda *args: True
+from loguru import logger
+from utils import metrics
+from utils.index_sync import batched, node_id
+
+# the embedding, redis and postgres backends are slow to import, so each is
+# only imported by the store that uses it
 
 
 class TafiVectorStore:
 	index_type = None
 
-	def __init__(self, persist_dir = None, embed_model = "sentence-transformers/all-MiniLM-L6-v2"):
+	def __init__(self, persist_dir = None, embed_model = "sentence-transformers/all-MiniLM-L6-v2", embedding_settings = None, batch_size = 1000):
 		self.embed_model = embed_model
 		self.persist_dir = persist_dir
+		self.embedding_settings = embedding_settings
+		self.batch_size = batch_size
+		self.loaded_embed_model = None
+
+	def insert_batches(self, index, docs, get_nodes, checkpoint = None):
+		# only one batch of documents, nodes and embeddings is alive at a time
+		total_docs = 0
+		total_nodes = 0
+		if checkpoint != None:
+			docs = checkpoint.skip(docs)
+			total_docs = checkpoint.state["documents"]
+			total_nodes = checkpoint.state["nodes"]
+		for batch in batched(docs, self.batch_size):
+			nodes = get_nodes(batch)
+			index.insert_nodes(nodes, show_progress = False)
+			for doc in batch:
+				index.docstore.set_document_hash(doc.get_doc_id(), doc.hash)
+			total_docs += len(batch)
+			total_nodes += len(nodes)
+			print(f"INDEXED {total_docs} documents ({total_nodes} chunks)")
+			if checkpoint != None:
+				checkpoint.commit(batch, len(nodes), persist = lambda folder: index.storage_context.persist(persist_dir = folder))
+			del batch, nodes
+		return index
 
 	def add_to_index(self, docs = None, index = None, index_name = None, with_llm = False):
 		if index==None and index_name!=None:
@@ -35,25 +57,18 @@ class TafiVectorStore:
 		if index==None and index_name==None:
 			raise Exception(f"{self.__class__}: Missing parameter - expected index or index_name.")
 		parser = self.get_node_parser()
-		new_nodes = parser.get_nodes_from_documents(docs)
-		service_context = self.get_service_context(with_llm)
-		index.insert_nodes(new_nodes, include_embeddings = True, show_progress = True, service_context = service_context)
+		self.insert_batches(index, docs, parser.get_nodes_from_documents)
 
-	def index_from_docs(self, docs = None, index_name = None, with_llm = False):
+	def index_from_docs(self, docs = None, index_name = None, with_llm = False, checkpoint = None):
 		storage_context = StorageContext.from_defaults(
 			vector_store = self.get_vector_store(index_name = index_name)
 		)
 		service_context = self.get_service_context(with_llm)
-		index = VectorStoreIndex.from_documents(docs,
-													include_embeddings=True,
-													storage_context=storage_context,
-													service_context=service_context,
-													show_progress=True
-													)
-		return index
+		index = VectorStoreIndex(nodes = [], storage_context = storage_context, service_context = service_context)
+		return self.insert_batches(index, docs, self.get_node_parser().get_nodes_from_documents, checkpoint = checkpoint)
 
 	def get_node_parser(self):
-		return SimpleNodeParser.from_defaults(chunk_size=256, chunk_overlap=20)
+		return SimpleNodeParser.from_defaults(chunk_size=256, chunk_overlap=20, id_func=node_id)
 
 	def get_service_context(self, with_llm):
 		embed_model = self.get_embed_model()
@@ -72,10 +87,18 @@ class TafiVectorStore:
 	# THIS ADDS LLM GOVERNANCE TO SEMANTIC SEARCH.
 	# FEELS LIKE OVERKILL.
 	def get_llm(self):
+		from langchain_community.llms import VertexAI
 		return VertexAI(model_name="text-bison", max_output_tokens=2048)
 
 	def get_embed_model(self):
-	   return LangchainEmbedding(HuggingFaceEmbeddings(model_name=self.embed_model))
+		if self.loaded_embed_model == None and self.embedding_settings != None:
+			from utils.embedding_engine import EmbeddingEngine
+			self.loaded_embed_model = metrics.instrument_embed_model(EmbeddingEngine.from_settings(self.embedding_settings, model_name=self.embed_model))
+		elif self.loaded_embed_model == None:
+			from llama_index.embeddings.langchain import LangchainEmbedding
+			from langchain_community.embeddings import HuggingFaceEmbeddings
+			self.loaded_embed_model = metrics.instrument_embed_model(LangchainEmbedding(HuggingFaceEmbeddings(model_name=self.embed_model)))
+		return self.loaded_embed_model
 
 
 class TafiSimpleVectorStore(TafiVectorStore):
@@ -90,19 +113,28 @@ class TafiSimpleVectorStore(TafiVectorStore):
 		#data["filename"] = filename
 		return data
 
-	def index_from_docs(self, docs = None, index_name = None, with_llm = False):
+	def index_from_docs(self, docs = None, index_name = None, with_llm = False, checkpoint = None):
 		print("INDEXING FROM DOCS")
-		index = VectorStoreIndex.from_documents(documents = docs, index_id = index_name)
-		return index
-
-	def load_index(self, index_id = None, with_llm=False):
+		index = None
+		if checkpoint != None and checkpoint.snapshot() != None:
+			index = self.load_index(index_id = index_name, persist_dir = checkpoint.snapshot())
+			if index == None:
+				raise Exception(f"{self.__class__}: Could not load the checkpoint snapshot {checkpoint.snapshot()}; run again without --resume.")
+		if index == None:
+			index = VectorStoreIndex(nodes = [], embed_model = self.get_embed_model())
+			index.set_index_id(index_name)
+		# the default chunking from_documents applied, with ids that do not change between runs
+		parser = SentenceSplitter(id_func = node_id)
+		return self.insert_batches(index, docs, parser.get_nodes_from_documents, checkpoint = checkpoint)
+
+	def load_index(self, index_id = None, with_llm=False, persist_dir = None):
 		index = None
 		try:
-			storage_context = StorageContext.from_defaults(persist_dir=self.persist_dir)
+			storage_context = StorageContext.from_defaults(persist_dir=persist_dir or self.persist_dir)
 			if index_id == None:
-				index = load_index_from_storage(storage_context)
+				index = load_index_from_storage(storage_context, embed_model = self.get_embed_model())
 			else:
-				index = load_index_from_storage(storage_context, index_id = index_id)
+				index = load_index_from_storage(storage_context, index_id = index_id, embed_model = self.get_embed_model())
 		except Exception as e:
 			print(f"COULDN'T LOAD ({e})")
 			index = None
@@ -111,16 +143,9 @@ class TafiSimpleVectorStore(TafiVectorStore):
 class TafiPGVectorStore(TafiVectorStore):
 	index_type = "pgvector"
 	def get_vector_store(self, index_name):
+		from utils import pg_pool
 		os.environ["PGVECTOR_VECTOR_SIZE"] = "384"
-		vector_store = PGVectorStore.from_params(
-			database=os.environ["PG_DB_DBASE"],
-			host=os.environ["PG_DB_HOST"],
-			password=os.environ["PG_DB_PASS"],
-			port=5432,
-			user=os.environ["PG_DB_USER"],
-			table_name=index_name,
-			embed_dim=384
-		)
+		vector_store = pg_pool.get_vector_store(index_name, embed_dim=384)
 		logger.info("postgres vector store loaded")
 		return vector_store
 
@@ -131,6 +156,9 @@ class TafiPGVectorStore(TafiVectorStore):
 class TafiRedisVectorStore(TafiVectorStore):
 	index_type = "redis"
 	def get_vector_store(self, index_name, metadata_fields):
+		from langchain_community.vectorstores import redis
+		from llama_index.vector_stores.redis import RedisVectorStore
+		redis._check_redis_module_exist = lambda *args: True
 		redis_endpoint = os.getenv("REDIS_ENDPOINT", "redis://34.70.63.211:6379")
 		logger.info(f"Using redis endpoint: {redis_endpoint}")
 		vector_store = RedisVectorStore(index_name=index_name, index_prefix=index_name,
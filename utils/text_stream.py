@@ -0,0 +1,122 @@
+import os
+import mmap
+import codecs
+
+BLOCK_SIZE = 1 << 20
+SAMPLE_SIZE = 64 * 1024
+FALLBACK_ENCODING = "cp1252"
+# longest BOM first: the UTF-32-LE BOM starts with the UTF-16-LE one
+BOMS = [(codecs.BOM_UTF32_LE, "utf-32"), (codecs.BOM_UTF32_BE, "utf-32"), (codecs.BOM_UTF8, "utf-8-sig"),
+	(codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16")]
+# UTF-8 decoding error handler: only the bytes that are not UTF-8 are read as FALLBACK_ENCODING
+STRAY_BYTES = "ragtime_stray_bytes"
+UTF8 = ["utf-8", "utf-8-sig"]
+
+
+def stray_bytes(exc):
+	# most likely Windows-1252 pasted into UTF-8 or ASCII text; what decodes as UTF-8 stays UTF-8
+	return exc.object[exc.start:exc.end].decode(FALLBACK_ENCODING, errors = "replace"), exc.end
+
+
+codecs.register_error(STRAY_BYTES, stray_bytes)
+
+
+def errors_for(encoding):
+	return STRAY_BYTES if codecs.lookup(encoding).name in UTF8 else "replace"
+
+
+def detect_encoding(sample):
+	"""Encoding of text starting with the bytes in sample: its BOM, else UTF-8 if the sample is valid UTF-8, else a guess from the bytes."""
+	for bom, encoding in BOMS:
+		if sample.startswith(bom):
+			return encoding
+	try:
+		# final = False: a character cut off at the end of the sample is not an error
+		codecs.getincrementaldecoder("utf-8")().decode(sample, final = False)
+		return "utf-8"
+	except UnicodeDecodeError:
+		pass
+	return guess_encoding(sample)
+
+
+def guess_encoding(sample):
+	try:
+		# installed with requests
+		from charset_normalizer import from_bytes
+		best = from_bytes(sample).best()
+		if best != None and best.encoding not in ["utf_8", "ascii"]:
+			return best.encoding
+	except ImportError:
+		pass
+	return FALLBACK_ENCODING
+
+
+def decode(data):
+	"""All of data as text, in its detected encoding (stray bytes in UTF-8 are read as FALLBACK_ENCODING, others replaced)."""
+	encoding = detect_encoding(data[:SAMPLE_SIZE])
+	return data.decode(encoding, errors = errors_for(encoding))
+
+
+def blocks(path, block_size = BLOCK_SIZE):
+	"""Yields the bytes of a file block by block from a read-only memory map, so the page cache is the only copy."""
+	with open(path, "rb") as fin:
+		if os.fstat(fin.fileno()).st_size == 0:
+			return
+		with mmap.mmap(fin.fileno(), 0, access = mmap.ACCESS_READ) as mm:
+			advise = hasattr(mm, "madvise") and hasattr(mmap, "MADV_DONTNEED")
+			if advise:
+				mm.madvise(mmap.MADV_SEQUENTIAL)
+			for i in range(0, len(mm), block_size):
+				block = mm[i:i + block_size]
+				if advise and i % mmap.PAGESIZE == 0:
+					# the block is a copy, so its pages can leave this process (they stay in the page cache)
+					mm.madvise(mmap.MADV_DONTNEED, i, len(block))
+				yield block
+
+
+def iter_lines(path, encoding = None, block_size = BLOCK_SIZE, max_line = BLOCK_SIZE):
+	"""Yields the lines of a text file of any size (without their "\\n"), holding about one block in memory.
+
+	The encoding is detected from the first SAMPLE_SIZE bytes unless given.
+	If a UTF-8 file turns out to have bytes that are not UTF-8 further on,
+	just those bytes are decoded as FALLBACK_ENCODING instead of failing.
+	Lines longer than max_line characters are split, at a space if there
+	is one.
+	"""
+	if encoding == None:
+		with open(path, "rb") as fin:
+			encoding = detect_encoding(fin.read(SAMPLE_SIZE))
+	decoder = codecs.getincrementaldecoder(encoding)(errors = errors_for(encoding))
+	pending = ""
+	for block in blocks(path, block_size):
+		text = decoder.decode(block)
+		lines = (pending + text).split("\n")
+		pending = lines.pop()
+		yield from lines
+		while len(pending) > max_line:
+			cut = pending.rfind(" ", 0, max_line)
+			cut = cut + 1 if cut > 0 else max_line
+			yield pending[:cut]
+			pending = pending[cut:]
+	pending += decoder.decode(b"", final = True)
+	if len(pending) > 0:
+		yield pending
+
+
+def sections(lines, max_chars = 8192):
+	"""Yields ("part_N", lines) groups of the non-blank lines, each about max_chars long."""
+	part = []
+	size = 0
+	n = 0
+	for line in lines:
+		if len(line.strip()) == 0:
+			continue
+		part.append(line)
+		size += len(line) + 1
+		if size >= max_chars:
+			yield f"part_{n}", part
+			part = []
+			size = 0
+			n += 1
+	if len(part) > 0:
+		yield f"part_{n}", part